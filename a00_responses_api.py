@@ -6,9 +6,10 @@
 # --------------------------------------------------
 import os
 import sys
+import io
 import json
 import base64
-import glob
+import hashlib
 import logging
 from datetime import datetime
 import time
@@ -17,11 +18,9 @@ from typing import Optional, List, Dict, Any, Literal
 from pathlib import Path
 
 import streamlit as st
-import pandas as pd
-import requests
 from pydantic import BaseModel, ValidationError
 
-from openai import OpenAI
+from openai import OpenAI, NotFoundError, BadRequestError
 from openai.types.responses import (
     EasyInputMessageParam,
     ResponseInputTextParam,
@@ -47,14 +46,16 @@ try:
     from helper_st import (
         UIHelper, MessageManagerUI, ResponseProcessorUI,
         SessionStateManager, error_handler_ui, timer_ui,
-        InfoPanelManager, safe_streamlit_json
+        InfoPanelManager, safe_streamlit_json, DemoRegistry
     )
     from helper_api import (
         config, logger, TokenManager, OpenAIClient,
         EasyInputMessageParam, ResponseInputTextParam,
         ConfigManager, MessageManager, sanitize_key,
         error_handler, timer, get_default_messages,
-        ResponseProcessor, format_timestamp
+        ResponseProcessor, format_timestamp, model_registry,
+        lazy_import, startup_profiler, ImagePreprocessor, PreparedImage,
+        image_index, CityTable, get_city_table, WeatherFetch, weather_client
     )
 except ImportError as e:
     st.error(f"ヘルパーモジュールのインポートに失敗しました: {e}")
@@ -160,23 +161,12 @@ class BaseDemo(ABC):
                                     config.get("models.default", "gpt-4o-mini"))
 
     def is_reasoning_model(self, model: str = None) -> bool:
-        """推論系モデルかどうかを判定（統一化）"""
+        """推論系モデルかどうかを判定（統一化・model_registryで事前計算済み）"""
         if model is None:
             model = self.get_model()
 
-        # config.ymlから取得、フォールバックあり
-        reasoning_models = config.get("models.categories.reasoning",
-                                      ["o1", "o1-mini", "o3", "o3-mini", "o4", "o4-mini"])
-        
-        # GPT-5系モデルも推論系として扱う（temperatureサポートなし）
-        frontier_models = config.get("models.categories.frontier",
-                                    ["gpt-5", "gpt-5-mini", "gpt-5-nano"])
-
-        # モデル名に推論系モデルの識別子が含まれているかチェック
-        reasoning_indicators = ["o1", "o3", "o4", "gpt-5"]
-        return any(indicator in model.lower() for indicator in reasoning_indicators) or \
-            any(reasoning_model in model for reasoning_model in reasoning_models) or \
-            any(frontier_model in model for frontier_model in frontier_models)
+        # o1/o3/o4系・GPT-5系（temperatureサポートなし）を含む
+        return model_registry.is_reasoning(model)
 
     def create_temperature_control(self, default_temp: float = 0.3, help_text: str = None) -> Optional[float]:
         """Temperatureコントロールを作成（統一化・推論系モデル・GPT-5系では無効化）"""
@@ -357,12 +347,6 @@ class TextResponseDemo(BaseDemo):
                 st.write(f"**ID**: {response_id[:8]}..." if len(str(response_id)) > 8 else f"**ID**: {response_id}")
 
 
-# ==================================================
-# 必要なインポートの追加（エラー修正）
-# ==================================================
-import pandas as pd
-from openai.types.responses import Response
-
 # ==================================================
 # メモリ応答デモ（改修版・エラー修正版）- 連続会話対応
 # ==================================================
@@ -373,6 +357,10 @@ class MemoryResponseDemo(BaseDemo):
         super().__init__(demo_name)
         # 会話ステップの管理
         self.conversation_steps = []
+        # ステップ追加時に更新する累積統計
+        self.conversation_stats = {}
+        # ステップ間で共有するベースメッセージ（system/developer等）: {base_id: messages}
+        self.message_bases = {}
         self._initialize_conversation_state()
 
     def _initialize_conversation_state(self):
@@ -380,8 +368,112 @@ class MemoryResponseDemo(BaseDemo):
         session_key = f"conversation_steps_{self.safe_key}"
         if session_key not in st.session_state:
             st.session_state[session_key] = []
+        bases_key = f"conversation_bases_{self.safe_key}"
+        if bases_key not in st.session_state:
+            st.session_state[bases_key] = {}
+        stats_key = f"conversation_stats_{self.safe_key}"
+        if stats_key not in st.session_state:
+            st.session_state[stats_key] = self._empty_statistics()
 
         self.conversation_steps = st.session_state[session_key]
+        self.message_bases = st.session_state[bases_key]
+        self.conversation_stats = st.session_state[stats_key]
+        if not isinstance(self.conversation_stats, dict):
+            self.conversation_stats = self._empty_statistics()
+
+    # ==================================================
+    # ステップ差分保存（messages_at_step の再構築）
+    # ==================================================
+    # 各ステップは送信メッセージ全体を複製せず、ベースメッセージのIDと
+    # 履歴の開始ステップ位置（context）だけを保持する。
+    # user/assistant のペアは conversation_steps 自体が共有ログとなる。
+
+    def _register_base(self, messages) -> str:
+        """ベースメッセージを登録してIDを返す（同一内容は共有）"""
+        base = [dict(msg) for msg in messages]
+        payload = json.dumps(base, ensure_ascii=False, sort_keys=True, default=str)
+        base_id = hashlib.md5(payload.encode("utf-8")).hexdigest()[:12]
+        self.message_bases.setdefault(base_id, base)
+        return base_id
+
+    def get_step_messages(self, index: int) -> List[Dict[str, Any]]:
+        """ステップ index（0始まり）の送信時点のメッセージ履歴を再構築"""
+        step = self.conversation_steps[index]
+        # 旧形式（全メッセージ保持）のステップはそのまま返す
+        if 'messages_at_step' in step:
+            return step['messages_at_step']
+
+        context = step.get('context') or {}
+        messages = [dict(msg) for msg in self.message_bases.get(context.get('base'), [])]
+        for prev in self.conversation_steps[context.get('from', 0):index]:
+            messages.append({"role": "user", "content": prev['user_input']})
+            messages.append({"role": "assistant", "content": prev['assistant_response']})
+        messages.append({"role": "user", "content": step['user_input']})
+        return messages
+
+    def _normalize_imported_steps(self, data: Dict[str, Any], offset: int) -> List[Dict[str, Any]]:
+        """インポートしたステップを差分形式に揃える（旧形式も受け付ける）"""
+        base_map = {
+            old_id: self._register_base(messages)
+            for old_id, messages in (data.get("message_bases") or {}).items()
+        }
+
+        steps = []
+        for raw in data["conversation_steps"]:
+            if self._validate_step_record(raw) is None:
+                steps.append(self._normalize_imported_step(raw, base_map, steps, offset))
+        return steps
+
+    def _normalize_imported_step(self, raw: Dict[str, Any], base_map: Dict[str, str],
+                                 previous: List[Dict[str, Any]], offset: int) -> Dict[str, Any]:
+        """インポートしたステップ1件を差分形式に揃える"""
+        step = dict(raw)
+        if 'context' in step:
+            context = step['context'] or {}
+            step['context'] = {
+                'base': base_map.get(context.get('base'), context.get('base')),
+                'from': context.get('from', 0) + offset,
+            }
+        elif 'messages_at_step' in step:
+            context = self._legacy_step_context(step, previous, offset)
+            if context is not None:
+                del step['messages_at_step']
+                step['context'] = context
+        return step
+
+    @staticmethod
+    def _validate_step_record(record: Any) -> Optional[str]:
+        """ステップレコードの検証（問題があれば理由を返す）"""
+        if not isinstance(record, dict):
+            return "ステップがオブジェクトではありません"
+        for field in ('user_input', 'assistant_response'):
+            if not isinstance(record.get(field), str):
+                return f"{field} がありません"
+        if 'context' in record and not isinstance(record['context'], dict):
+            return "context の形式が不正です"
+        if 'messages_at_step' in record and not isinstance(record['messages_at_step'], list):
+            return "messages_at_step の形式が不正です"
+        return None
+
+    def _legacy_step_context(self, step: Dict[str, Any], previous: List[Dict[str, Any]],
+                             offset: int) -> Optional[Dict[str, Any]]:
+        """旧形式の messages_at_step を差分表現に変換（履歴と一致しなければNone）"""
+        messages_at_step = step['messages_at_step']
+        expected = []
+        for prev in previous:
+            expected.append(("user", prev.get('user_input')))
+            expected.append(("assistant", prev.get('assistant_response')))
+        expected.append(("user", step.get('user_input')))
+
+        tail_length = len(expected)
+        if len(messages_at_step) < tail_length:
+            return None
+        tail = [(msg.get('role'), msg.get('content')) for msg in messages_at_step[-tail_length:]]
+        if tail != expected:
+            return None
+
+        base_id = self._register_base(messages_at_step[:-tail_length])
+        return {'base': base_id, 'from': offset}
 
     @error_handler_ui
     @timer_ui
@@ -449,8 +541,13 @@ class MemoryResponseDemo(BaseDemo):
                 latest_time = latest_step.get('timestamp', 'N/A')
                 st.metric("最新質問時刻", latest_time[-8:] if len(latest_time) > 8 else latest_time)  # 時刻部分のみ表示
 
-        # 各会話ステップの表示
-        for i, step in enumerate(self.conversation_steps, 1):
+        # 各会話ステップの表示（直近ページのみ描画し、古いステップは要求時に展開）
+        start = UIHelper.paginate_window(
+            len(self.conversation_steps),
+            key=f"steps_{self.safe_key}",
+            page_size=config.get("ui.conversation_page_size", 10)
+        )
+        for i, step in enumerate(self.conversation_steps[start:], start + 1):
             with st.expander(
                     f"🔄 ステップ {i}: {step['user_input'][:50]}{'...' if len(step['user_input']) > 50 else ''}",
                     expanded=(i == len(self.conversation_steps))):
@@ -468,6 +565,17 @@ class MemoryResponseDemo(BaseDemo):
                         st.write(f"出力: {usage.get('completion_tokens', 0)}")
                         st.write(f"合計: {usage.get('total_tokens', 0)}")
 
+                # 送信方式と全履歴送信との比較
+                transport = step.get('transport')
+                if transport:
+                    saved_bytes = transport['replay_bytes'] - transport['sent_bytes']
+                    saved_tokens = transport['replay_tokens'] - transport['sent_tokens']
+                    mode_label = "🔗 previous_response_id" if transport['mode'] == "chain" else "📚 全履歴送信"
+                    st.caption(
+                        f"{mode_label}: 送信 {transport['sent_bytes']:,} bytes / {transport['sent_tokens']:,} tokens"
+                        f"（全履歴送信比 -{saved_bytes:,} bytes / -{saved_tokens:,} tokens）"
+                    )
+
                 # ユーザーの質問
                 st.write("**👤 ユーザーの質問:**")
                 st.markdown(f"> {step['user_input']}")
@@ -480,7 +588,7 @@ class MemoryResponseDemo(BaseDemo):
                 # この時点でのメッセージ履歴
                 if st.checkbox(f"メッセージ履歴を表示 (ステップ {i})", key=f"show_messages_{i}_{self.safe_key}"):
                     st.write("**📋 この時点でのメッセージ履歴:**")
-                    messages = step.get('messages_at_step', [])
+                    messages = self.get_step_messages(i - 1)
                     for j, msg in enumerate(messages):
                         role = msg.get('role', 'unknown')
                         content = msg.get('content', '')
@@ -545,6 +653,13 @@ class MemoryResponseDemo(BaseDemo):
         # ユーザー入力の同期
         st.session_state[input_key] = user_input
 
+        # 会話状態の送信方式
+        st.toggle(
+            "🔗 サーバー側会話状態（previous_response_id で新しい質問のみ送信）",
+            key=f"chain_mode_{self.safe_key}",
+            help="オフ: 毎回デフォルトプロンプトと全履歴を送信 / オン: 直前のResponse IDを指定して新しい質問のみ送信"
+        )
+
         # Temperature設定
         col1, col2 = st.columns([2, 1])
         with col1:
@@ -626,12 +741,24 @@ class MemoryResponseDemo(BaseDemo):
         # トークン情報の表示
         UIHelper.show_token_info(user_input, self.model, position="sidebar")
 
-        # メッセージ履歴の構築
-        messages = self._build_conversation_messages(user_input)
+        # メッセージ履歴の構築（全履歴送信時の内容。比較・記録用にも使用）
+        base_messages = get_default_messages()
+        messages = self._build_conversation_messages(user_input, base_messages)
+        sent_messages = messages
 
-        # APIコール
+        # APIコール（サーバー側会話状態モードでは新しい質問のみ送信）
         with st.spinner("🤖 AIが思考中..."):
-            response = self.call_api_unified(messages, temperature=temperature)
+            response = None
+            previous_response_id = self._get_chain_response_id()
+            if previous_response_id:
+                sent_messages = [EasyInputMessageParam(role="user", content=user_input)]
+                response = self._call_api_chained(sent_messages, previous_response_id, temperature)
+                if response is None:
+                    # チェーン切れ・期限切れ: 全履歴送信にフォールバック
+                    st.warning("⚠️ 前回のレスポンスを参照できないため、全履歴を送信して再実行します")
+                    sent_messages = messages
+            if response is None:
+                response = self.call_api_unified(messages, temperature=temperature)
 
         # レスポンスからテキストを抽出
         assistant_texts = ResponseProcessor.extract_text(response)
@@ -644,15 +771,18 @@ class MemoryResponseDemo(BaseDemo):
             'model'             : self.model,
             'user_input'        : user_input,
             'assistant_response': assistant_response,
-            'messages_at_step'  : [dict(msg) for msg in messages],  # EasyInputMessageParamを辞書に変換
+            'context'           : {'base': self._register_base(base_messages), 'from': 0},
             'temperature'       : temperature,
             'usage'             : self._extract_usage_info(response),
-            'total_tokens'      : self._calculate_total_tokens(response)
+            'total_tokens'      : self._calculate_total_tokens(response),
+            'response_id'       : getattr(response, 'id', None),
+            'transport'         : self._measure_transport(sent_messages, messages),
         }
 
         # セッション状態に保存
         self.conversation_steps.append(step_data)
         st.session_state[f"conversation_steps_{self.safe_key}"] = self.conversation_steps
+        self._accumulate_statistics(step_data)
 
         # 成功メッセージと即座の表示更新
         st.success(f"✅ ステップ {step_data['step_number']} の応答を取得しました")
@@ -664,10 +794,12 @@ class MemoryResponseDemo(BaseDemo):
         # フォームの再描画（入力フィールドがクリアされる）
         st.rerun()
 
-    def _build_conversation_messages(self, new_user_input: str) -> List[EasyInputMessageParam]:
+    def _build_conversation_messages(self, new_user_input: str,
+                                     base_messages: Optional[List[EasyInputMessageParam]] = None
+                                     ) -> List[EasyInputMessageParam]:
         """会話履歴を基にメッセージリストを構築"""
         # デフォルトメッセージから開始
-        messages = get_default_messages()
+        messages = list(base_messages) if base_messages is not None else get_default_messages()
 
         # 過去の会話ステップを追加
         for step in self.conversation_steps:
@@ -679,6 +811,53 @@ class MemoryResponseDemo(BaseDemo):
 
         return messages
 
+    def _get_chain_response_id(self) -> Optional[str]:
+        """サーバー側会話状態モードで参照する直前のResponse ID（使えない場合はNone）"""
+        if not st.session_state.get(f"chain_mode_{self.safe_key}", False):
+            return None
+        if not self.conversation_steps:
+            return None
+        # インポートした旧形式の履歴などIDを持たない場合は全履歴送信
+        return self.conversation_steps[-1].get('response_id')
+
+    def _call_api_chained(self, messages: List[EasyInputMessageParam], previous_response_id: str,
+                          temperature: Optional[float]) -> Optional[Response]:
+        """previous_response_id 付きのAPI呼び出し（チェーンを参照できない場合はNone）"""
+        model = self.get_model()
+        api_params = {
+            "input"               : messages,
+            "model"               : model,
+            "previous_response_id": previous_response_id,
+        }
+        if not self.is_reasoning_model(model) and temperature is not None:
+            api_params["temperature"] = temperature
+
+        try:
+            return self.client.create_response(**api_params)
+        except (NotFoundError, BadRequestError) as e:
+            logger.warning(f"previous_response_id が参照できません（全履歴送信にフォールバック）: {e}")
+            return None
+
+    def _measure_transport(self, sent_messages: List[EasyInputMessageParam],
+                           replay_messages: List[EasyInputMessageParam]) -> Dict[str, Any]:
+        """送信したリクエストと全履歴送信時のサイズ（バイト数・入力トークン数）の比較"""
+        def footprint(msgs: List[EasyInputMessageParam]) -> Dict[str, int]:
+            text = "\n".join(str(msg.get('content', '')) for msg in msgs)
+            return {
+                "bytes" : len(json.dumps([dict(msg) for msg in msgs], ensure_ascii=False).encode("utf-8")),
+                "tokens": TokenManager.count_tokens(text, self.model),
+            }
+
+        sent = footprint(sent_messages)
+        replay = sent if sent_messages is replay_messages else footprint(replay_messages)
+        return {
+            "mode"         : "replay" if sent_messages is replay_messages else "chain",
+            "sent_bytes"   : sent["bytes"],
+            "sent_tokens"  : sent["tokens"],
+            "replay_bytes" : replay["bytes"],
+            "replay_tokens": replay["tokens"],
+        }
+
     def _extract_usage_info(self, response: Response) -> Dict[str, Any]:
         """レスポンスから使用量情報を抽出"""
         try:
@@ -716,7 +895,10 @@ class MemoryResponseDemo(BaseDemo):
         with col1:
             if st.button("🗑️ 会話履歴クリア", key=f"clear_conv_{self.safe_key}"):
                 self.conversation_steps.clear()
+                self.message_bases.clear()
                 st.session_state[f"conversation_steps_{self.safe_key}"] = []
+                st.session_state[f"conversation_bases_{self.safe_key}"] = {}
+                self._rebuild_statistics()
                 st.success("会話履歴をクリアしました")
                 st.rerun()
 
@@ -727,7 +909,7 @@ class MemoryResponseDemo(BaseDemo):
         with col3:
             uploaded_file = st.file_uploader(
                 "📤 会話履歴インポート",
-                type=['json'],
+                type=['ndjson', 'jsonl', 'json'],
                 key=f"import_conv_{self.safe_key}",
                 help="過去にエクスポートした会話履歴をインポート"
             )
@@ -738,126 +920,302 @@ class MemoryResponseDemo(BaseDemo):
             if self.conversation_steps and st.button("📊 会話統計", key=f"stats_conv_{self.safe_key}"):
                 self._show_conversation_statistics()
 
+    # ==================================================
+    # エクスポート / インポート（NDJSON: ヘッダー + ベース + ステップ1件1行）
+    # ==================================================
+    NDJSON_FORMAT = "memory_response_conversation"
+    NDJSON_FORMAT_VERSION = 3
+
+    def _iter_export_records(self):
+        """エクスポート用レコードを1件ずつ生成"""
+        yield {
+            "type"          : "header",
+            "format"        : self.NDJSON_FORMAT,
+            "format_version": self.NDJSON_FORMAT_VERSION,
+            "timestamp"     : format_timestamp(),
+            "total_steps"   : len(self.conversation_steps),
+            "model_used"    : self.model,
+            "demo_version"  : "MemoryResponseDemo_v2.0",
+        }
+        # 各ステップが参照するベースメッセージ（ステップ側は差分のみ）
+        referenced = {(step.get('context') or {}).get('base') for step in self.conversation_steps}
+        for base_id, messages in self.message_bases.items():
+            if base_id in referenced:
+                yield {"type": "base", "id": base_id, "messages": messages}
+        for step in self.conversation_steps:
+            yield {"type": "step", **step}
+
+    def _serialize_conversation(self) -> bytes:
+        """会話履歴をNDJSONへ1レコードずつ書き出す"""
+        buffer = io.BytesIO()
+        for record in self._iter_export_records():
+            buffer.write(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8"))
+            buffer.write(b"\n")
+        return buffer.getvalue()
+
     def _export_conversation(self):
         """会話履歴のエクスポート"""
         if not self.conversation_steps:
             st.warning("エクスポートする会話履歴がありません")
             return
 
-        export_data = {
-            "export_info"       : {
-                "timestamp"   : format_timestamp(),
-                "total_steps" : len(self.conversation_steps),
-                "model_used"  : self.model,
-                "demo_version": "MemoryResponseDemo_v2.0"
-            },
-            "conversation_steps": self.conversation_steps
-        }
-
         try:
+            # ボタン押下時のみ描画されるため、その場でNDJSONへ書き出す
             UIHelper.create_download_button(
-                export_data,
-                f"conversation_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                "application/json",
-                "📥 会話履歴JSONダウンロード"
+                self._serialize_conversation(),
+                f"conversation_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson",
+                "application/x-ndjson",
+                "📥 会話履歴NDJSONダウンロード"
             )
         except Exception as e:
             st.error(f"エクスポートエラー: {e}")
 
+    @classmethod
+    def _read_import_header(cls, uploaded_file) -> Optional[Dict[str, Any]]:
+        """先頭行のみを読み、NDJSONのヘッダーを返す（旧形式JSONならNone）"""
+        uploaded_file.seek(0)
+        first_line = uploaded_file.readline()
+        uploaded_file.seek(0)
+        try:
+            record = json.loads(first_line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None
+        if isinstance(record, dict) and record.get("type") == "header" \
+                and record.get("format") == cls.NDJSON_FORMAT:
+            return record
+        return None
+
+    def _iter_import_steps(self, uploaded_file, offset: int, errors: List[str]):
+        """NDJSONを1行ずつ検証し、差分形式のステップを順に返す"""
+        uploaded_file.seek(0)
+        base_map = {}
+        previous = []
+        for line_number, line in enumerate(uploaded_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                errors.append(f"{line_number}行目: JSON解析エラー ({e})")
+                continue
+
+            record_type = record.get("type") if isinstance(record, dict) else None
+            if record_type == "header":
+                continue
+            if record_type == "base":
+                if not isinstance(record.get("id"), str) or not isinstance(record.get("messages"), list):
+                    errors.append(f"{line_number}行目: ベースメッセージの形式が不正です")
+                    continue
+                base_map[record["id"]] = self._register_base(record["messages"])
+            elif record_type == "step":
+                step = {key: value for key, value in record.items() if key != "type"}
+                problem = self._validate_step_record(step)
+                if problem:
+                    errors.append(f"{line_number}行目: {problem}")
+                    continue
+                step = self._normalize_imported_step(step, base_map, previous, offset)
+                previous.append(step)
+                yield step
+            else:
+                errors.append(f"{line_number}行目: 不明なレコード種別 {record_type!r}")
+
+    def _load_import_steps(self, uploaded_file, header: Optional[Dict[str, Any]], offset: int,
+                           errors: List[str]) -> List[Dict[str, Any]]:
+        """アップロードファイルからステップを読み込む（NDJSON / 旧形式JSON）"""
+        if header is not None:
+            return list(self._iter_import_steps(uploaded_file, offset, errors))
+
+        # 旧形式: 単一のJSONドキュメント
+        uploaded_file.seek(0)
+        data = json.load(uploaded_file)
+        if not isinstance(data, dict) or not isinstance(data.get("conversation_steps"), list):
+            errors.append("有効な会話履歴データが見つかりません")
+            return []
+        for index, raw in enumerate(data["conversation_steps"], start=1):
+            problem = self._validate_step_record(raw)
+            if problem:
+                errors.append(f"ステップ{index}: {problem}")
+        return self._normalize_imported_steps(data, offset)
+
     def _import_conversation(self, uploaded_file):
         """会話履歴のインポート"""
         try:
-            content = uploaded_file.read()
-            data = json.loads(content)
-
-            if "conversation_steps" in data:
-                imported_steps = data["conversation_steps"]
-
-                # 現在の履歴に追加 or 置換
-                replace_option = st.radio(
-                    "インポート方法",
-                    ["現在の履歴に追加", "現在の履歴を置換"],
-                    key=f"import_option_{self.safe_key}"
-                )
+            # 再実行ごとにはヘッダー行のみ確認し、本体は実行時に逐次読み込む
+            header = self._read_import_header(uploaded_file)
+            if header is not None:
+                st.caption(f"NDJSON形式: {header.get('total_steps', '?')}ステップ "
+                           f"({header.get('timestamp', '-')} エクスポート)")
+            else:
+                st.caption("旧形式（JSON）の会話履歴")
 
-                if st.button("インポート実行", key=f"execute_import_{self.safe_key}"):
-                    if replace_option == "現在の履歴を置換":
-                        self.conversation_steps = imported_steps
-                    else:
-                        self.conversation_steps.extend(imported_steps)
+            # 現在の履歴に追加 or 置換
+            replace_option = st.radio(
+                "インポート方法",
+                ["現在の履歴に追加", "現在の履歴を置換"],
+                key=f"import_option_{self.safe_key}"
+            )
 
-                    st.session_state[f"conversation_steps_{self.safe_key}"] = self.conversation_steps
-                    st.success(f"{len(imported_steps)}ステップの会話履歴をインポートしました")
-                    st.rerun()
-            else:
-                st.error("有効な会話履歴データが見つかりません")
+            if st.button("インポート実行", key=f"execute_import_{self.safe_key}"):
+                replace = replace_option == "現在の履歴を置換"
+                previous_bases = self.message_bases
+                if replace:
+                    self.message_bases = {}
+                offset = 0 if replace else len(self.conversation_steps)
+
+                errors = []
+                imported_steps = self._load_import_steps(uploaded_file, header, offset, errors)
+                if not imported_steps:
+                    self.message_bases = previous_bases
+                    st.error("有効な会話履歴データが見つかりません")
+                    for error in errors[:10]:
+                        st.caption(error)
+                    return
+
+                if replace:
+                    self.conversation_steps = imported_steps
+                else:
+                    self.conversation_steps.extend(imported_steps)
+
+                st.session_state[f"conversation_steps_{self.safe_key}"] = self.conversation_steps
+                st.session_state[f"conversation_bases_{self.safe_key}"] = self.message_bases
+                self._rebuild_statistics()
+                st.success(f"{len(imported_steps)}ステップの会話履歴をインポートしました")
+                if errors:
+                    # 読み飛ばしたレコードを確認できるよう再実行しない
+                    st.warning(f"⚠️ {len(errors)}件のレコードを読み飛ばしました")
+                    for error in errors[:10]:
+                        st.caption(error)
+                    return
+                st.rerun()
 
         except Exception as e:
             st.error(f"インポートエラー: {e}")
             logger.error(f"Conversation import error: {e}")
 
+    # ==================================================
+    # 累積統計（ステップ追加ごとに更新）
+    # ==================================================
+    @staticmethod
+    def _empty_statistics() -> Dict[str, Any]:
+        """累積統計の初期値"""
+        return {
+            'steps'           : 0,
+            'user_chars'      : 0,
+            'assistant_chars' : 0,
+            'input_tokens'    : 0,
+            'output_tokens'   : 0,
+            'cached_tokens'   : 0,
+            'reasoning_tokens': 0,
+            'total_tokens'    : 0,
+            'cost'            : 0.0,
+            'cost_by_model'   : {},
+            'min_question'    : None,
+            'max_question'    : 0,
+            'step_tokens'     : [],
+        }
+
+    @staticmethod
+    def _usage_breakdown(step: Dict[str, Any]) -> Dict[str, int]:
+        """ステップのusageから入力/出力/キャッシュ/推論トークンを取り出す"""
+        usage = step.get('usage') or {}
+        input_details = usage.get('input_tokens_details') or {}
+        output_details = usage.get('output_tokens_details') or {}
+        input_tokens = usage.get('input_tokens', usage.get('prompt_tokens', 0)) or 0
+        output_tokens = usage.get('output_tokens', usage.get('completion_tokens', 0)) or 0
+        return {
+            'input_tokens'    : input_tokens,
+            'output_tokens'   : output_tokens,
+            'cached_tokens'   : input_details.get('cached_tokens', 0) or 0,
+            'reasoning_tokens': output_details.get('reasoning_tokens', 0) or 0,
+            'total_tokens'    : step.get('total_tokens') or usage.get('total_tokens') or input_tokens + output_tokens,
+        }
+
+    def _accumulate_statistics(self, step: Dict[str, Any]):
+        """追加されたステップ1件分を累積統計に反映"""
+        if self.conversation_stats.get('steps') != len(self.conversation_steps) - 1:
+            # 統計と履歴がずれている場合（旧セッション等）は一度だけ再集計
+            self._rebuild_statistics()
+            return
+        self._add_step_statistics(self.conversation_stats, step)
+
+    def _add_step_statistics(self, stats: Dict[str, Any], step: Dict[str, Any]):
+        """ステップ1件分の値を統計に加算"""
+        breakdown = self._usage_breakdown(step)
+        model = step.get('model') or self.model
+        cost = TokenManager.estimate_cost(breakdown['input_tokens'], breakdown['output_tokens'], model)
+        question_length = len(step.get('user_input', ''))
+
+        stats['steps'] += 1
+        stats['user_chars'] += question_length
+        stats['assistant_chars'] += len(step.get('assistant_response', ''))
+        for name, value in breakdown.items():
+            stats[name] += value
+        stats['cost'] += cost
+        stats['cost_by_model'][model] = stats['cost_by_model'].get(model, 0.0) + cost
+        stats['min_question'] = question_length if stats['min_question'] is None else min(stats['min_question'], question_length)
+        stats['max_question'] = max(stats['max_question'], question_length)
+        stats['step_tokens'].append(breakdown['total_tokens'])
+
+    def _rebuild_statistics(self):
+        """履歴全体から累積統計を作り直す（クリア・インポート時）"""
+        self.conversation_stats = self._empty_statistics()
+        st.session_state[f"conversation_stats_{self.safe_key}"] = self.conversation_stats
+        for step in self.conversation_steps:
+            self._add_step_statistics(self.conversation_stats, step)
+
     def _show_conversation_statistics(self):
-        """会話統計の表示"""
+        """会話統計の表示（累積統計を参照するのみ）"""
         if not self.conversation_steps:
             return
+        if self.conversation_stats.get('steps') != len(self.conversation_steps):
+            self._rebuild_statistics()
+        stats = self.conversation_stats
 
         with st.expander("📊 詳細統計", expanded=True):
             # 基本統計
-            total_steps = len(self.conversation_steps)
-            total_user_chars = sum(len(step['user_input']) for step in self.conversation_steps)
-            total_assistant_chars = sum(len(step['assistant_response']) for step in self.conversation_steps)
-            total_tokens = sum(step.get('total_tokens', 0) for step in self.conversation_steps)
+            total_steps = stats['steps']
 
             col1, col2 = st.columns(2)
             with col1:
                 st.metric("総会話ステップ", total_steps)
-                st.metric("ユーザー入力文字数", f"{total_user_chars:,}")
-                st.metric("AI応答文字数", f"{total_assistant_chars:,}")
+                st.metric("ユーザー入力文字数", f"{stats['user_chars']:,}")
+                st.metric("AI応答文字数", f"{stats['assistant_chars']:,}")
             with col2:
-                st.metric("総トークン数", f"{total_tokens:,}")
+                st.metric("総トークン数", f"{stats['total_tokens']:,}")
                 if total_steps > 0:
-                    avg_tokens = total_tokens / total_steps
-                    st.metric("平均トークン/ステップ", f"{avg_tokens:.1f}")
-
-                # コスト推定
-                try:
-                    estimated_cost = TokenManager.estimate_cost(
-                        total_tokens // 2,  # 概算で半分を入力トークンと仮定
-                        total_tokens // 2,  # 半分を出力トークンと仮定
-                        self.model
-                    )
-                    st.metric("推定総コスト", f"${estimated_cost:.6f}")
-                except Exception as e:
-                    st.warning(f"コスト推定エラー: {e}")
+                    st.metric("平均トークン/ステップ", f"{stats['total_tokens'] / total_steps:.1f}")
+                st.metric("総コスト", f"${stats['cost']:.6f}")
+
+            # トークン内訳
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("入力トークン", f"{stats['input_tokens']:,}")
+            with col2:
+                st.metric("出力トークン", f"{stats['output_tokens']:,}")
+            with col3:
+                st.metric("キャッシュ済み入力", f"{stats['cached_tokens']:,}")
+            with col4:
+                st.metric("推論トークン", f"{stats['reasoning_tokens']:,}")
+
+            if len(stats['cost_by_model']) > 1:
+                st.write("**モデル別コスト**")
+                for model, cost in stats['cost_by_model'].items():
+                    st.write(f"- {model}: ${cost:.6f}")
 
             # 時系列グラフ（簡易版）
             st.write("**ステップ別トークン使用量**")
-            step_tokens = [step.get('total_tokens', 0) for step in self.conversation_steps]
-            if step_tokens:
-                try:
-                    df = pd.DataFrame({
-                        'ステップ'  : range(1, len(step_tokens) + 1),
-                        'トークン数': step_tokens
-                    })
-                    st.bar_chart(df.set_index('ステップ'))
-                except Exception as e:
-                    st.warning(f"グラフ表示エラー: {e}")
+            if stats['step_tokens']:
+                st.bar_chart(stats['step_tokens'])
 
             # 質問の傾向分析（簡易版）
             st.write("**質問の長さ分布**")
-            question_lengths = [len(step['user_input']) for step in self.conversation_steps]
-            if question_lengths:
-                avg_length = sum(question_lengths) / len(question_lengths)
-                max_length = max(question_lengths)
-                min_length = min(question_lengths)
-
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("平均質問長", f"{avg_length:.1f}文字")
-                with col2:
-                    st.metric("最長質問", f"{max_length}文字")
-                with col3:
-                    st.metric("最短質問", f"{min_length}文字")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("平均質問長", f"{stats['user_chars'] / total_steps:.1f}文字")
+            with col2:
+                st.metric("最長質問", f"{stats['max_question']}文字")
+            with col3:
+                st.metric("最短質問", f"{stats['min_question']}文字")
 
 # ==================================================
 # 画像応答デモ
@@ -929,8 +1287,14 @@ class ImageResponseDemo(BaseDemo):
 
             submitted = st.form_submit_button("画像で質問")
 
+        if image_url and question:
+            self._show_token_estimate(question, image_url)
+
         if submitted and image_url and question:
-            self._process_image_question(question, image_url, temperature)
+            # 到達不能・画像以外のURLはモデル呼び出し前に失敗させる
+            info = UIHelper.check_image_url(image_url)
+            if info is not None:
+                self._process_image_question(question, info.request_url, temperature)
 
     def _run_base64_demo(self):
         """Base64画像のデモ（統一化版）"""
@@ -949,19 +1313,47 @@ class ImageResponseDemo(BaseDemo):
                 default_temp=0.3,
                 help_text="低い値ほど一貫性のある回答"
             )
+            detail = self._create_detail_control()
 
             submitted = st.form_submit_button("選択画像で実行")
 
+        # 送信前のトークン見積もり（前処理結果はキャッシュ済み）
+        prepared = self._prepare_image(file_path, detail) if file_path else None
+        if prepared is not None:
+            self._show_token_estimate("このイメージを日本語で説明しなさい。", prepared.data_url, prepared.detail)
+
         if submitted and file_path:
-            self._process_base64_image(file_path, temperature)
+            self._process_base64_image(file_path, temperature, detail)
+
+    def _show_token_estimate(self, question: str, image_url: str, detail: str = "auto"):
+        """送信前の入力トークン見積もり（画像はタイル方式で概算）をサイドバーに表示"""
+        messages = get_default_messages()
+        messages.append(
+            EasyInputMessageParam(
+                role="user",
+                content=[
+                    ResponseInputTextParam(type="input_text", text=question),
+                    ResponseInputImageParam(type="input_image", image_url=image_url, detail=detail),
+                ],
+            )
+        )
+        UIHelper.show_token_info(messages, self.model, position="sidebar")
+
+    def _create_detail_control(self) -> str:
+        """画像の detail 選択（送信前の縮小解像度もこれに合わせる）"""
+        options = ["auto", "low", "high"]
+        default = config.get("vision.detail", "auto")
+        return st.selectbox(
+            "detail",
+            options,
+            index=options.index(default) if default in options else 0,
+            key=f"img_detail_{self.safe_key}",
+            help="low: 512px以内に縮小（固定トークン） / high・auto: 2048px以内かつ短辺768pxまで縮小"
+        )
 
     def _get_image_files(self, images_dir: str) -> List[str]:
-        """画像ファイルのリストを取得"""
-        patterns = ["*.png", "*.jpg", "*.jpeg", "*.webp", "*.gif"]
-        files = []
-        for pattern in patterns:
-            files.extend(glob.glob(f"{images_dir}/{pattern}"))
-        return sorted(files)
+        """画像ファイルのリストを取得（フォルダ更新時のみ再走査）"""
+        return [os.path.join(images_dir, name) for name in image_index.files(images_dir)]
 
     def _encode_image(self, path: str) -> str:
         """画像をBase64エンコード"""
@@ -972,6 +1364,17 @@ class ImageResponseDemo(BaseDemo):
             st.error(f"画像エンコードエラー: {e}")
             return ""
 
+    def _prepare_image(self, path: str, detail: str = "auto") -> Optional[PreparedImage]:
+        """画像を送信用に前処理（縮小・再エンコード）。前処理できない場合は元ファイルを使用"""
+        if config.get("vision.preprocess", True):
+            try:
+                return ImagePreprocessor.prepare_file(path, detail=detail)
+            except Exception as e:
+                logger.debug(f"画像前処理エラー（元ファイルを使用）: {e}")
+
+        b64 = self._encode_image(path)
+        return ImagePreprocessor.from_base64(b64, detail=detail) if b64 else None
+
     def _process_image_question(self, question: str, image_url: str, temperature: Optional[float]):
         """画像質問の処理（統一化版）"""
         messages = get_default_messages()
@@ -1028,21 +1431,20 @@ class ImageResponseDemo(BaseDemo):
             else:
                 st.write("**画像**: Base64")
 
-    def _process_base64_image(self, file_path: str, temperature: Optional[float]):
+    def _process_base64_image(self, file_path: str, temperature: Optional[float], detail: str = "auto"):
         """Base64画像の処理（統一化版）"""
-        b64 = self._encode_image(file_path)
-        if not b64:
+        prepared = self._prepare_image(file_path, detail)
+        if prepared is None:
             return
 
         col1, col2 = st.columns([3, 1])
         with col1:
             st.image(file_path, caption="選択画像", use_container_width=True)
         with col2:
-            # ファイル情報
+            # ファイル情報（前処理前後のサイズ・推定トークン）
             st.write("**📁 ファイル情報**")
-            file_size = Path(file_path).stat().st_size
-            st.metric("サイズ", f"{file_size // 1024} KB")
-            st.write(f"**形式**: {Path(file_path).suffix.upper()}")
+            st.write(f"**ファイル**: {Path(file_path).name}")
+            UIHelper.show_image_preparation(prepared, self.model)
 
         messages = get_default_messages()
         messages.append(
@@ -1055,8 +1457,8 @@ class ImageResponseDemo(BaseDemo):
                     ),
                     ResponseInputImageParam(
                         type="input_image",
-                        image_url=f"data:image/jpeg;base64,{b64}",
-                        detail="auto"
+                        image_url=prepared.data_url,
+                        detail=prepared.detail
                     ),
                 ],
             )
@@ -1181,7 +1583,7 @@ class StructuredOutputDemo(BaseDemo):
         # モデルの推奨事項
         if "gpt-4o" in self.model:
             st.success("✅ 構造化出力に適したモデルが選択されています")
-        elif self.model.startswith("o"):
+        elif model_registry.get(self.model).in_category("reasoning"):
             st.warning("⚠️ 推論系モデルは構造化出力で制限される場合があります")
         else:
             st.info("ℹ️ 構造化出力には gpt-4o 系モデルが推奨されます")
@@ -1479,10 +1881,10 @@ class WeatherDemo(BaseDemo):
             st.error(f"都市データファイルが見つかりません: {cities_json}")
             return
 
-        df_jp = self._load_japanese_cities(cities_json)
+        cities = self._load_japanese_cities(cities_json)
 
         # 都市選択UI
-        city, lat, lon = self._select_city(df_jp)
+        city, lat, lon = self._select_city(cities)
 
         # APIを実行ボタンの追加
         col1, col2, col3 = st.columns([2, 1, 2])
@@ -1522,30 +1924,17 @@ class WeatherDemo(BaseDemo):
             else:
                 st.error("❌ 都市が正しく選択されていません。都市を選択してから再実行してください。")
 
-    def _load_japanese_cities(self, json_path: str) -> pd.DataFrame:
-        """日本の都市データを city_jp.list.json から読み込み"""
+    def _load_japanese_cities(self, json_path: str) -> Optional[CityTable]:
+        """日本の都市データを読み込み（プロセス共有。JSONの解析は初回のみで以降は .npz を利用）"""
         try:
-            with open(json_path, "r", encoding="utf-8") as f:
-                cities_list = json.load(f)
-            # 必要なカラムのみ抽出
-            df = pd.DataFrame([
-                {
-                    "name": city["name"],
-                    "lat" : city["coord"]["lat"],
-                    "lon" : city["coord"]["lon"],
-                    "id"  : city["id"]
-                }
-                for city in cities_list
-            ])
-            # 都市名でソート
-            return df.sort_values("name").reset_index(drop=True)
+            return get_city_table(json_path)
         except Exception as e:
             st.error(f"都市データの読み込みに失敗しました: {e}")
-            return pd.DataFrame()
+            return None
 
-    def _select_city(self, df: pd.DataFrame) -> tuple:
-        """都市選択UI（改修版）"""
-        if df.empty:
+    def _select_city(self, cities: Optional[CityTable]) -> tuple:
+        """都市選択UI（絞り込み検索 + 都市名からの直接参照）"""
+        if cities is None or len(cities) == 0:
             st.error("都市データが空です")
             return "Tokyo", 35.6895, 139.69171
 
@@ -1553,27 +1942,40 @@ class WeatherDemo(BaseDemo):
         st.subheader("🏙️ 都市選択")
         st.write("天気情報を取得したい都市を選択してください：")
 
+        # 絞り込み（前方一致 → 部分一致の順）
+        query = st.text_input(
+            "🔎 都市名で絞り込み",
+            key=f"city_query_{self.safe_key}",
+            placeholder="例: Tok, kyo",
+            help="前方一致する都市を先に、続けて部分一致する都市を表示します"
+        )
+        options = cities.search(query)
+        if not options:
+            st.warning(f"「{query}」に一致する都市がありません。全都市から選択してください。")
+            options = cities.unique_names
+
         # 都市選択ボックス
         city = st.selectbox(
             "都市を選択してください",
-            df["name"].tolist(),
+            options,
             key=f"city_{self.safe_key}",
             help="日本国内の主要都市から選択できます"
         )
 
-        row = df[df["name"] == city].iloc[0]
-
-        return city, row["lat"], row["lon"]
+        return cities.lookup(city)
 
     def _display_weather(self, lat: float, lon: float, city_name: str = None):
         """天気情報の表示（改修版・右ペイン付き）"""
+        pd = lazy_import("pandas")
         try:
             # 実行時間の計測開始
             start_time = time.time()
 
-            # 現在の天気
-            with st.spinner(f"🌤️ {city_name or '選択した都市'}の現在の天気を取得中..."):
-                today = self._get_current_weather(lat, lon)
+            # 現在の天気と5日間予報を並列に取得
+            with st.spinner(f"🌤️ {city_name or '選択した都市'}の天気情報を取得中..."):
+                legs = weather_client.fetch_many(["weather", "forecast"], lat, lon)
+            today = self._parse_current_weather(legs["weather"])
+            forecast = self._parse_weekly_forecast(legs["forecast"])
 
             if today:
                 st.success("✅ 現在の天気情報を取得しました")
@@ -1611,10 +2013,6 @@ class WeatherDemo(BaseDemo):
                     if 'wind_speed' in today:
                         st.metric("🌬️ 風速", f"{today['wind_speed']}m/s")
 
-            # 週間予報
-            with st.spinner("📊 5日間予報を取得中..."):
-                forecast = self._get_weekly_forecast(lat, lon)
-
             if forecast:
                 st.success("✅ 週間予報を取得しました")
 
@@ -1655,16 +2053,21 @@ class WeatherDemo(BaseDemo):
             st.write("---")
             detail_col, metric_col = st.columns([3, 1])
             
+            api_calls = sum(1 for leg in legs.values() if not leg.cached)
+
             with detail_col:
                 with st.expander("🔧 API実行詳細", expanded=False):
                     st.write(f"**実行時間**: {execution_time:.2f}秒")
-                    st.write(f"**API呼び出し数**: 2回")
-                    st.write(f"**エンドポイント**: OpenWeatherMap API")
+                    st.write(f"**API呼び出し数**: {api_calls}回（キャッシュ {len(legs) - api_calls}件）")
+                    st.write(f"**エンドポイント**: {weather_client.base_url}")
+                    for name, leg in legs.items():
+                        source = "キャッシュ" if leg.cached else "API"
+                        st.write(f"- {name}: {leg.elapsed * 1000:.0f}ms（{source}）")
                     
             with metric_col:
                 st.write("**📋 実行サマリ**")
                 st.metric("実行時間", f"{execution_time:.2f}秒")
-                st.metric("API呼び出し", "2回")
+                st.metric("API呼び出し", f"{api_calls}回")
                 if today:
                     st.metric("データ取得", "成功")
                     st.metric("データ形式", "JSON")
@@ -1684,26 +2087,27 @@ class WeatherDemo(BaseDemo):
                     st.exception(e)
 
     def _get_current_weather(self, lat: float, lon: float, unit: str = "metric") -> dict[str, Any] | None:
-        """現在の天気を取得（改修版）"""
-        api_key = os.getenv("OPENWEATHER_API_KEY")
-        if not api_key:
+        """現在の天気を取得（共有クライアント経由・キャッシュ対応）"""
+        if not weather_client.api_key():
             st.error("❌ OPENWEATHER_API_KEY環境変数が設定されていません")
             return None
+        return self._parse_current_weather(weather_client.fetch("weather", lat, lon, units=unit))
 
-        try:
-            url = "http://api.openweathermap.org/data/2.5/weather"
-            params = {
-                "lat"  : lat,
-                "lon"  : lon,
-                "appid": api_key,
-                "units": unit,
-                "lang" : "ja"  # 日本語での天気説明
-            }
+    def _get_weekly_forecast(self, lat: float, lon: float, unit: str = "metric") -> List[dict]:
+        """週間予報を取得（共有クライアント経由・キャッシュ対応）"""
+        if not weather_client.api_key():
+            return []
+        return self._parse_weekly_forecast(weather_client.fetch("forecast", lat, lon, units=unit))
 
-            response = requests.get(url, params=params, timeout=config.get("api.timeout", 30))
-            response.raise_for_status()
-            data = response.json()
+    def _parse_current_weather(self, leg: WeatherFetch) -> dict[str, Any] | None:
+        """現在の天気の応答を表示用に整形"""
+        if leg.error is not None:
+            st.error(f"❌ 天気API呼び出しエラー: {leg.error}")
+            logger.error(f"Weather API request error: {leg.error}")
+            return None
 
+        try:
+            data = leg.data
             return {
                 "city"       : data["name"],
                 "temperature": round(data["main"]["temp"], 1),
@@ -1713,34 +2117,20 @@ class WeatherDemo(BaseDemo):
                 "pressure"   : data["main"]["pressure"],
                 "wind_speed" : data.get("wind", {}).get("speed", 0)
             }
-        except requests.exceptions.RequestException as e:
-            st.error(f"❌ 天気API呼び出しエラー: {e}")
-            logger.error(f"Weather API request error: {e}")
-            return None
         except Exception as e:
             st.error(f"❌ 天気データ処理エラー: {e}")
             logger.error(f"Weather data processing error: {e}")
             return None
 
-    def _get_weekly_forecast(self, lat: float, lon: float, unit: str = "metric") -> List[dict]:
-        """週間予報を取得（改修版）"""
-        api_key = os.getenv("OPENWEATHER_API_KEY")
-        if not api_key:
+    def _parse_weekly_forecast(self, leg: WeatherFetch) -> List[dict]:
+        """5日間予報（3時間毎）の応答を日別に集計"""
+        if leg.error is not None:
+            st.error(f"❌ 予報API呼び出しエラー: {leg.error}")
+            logger.error(f"Forecast API request error: {leg.error}")
             return []
 
         try:
-            url = "http://api.openweathermap.org/data/2.5/forecast"
-            params = {
-                "lat"  : lat,
-                "lon"  : lon,
-                "units": unit,
-                "appid": api_key,
-                "lang" : "ja"  # 日本語での天気説明
-            }
-
-            response = requests.get(url, params=params, timeout=config.get("api.timeout", 30))
-            response.raise_for_status()
-            data = response.json()
+            data = leg.data
 
             # 日別に集計
             daily = {}
@@ -1765,10 +2155,6 @@ class WeatherDemo(BaseDemo):
 
             return result
 
-        except requests.exceptions.RequestException as e:
-            st.error(f"❌ 予報API呼び出しエラー: {e}")
-            logger.error(f"Forecast API request error: {e}")
-            return []
         except Exception as e:
             st.error(f"❌ 予報データ処理エラー: {e}")
             logger.error(f"Forecast data processing error: {e}")
@@ -2513,18 +2899,19 @@ class DemoManager:
         self.config = ConfigManager("config.yml")
         self.demos = self._initialize_demos()
 
-    def _initialize_demos(self) -> Dict[str, BaseDemo]:
-        """デモインスタンスの初期化（統一化版）"""
-        return {
-            "Text Responses (One Shot)"  : TextResponseDemo("Text Responses(one shot)"),
-            "Text Responses (Memory)"    : MemoryResponseDemo("Text Responses(memory)"),
-            "Image to Text 画像入力(URL)"   : ImageResponseDemo("Image_URL", use_base64=False),
-            "Image to Text 画像入力(base64)": ImageResponseDemo("Image_Base64", use_base64=True),
-            "Structured Output 構造化出力" : StructuredOutputDemo("Structured_Output_create", use_parse=False),
-            "Open Weather API(比較用)" : WeatherDemo("OpenWeatherAPI"),
-            "File Search-Tool vector store": FileSearchVectorStoreDemo("FileSearch_vsid"),
-            "Tools - Web Search Tools"     : WebSearchToolsDemo("WebSearch"),
-        }
+    def _initialize_demos(self) -> DemoRegistry:
+        """デモファクトリの登録（選択されたデモのみ生成）"""
+        return (
+            DemoRegistry("a00_responses_api")
+            .register("Text Responses (One Shot)"     , TextResponseDemo, "Text Responses(one shot)")
+            .register("Text Responses (Memory)"       , MemoryResponseDemo, "Text Responses(memory)")
+            .register("Image to Text 画像入力(URL)"   , ImageResponseDemo, "Image_URL", use_base64=False)
+            .register("Image to Text 画像入力(base64)", ImageResponseDemo, "Image_Base64", use_base64=True)
+            .register("Structured Output 構造化出力"  , StructuredOutputDemo, "Structured_Output_create", use_parse=False)
+            .register("Open Weather API(比較用)"      , WeatherDemo, "OpenWeatherAPI")
+            .register("File Search-Tool vector store" , FileSearchVectorStoreDemo, "FileSearch_vsid")
+            .register("Tools - Web Search Tools"      , WebSearchToolsDemo, "WebSearch")
+        )
 
     @error_handler_ui
     @timer_ui
@@ -2536,7 +2923,7 @@ class DemoManager:
         # デモ選択
         demo_name = st.sidebar.radio(
             "[a00_responses_api.py] デモを選択",
-            list(self.demos.keys()),
+            self.demos.keys(),
             key="demo_selection"
         )
 
@@ -2623,6 +3010,7 @@ def main():
 
 if __name__ == "__main__":
     main()
+    startup_profiler.mark_first_render()
 
 # streamlit run a00_responses_api.py --server.port=8510
 
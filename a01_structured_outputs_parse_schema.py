@@ -15,7 +15,6 @@ from typing import Optional, List, Dict, Any, Union
 from pathlib import Path
 
 import streamlit as st
-import pandas as pd
 from pydantic import BaseModel, Field, ValidationError
 
 from openai import OpenAI
@@ -43,14 +42,15 @@ try:
     from helper_st import (
         UIHelper, MessageManagerUI, ResponseProcessorUI,
         SessionStateManager, error_handler_ui, timer_ui,
-        InfoPanelManager, safe_streamlit_json
+        InfoPanelManager, safe_streamlit_json, DemoRegistry
     )
     from helper_api import (
         config, logger, TokenManager, OpenAIClient,
         EasyInputMessageParam, ResponseInputTextParam,
         ConfigManager, MessageManager, sanitize_key,
         error_handler, timer, get_default_messages,
-        ResponseProcessor, format_timestamp
+        ResponseProcessor, format_timestamp, model_registry,
+        startup_profiler
     )
 except ImportError as e:
     st.error(f"ヘルパーモジュールのインポートに失敗しました: {e}")
@@ -147,23 +147,12 @@ class BaseDemo(ABC):
                                     config.get("models.default", "gpt-4o-mini"))
 
     def is_reasoning_model(self, model: str = None) -> bool:
-        """推論系モデルかどうかを判定（統一化）"""
+        """推論系モデルかどうかを判定（統一化・model_registryで事前計算済み）"""
         if model is None:
             model = self.get_model()
 
-        # config.ymlから取得、フォールバックあり
-        reasoning_models = config.get("models.categories.reasoning",
-                                      ["o1", "o1-mini", "o3", "o3-mini", "o4", "o4-mini"])
-        
-        # GPT-5系モデルも推論系として扱う（temperatureサポートなし）
-        frontier_models = config.get("models.categories.frontier",
-                                    ["gpt-5", "gpt-5-mini", "gpt-5-nano"])
-
-        # モデル名に推論系モデルの識別子が含まれているかチェック
-        reasoning_indicators = ["o1", "o3", "o4", "gpt-5"]
-        return any(indicator in model.lower() for indicator in reasoning_indicators) or \
-            any(reasoning_model in model for reasoning_model in reasoning_models) or \
-            any(frontier_model in model for frontier_model in frontier_models)
+        # o1/o3/o4系・GPT-5系（temperatureサポートなし）を含む
+        return model_registry.is_reasoning(model)
 
     def create_temperature_control(self, default_temp: float = 0.3, help_text: str = None) -> Optional[float]:
         """Temperatureコントロールを作成（統一化・推論系モデル・GPT-5系では無効化）"""
@@ -1017,16 +1006,19 @@ class DemoManager:
         self.config = ConfigManager("config.yml")
         self.demos = self._initialize_demos()
 
-    def _initialize_demos(self) -> Dict[str, BaseDemo]:
-        """デモインスタンスの初期化（統一化版）"""
-        return {
-            "イベント情報抽出": EventExtractionDemo("イベント情報抽出"),
-            "数学的思考ステップ": MathReasoningDemo("数学的思考ステップ"),
-            "UIコンポーネント生成": UIGenerationDemo("UIコンポーネント生成"),
-            "エンティティ抽出": EntityExtractionDemo("エンティティ抽出"),
-            "条件分岐スキーマ": ConditionalSchemaDemo("条件分岐スキーマ"),
-            "モデレーション＆拒否処理": ModerationDemo("モデレーション＆拒否処理")
-        }
+    def _initialize_demos(self) -> DemoRegistry:
+        """デモファクトリの登録（選択されたデモのみ生成）"""
+        demos = DemoRegistry("a01_structured_outputs_parse_schema")
+        for name, demo_class in (
+            ("イベント情報抽出", EventExtractionDemo),
+            ("数学的思考ステップ", MathReasoningDemo),
+            ("UIコンポーネント生成", UIGenerationDemo),
+            ("エンティティ抽出", EntityExtractionDemo),
+            ("条件分岐スキーマ", ConditionalSchemaDemo),
+            ("モデレーション＆拒否処理", ModerationDemo),
+        ):
+            demos.register(name, demo_class, name)
+        return demos
 
     @error_handler_ui
     @timer_ui
@@ -1038,7 +1030,7 @@ class DemoManager:
         # デモ選択
         demo_name = st.sidebar.radio(
             "[a01_structured_outputs_parse_schema.py] デモを選択",
-            list(self.demos.keys()),
+            self.demos.keys(),
             key="demo_selection"
         )
 
@@ -1125,5 +1117,6 @@ def main():
 
 if __name__ == "__main__":
     main()
+    startup_profiler.mark_first_render()
 
 # streamlit run a01_structured_outputs_parse_schema.py --server.port=8501
\ No newline at end of file
@@ -14,9 +14,8 @@
 import os
 import sys
 from pathlib import Path
-from typing import List, Dict, Any, Union
+from typing import List, Dict, Any, Optional, Union
 from enum import Enum
-import requests
 import pprint
 import logging
 
@@ -37,13 +36,15 @@ try:
     from helper_st import (
         UIHelper, MessageManagerUI, ResponseProcessorUI,
         SessionStateManager, error_handler_ui, timer_ui,
-        init_page, select_model, InfoPanelManager
+        init_page, select_model, InfoPanelManager, DemoRegistry,
+        SessionMemoryManager
     )
     from helper_api import (
         config, logger, TokenManager, OpenAIClient,
         EasyInputMessageParam, ResponseInputTextParam,
         ConfigManager, MessageManager, sanitize_key,
-        error_handler, timer
+        error_handler, timer, model_registry,
+        lazy_import, startup_profiler, get_city_table, weather_client
     )
 except ImportError as e:
     st.error(f"ヘルパーモジュールのインポートに失敗しました: {e}")
@@ -207,9 +208,10 @@ class BaseDemo:
     def _show_model_info_collapsed(self, selected_model: str):
         """モデル情報パネル（閉じた状態で開始）"""
         with st.sidebar.expander("📊 モデル情報", expanded=False):
-            # 基本情報
-            limits = TokenManager.get_model_limits(selected_model)
-            pricing = config.get("model_pricing", {}).get(selected_model, {})
+            # 基本情報（model_registryで事前計算済み）
+            info = model_registry.get(selected_model)
+            limits = info.limits
+            pricing = info.pricing or {}
 
             col1, col2 = st.columns(2)
             with col1:
@@ -224,11 +226,11 @@ class BaseDemo:
                 st.write(f"- 出力: ${pricing.get('output', 0):.5f}")
 
             # モデル特性
-            if selected_model.startswith("o"):
+            if info.in_category("reasoning"):
                 st.info("🧠 推論特化モデル")
-            elif "audio" in selected_model:
+            elif info.supports_audio:
                 st.info("🎵 音声対応モデル")
-            elif "gpt-4o" in selected_model:
+            elif info.supports_vision:
                 st.info("👁️ 視覚対応モデル")
 
     def handle_error(self, e: Exception):
@@ -374,30 +376,32 @@ class BasicFunctionCallDemo(BaseDemo):
                 city = function_call.parsed_arguments.city
                 date = function_call.parsed_arguments.date
 
-                if city in city_coords:
-                    self._fetch_weather_data(city, city_coords[city])
+                coords = city_coords.get(city) or self._lookup_city_coords(city)
+                if coords:
+                    self._fetch_weather_data(city, coords)
+
+    def _lookup_city_coords(self, city: str) -> Optional[Dict[str, float]]:
+        """都市データ（city_jp.list.json）から座標を取得。データが無い・該当しない場合は None"""
+        try:
+            cities = get_city_table(config.get("paths.cities_json", "data/city_jp.list.json"))
+        except OSError:
+            return None
+        found = cities.lookup(city)
+        return {"lat": found[1], "lon": found[2]} if found else None
 
     def _fetch_weather_data(self, city: str, coords: Dict[str, float]):
-        """天気データの取得"""
-        API_key = os.getenv("OPENWEATHER_API_KEY")
-        if not API_key:
+        """天気データの取得（共有クライアント経由・タイムアウト/キャッシュ付き）"""
+        if not weather_client.api_key():
             st.warning("OPENWEATHER_API_KEY環境変数が設定されていません")
             return
 
-        lat, lon = coords["lat"], coords["lon"]
-        url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={API_key}"
-
-        try:
-            res = requests.get(url)
-            if res.status_code == 200:
-                weather_data = res.json()
-                st.write(f"**{city}の天気情報:**")
-                with st.expander("天気データを表示", expanded=False):
-                    st.json(weather_data)
-            else:
-                st.error(f"天気データの取得に失敗: {res.status_code}")
-        except Exception as e:
-            st.error(f"天気API呼び出しエラー: {e}")
+        leg = weather_client.fetch("weather", coords["lat"], coords["lon"], units="standard", lang=None)
+        if leg.ok:
+            st.write(f"**{city}の天気情報:**")
+            with st.expander("天気データを表示", expanded=False):
+                st.json(leg.data)
+        else:
+            st.error(f"天気データの取得に失敗: {leg.error}")
 
 # --------------------------------------------------
 # MultipleToolsDemo
@@ -1198,7 +1202,7 @@ class ConversationHistoryDemo(BaseDemo):
             self._process_query(model, user_input)
 
         # 会話履歴の表示
-        history = st.session_state[f"qa_history_{self.safe_key}"]
+        history = SessionMemoryManager.get(f"qa_history_{self.safe_key}", [])
         if history:
             st.write("### 会話履歴")
             for i, qa in enumerate(history, 1):
@@ -1207,7 +1211,7 @@ class ConversationHistoryDemo(BaseDemo):
                     st.write(f"**回答:** {qa.answer}")
 
         if st.button("会話履歴をクリア", key=f"clear_history_{self.safe_key}"):
-            st.session_state[f"qa_history_{self.safe_key}"] = []
+            SessionMemoryManager.store(f"qa_history_{self.safe_key}", [], group=self.safe_key)
             st.rerun()
 
     @timer
@@ -1228,7 +1232,7 @@ class ConversationHistoryDemo(BaseDemo):
             qa = response.output[0].content[0].parsed
 
             # 履歴に追加
-            st.session_state[f"qa_history_{self.safe_key}"].append(qa)
+            SessionMemoryManager.append(f"qa_history_{self.safe_key}", qa, group=self.safe_key)
 
             st.write("### 最新の回答")
             st.write(f"**質問:** {qa.question}")
@@ -1250,21 +1254,22 @@ class DemoManager:
         self.config = ConfigManager("config.yml")
         self.demos = self._initialize_demos()
 
-    def _initialize_demos(self) -> Dict[str, BaseDemo]:
-        """デモインスタンスの初期化"""
-        return {
-            "シンプルデータ抽出": SimpleDataExtractionDemo("SimpleDataExtraction"),
-            "基本的なFunction Call": BasicFunctionCallDemo("BasicFunctionCall"),
-            "入れ子構造"           : NestedStructureDemo("NestedStructure"),
-            "Enum型"               : EnumTypeDemo("EnumType"),
-            "自然文構造化出力"     : NaturalTextStructuredOutputDemo("NaturalTextStructured"),
-
-            "複数エンティティ抽出" : MultipleEntityExtractionDemo("MultipleEntityExtraction"),
-            "複雑なクエリ"         : ComplexQueryDemo("ComplexQuery"),
-            "動的Enum"             : DynamicEnumDemo("DynamicEnum"),
-            "思考の連鎖(CoT)"           : ChainOfThoughtDemo("ChainOfThought"),
-            "会話履歴"             : ConversationHistoryDemo("ConversationHistory"),
-        }
+    def _initialize_demos(self) -> DemoRegistry:
+        """デモファクトリの登録（選択されたデモのみ生成）"""
+        return (
+            DemoRegistry("a02_responses_tools_pydantic_parse")
+            .register("シンプルデータ抽出"   , SimpleDataExtractionDemo, "SimpleDataExtraction")
+            .register("基本的なFunction Call", BasicFunctionCallDemo, "BasicFunctionCall")
+            .register("入れ子構造"           , NestedStructureDemo, "NestedStructure")
+            .register("Enum型"               , EnumTypeDemo, "EnumType")
+            .register("自然文構造化出力"     , NaturalTextStructuredOutputDemo, "NaturalTextStructured")
+
+            .register("複数エンティティ抽出" , MultipleEntityExtractionDemo, "MultipleEntityExtraction")
+            .register("複雑なクエリ"         , ComplexQueryDemo, "ComplexQuery")
+            .register("動的Enum"             , DynamicEnumDemo, "DynamicEnum")
+            .register("思考の連鎖(CoT)"      , ChainOfThoughtDemo, "ChainOfThought")
+            .register("会話履歴"             , ConversationHistoryDemo, "ConversationHistory")
+        )
 
     def run(self):
         """アプリケーションの実行"""
@@ -1273,7 +1278,7 @@ class DemoManager:
         # デモ選択
         demo_name = st.sidebar.radio(
             "[a02_responses_tools_pydantic_parse.py] デモを選択",
-            list(self.demos.keys()),
+            self.demos.keys(),
             key="demo_selection"
         )
 
@@ -1358,5 +1363,6 @@ def main():
 
 if __name__ == "__main__":
     main()
+    startup_profiler.mark_first_render()
 
 # streamlit run a02_responses_tools_pydantic_parse.py --server.port=8502
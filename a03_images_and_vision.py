@@ -12,11 +12,10 @@ import logging
 from datetime import datetime
 import time
 from abc import ABC, abstractmethod
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Union, Tuple
 from pathlib import Path
 
 import streamlit as st
-import pandas as pd
 from pydantic import BaseModel, Field, ValidationError
 
 from openai import OpenAI
@@ -51,7 +50,9 @@ try:
         EasyInputMessageParam, ResponseInputTextParam,
         ConfigManager, MessageManager, sanitize_key,
         error_handler, timer, get_default_messages,
-        ResponseProcessor, format_timestamp
+        ResponseProcessor, format_timestamp, startup_profiler,
+        ImagePreprocessor, PreparedImage, image_index, iter_concurrent,
+        ImageURLProbe, generated_image_store
     )
 except ImportError as e:
     st.error(f"ヘルパーモジュールのインポートに失敗しました: {e}")
@@ -146,6 +147,85 @@ class BaseDemo(ABC):
         # デモ実行
         self.run_demo()
 
+    @staticmethod
+    def _build_image_messages(prompt: str, image_url: str, detail: str = "auto") -> List[EasyInputMessageParam]:
+        """画像1枚とテキストの入力メッセージを構築"""
+        messages = get_default_messages()
+        messages.append(
+            EasyInputMessageParam(
+                role="user",
+                content=[
+                    ResponseInputTextParam(type="input_text", text=prompt),
+                    ResponseInputImageParam(type="input_image", image_url=image_url, detail=detail),
+                ],
+            )
+        )
+        return messages
+
+    def _show_token_estimate(self, prompt: str, image_url: str, detail: str = "auto"):
+        """送信前の入力トークン見積もり（画像はタイル方式で概算）をサイドバーに表示"""
+        UIHelper.show_token_info(self._build_image_messages(prompt, image_url, detail), self.model,
+                                 position="sidebar")
+
+    def _run_image_batch(self, prompt: str, images: List[Tuple[str, str, str]]) -> List[Dict[str, Any]]:
+        """
+        複数画像を画像ごとのリクエストとして並列実行
+
+        images は (表示名, image_url, detail) のリスト。結果枠を入力順に先に配置し、
+        完了したものから該当する枠へ表示する。戻り値は入力順の結果一覧。
+        """
+        max_workers = config.get("vision.batch_max_workers", 4)
+        placeholders = []
+        for label, _, _ in images:
+            box = st.container(border=True)
+            box.write(f"**🖼️ {label}**")
+            placeholder = box.empty()
+            placeholder.info("⏳ 待機中...")
+            placeholders.append(placeholder)
+        progress = st.progress(0.0, text=f"0 / {len(images)} 完了")
+
+        def ask(image: Tuple[str, str, str]):
+            _, image_url, detail = image
+            return self.client.responses.create(
+                model=self.model,
+                input=self._build_image_messages(prompt, image_url, detail),
+            )
+
+        results: List[Dict[str, Any]] = [{} for _ in images]
+        start_time = time.perf_counter()
+        completed = iter_concurrent(ask, images, max_workers=max_workers)
+        for done, (index, response, error, elapsed) in enumerate(completed, start=1):
+            result = {"label": images[index][0], "latency": elapsed, "error": error, "text": "", "tokens": 0}
+            with placeholders[index].container():
+                if error is not None:
+                    st.error(f"エラー: {error}")
+                else:
+                    result["text"] = "\n".join(ResponseProcessor.extract_text(response))
+                    tokens = getattr(getattr(response, "usage", None), "total_tokens", 0)
+                    result["tokens"] = tokens if isinstance(tokens, int) else 0
+                    st.markdown(result["text"] or "（テキスト出力なし）")
+                    st.write(f"⏱️ {elapsed:.2f}秒 / {result['tokens']:,} トークン")
+            results[index] = result
+            progress.progress(done / len(images), text=f"{done} / {len(images)} 完了")
+        wall_time = time.perf_counter() - start_time
+
+        # 集計（並列実行による短縮効果）
+        latencies = [r["latency"] for r in results]
+        succeeded = sum(1 for r in results if r["error"] is None)
+        st.write("**📊 バッチ実行結果**")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("成功 / 画像数", f"{succeeded} / {len(images)}")
+        with col2:
+            st.metric("総実行時間", f"{wall_time:.2f}秒",
+                      help=f"逐次実行なら約 {sum(latencies):.2f}秒（ワーカー数 {max_workers}）")
+        with col3:
+            st.metric("スループット", f"{len(images) / wall_time:.2f} 枚/秒" if wall_time > 0 else "-")
+        with col4:
+            st.metric("レイテンシ 平均 / 最大", f"{sum(latencies) / len(latencies):.2f} / {max(latencies):.2f}秒")
+        st.metric("総トークン数", f"{sum(r['tokens'] for r in results):,}")
+        return results
+
 
 # ==================================================
 # 画像＆ビジョンデモクラス
@@ -184,6 +264,10 @@ class URLImageToTextDemo(BaseDemo):
         # 入力エリア
         st.subheader("📤 入力")
         
+        if st.toggle("📚 バッチモード（複数画像を並列処理）", key=f"batch_mode_{self.safe_key}"):
+            self._run_url_batch()
+            return
+        
         # 画像URL入力
         image_url = st.text_input(
             "画像URLを入力してください:",
@@ -208,8 +292,51 @@ class URLImageToTextDemo(BaseDemo):
             )
             submit_button = st.form_submit_button(label="🚀 送信")
         
+        if user_prompt and image_url:
+            self._show_token_estimate(user_prompt, image_url)
+
         if submit_button and user_prompt and image_url:
-            self._process_image_with_text(user_prompt, image_url)
+            # 到達不能・画像以外のURLはモデル呼び出し前に失敗させる
+            info = UIHelper.check_image_url(image_url)
+            if info is not None:
+                self._process_image_with_text(user_prompt, info.request_url)
+    
+    def _run_url_batch(self):
+        """複数URLのバッチモード"""
+        max_images = config.get("vision.batch_max_images", 20)
+        with st.form(key=f"url_batch_form_{self.safe_key}"):
+            urls_text = st.text_area(
+                f"画像URL（1行に1つ、最大{max_images}件）:",
+                value=image_url_default,
+                height=150,
+                key=f"batch_urls_{self.safe_key}"
+            )
+            user_prompt = st.text_area(
+                "各画像への質問:",
+                value="この画像を日本語で簡潔に説明してください。",
+                height=config.get("ui.text_area_height", 75),
+                key=f"batch_prompt_{self.safe_key}"
+            )
+            submit_button = st.form_submit_button(label="🚀 一括送信")
+        
+        urls = [line.strip() for line in urls_text.splitlines() if line.strip()]
+        if len(urls) > max_images:
+            st.warning(f"先頭の{max_images}件のみ処理します")
+            urls = urls[:max_images]
+        
+        if submit_button and user_prompt and urls:
+            # 全URLを並列に事前確認し、使用できるものだけ送信
+            with st.spinner(f"{len(urls)}件の画像URLを確認中..."):
+                infos = ImageURLProbe.probe_many(urls, max_workers=config.get("vision.batch_max_workers", 4))
+            images = []
+            for i, info in enumerate(infos, start=1):
+                label = f"{i}. {info.url.rsplit('/', 1)[-1][:60]}"
+                if info.ok:
+                    images.append((label, info.request_url, "auto"))
+                else:
+                    st.error(f"❌ {label}: {info.error}")
+            if images:
+                self._run_image_batch(user_prompt, images)
     
     def _process_image_with_text(self, prompt: str, image_url: str):
         """画像とテキストの処理"""
@@ -344,10 +471,8 @@ class Base64ImageToTextDemo(BaseDemo):
             st.info(f"'{image_folder}'フォルダを作成しました。画像ファイルを配置してください。")
             return
         
-        image_files = [
-            f for f in os.listdir(image_folder)
-            if f.lower().endswith(('png', 'jpg', 'jpeg', 'webp', 'gif'))
-        ]
+        # フォルダの更新時刻が変わった時のみ再走査
+        image_files = image_index.files(image_folder)
         
         if not image_files:
             st.warning("画像フォルダに画像ファイルがありません。")
@@ -369,6 +494,10 @@ class Base64ImageToTextDemo(BaseDemo):
                 st.rerun()
             return
         
+        if st.toggle("📚 バッチモード（複数画像を並列処理）", key=f"batch_mode_{self.safe_key}"):
+            self._run_file_batch(image_folder, image_files)
+            return
+        
         # 画像選択
         selected_image_file = st.selectbox(
             "images/以下に画像を配置して、画像ファイルを選択してください",
@@ -390,10 +519,54 @@ class Base64ImageToTextDemo(BaseDemo):
                 key=f"prompt_{self.safe_key}"
             )
             
+            # detail（送信前の縮小解像度もこれに合わせる）
+            detail_options = ["auto", "low", "high"]
+            default_detail = config.get("vision.detail", "auto")
+            detail = st.selectbox(
+                "detail",
+                detail_options,
+                index=detail_options.index(default_detail) if default_detail in detail_options else 0,
+                key=f"detail_{self.safe_key}",
+                help="low: 512px以内に縮小（固定トークン） / high・auto: 2048px以内かつ短辺768pxまで縮小"
+            )
+
+            # 送信前のトークン見積もり（前処理結果はキャッシュ済み）
+            prepared = self._prepare_image(image_path, detail)
+            if prepared is not None:
+                self._show_token_estimate(user_prompt, prepared.data_url, prepared.detail)
+
             # 解析ボタン
             if st.button("🚀 解析する", key=f"analyze_{self.safe_key}"):
                 if selected_image_file:
-                    self._process_base64_image(image_path, user_prompt)
+                    self._process_base64_image(image_path, user_prompt, detail)
+    
+    def _run_file_batch(self, image_folder: str, image_files: List[str]):
+        """複数ファイルのバッチモード"""
+        max_images = config.get("vision.batch_max_images", 20)
+        selected_files = st.multiselect(
+            f"画像ファイルを選択（最大{max_images}件）",
+            image_files,
+            default=image_files[:min(3, len(image_files))],
+            max_selections=max_images,
+            key=f"batch_files_{self.safe_key}"
+        )
+        user_prompt = st.text_area(
+            "各画像への質問:",
+            value="画像に何が写っているか日本語で簡潔に説明してください。",
+            height=config.get("ui.text_area_height", 75),
+            key=f"batch_prompt_{self.safe_key}"
+        )
+        detail = st.selectbox("detail", ["auto", "low", "high"], key=f"batch_detail_{self.safe_key}")
+        
+        if st.button("🚀 一括解析", key=f"batch_analyze_{self.safe_key}") and selected_files and user_prompt:
+            # 前処理はメインスレッドで実施（キャッシュ済みなら再処理なし）
+            images = []
+            for name in selected_files:
+                prepared = self._prepare_image(os.path.join(image_folder, name), detail)
+                if prepared is not None:
+                    images.append((name, prepared.data_url, prepared.detail))
+            if images:
+                self._run_image_batch(user_prompt, images)
     
     def _encode_image_to_base64(self, image_path: str) -> str:
         """画像をBase64エンコード"""
@@ -404,13 +577,24 @@ class Base64ImageToTextDemo(BaseDemo):
             st.error(f"画像エンコードエラー: {e}")
             return ""
     
-    def _process_base64_image(self, image_path: str, prompt: str):
+    def _prepare_image(self, image_path: str, detail: str = "auto") -> Optional[PreparedImage]:
+        """画像を送信用に前処理（縮小・再エンコード）。前処理できない場合は元ファイルを使用"""
+        if config.get("vision.preprocess", True):
+            try:
+                return ImagePreprocessor.prepare_file(image_path, detail=detail)
+            except Exception as e:
+                logger.debug(f"画像前処理エラー（元ファイルを使用）: {e}")
+
+        image_base64 = self._encode_image_to_base64(image_path)
+        return ImagePreprocessor.from_base64(image_base64, detail=detail) if image_base64 else None
+
+    def _process_base64_image(self, image_path: str, prompt: str, detail: str = "auto"):
         """Base64画像の処理"""
         try:
-            # 画像をBase64エンコード
-            image_base64 = self._encode_image_to_base64(image_path)
+            # 画像を前処理してBase64エンコード
+            prepared = self._prepare_image(image_path, detail)
             
-            if not image_base64:
+            if prepared is None:
                 st.error("画像のエンコードに失敗しました")
                 return
             
@@ -425,8 +609,8 @@ class Base64ImageToTextDemo(BaseDemo):
                         ResponseInputTextParam(type="input_text", text=prompt),
                         ResponseInputImageParam(
                             type="input_image",
-                            image_url=f"data:image/png;base64,{image_base64}",
-                            detail="auto"
+                            image_url=prepared.data_url,
+                            detail=prepared.detail
                         ),
                     ],
                 )
@@ -448,9 +632,6 @@ class Base64ImageToTextDemo(BaseDemo):
             st.session_state[f"base64_image_query_{self.safe_key}"] = prompt
             st.session_state[f"base64_image_path_{self.safe_key}"] = image_path
             
-            # ファイルサイズを取得
-            file_size = os.path.getsize(image_path) / 1024  # KB単位
-            
             st.success("応答を取得しました")
             st.subheader("🤖 回答")
             
@@ -480,11 +661,9 @@ class Base64ImageToTextDemo(BaseDemo):
                 st.write("**📝 入力情報**")
                 st.metric("プロンプト文字数", len(prompt))
                 
-                # 画像情報
-                st.write("**🖼️ 画像情報**")
-                st.write("ソース: Base64")
-                st.metric("ファイルサイズ", f"{file_size:.1f} KB")
+                # 画像情報（前処理前後のサイズ・推定トークン）
                 st.write(f"ファイル: {os.path.basename(image_path)}")
+                UIHelper.show_image_preparation(prepared, self.model)
             
         except Exception as e:
             st.error(f"エラーが発生しました: {e}")
@@ -552,46 +731,108 @@ image_url = response.data[0].url
             key=f"dalle_prompt_{self.safe_key}"
         )
         
+        # 生成枚数（dall-e-3 は1枚ずつ並列リクエスト、dall-e-2 は n 指定の1リクエスト）
+        variants = st.slider(
+            "生成枚数",
+            min_value=1,
+            max_value=config.get("image_generation.max_variants", 4),
+            value=1,
+            key=f"dalle_variants_{self.safe_key}"
+        )
+        
         # 生成ボタン
         if st.button("🚀 画像を生成", key=f"generate_{self.safe_key}"):
             if prompt:
-                self._generate_image_from_prompt(model, prompt, size, quality)
+                self._generate_image_from_prompt(model, prompt, size, quality, variants)
     
-    def _generate_image_from_prompt(self, model: str, prompt: str, size: str, quality: str):
-        """DALL-Eで画像生成"""
+    @staticmethod
+    def _estimate_image_cost(model: str, size: str, quality: str) -> Optional[float]:
+        """1枚あたりのコスト目安（DALL-E 3のみ）"""
+        if model != "dall-e-3":
+            return None
+        if quality == "hd":
+            return 0.080 if size == "1024x1024" else 0.120
+        return 0.040 if size == "1024x1024" else 0.080
+
+    def _request_variants(self, model: str, prompt: str, size: str, quality: str, count: int):
+        """
+        生成リクエストを実行し、完了順に (位置, 画像データ, 修正プロンプト, 所要秒, 例外) を返す
+
+        dall-e-3 は n=1 のみ対応のため1枚ずつ並列に、それ以外は n 指定の1リクエストで生成する。
+        """
+        jobs = [1] * count if model == "dall-e-3" else [count]
+        offsets = [sum(jobs[:i]) for i in range(len(jobs))]
+
+        def generate(n: int):
+            return self.client.images.generate(
+                model=model,
+                prompt=prompt,
+                size=size,
+                quality=quality,
+                n=n,
+                response_format="b64_json"
+            )
+
+        max_workers = config.get("image_generation.max_workers", 4)
+        for job, response, error, elapsed in iter_concurrent(generate, jobs, max_workers=max_workers):
+            if error is not None:
+                for position in range(offsets[job], offsets[job] + jobs[job]):
+                    yield position, None, None, elapsed, error
+                continue
+            for i, item in enumerate(response.data[:jobs[job]]):
+                yield (offsets[job] + i, base64.b64decode(item.b64_json),
+                       getattr(item, "revised_prompt", None), elapsed, None)
+
+    def _show_variant(self, placeholder, variant: Dict[str, Any], cached: bool):
+        """生成画像1枚の表示"""
+        image_path = generated_image_store.path(variant)
+        with placeholder.container():
+            st.image(str(image_path), use_container_width=True)
+            source = "💾 保存済み" if cached else f"⏱️ {variant['elapsed']:.2f}秒"
+            st.write(f"{source} / {variant['created_at']} / `{image_path}`")
+
+    def _generate_image_from_prompt(self, model: str, prompt: str, size: str, quality: str, variants: int = 1):
+        """DALL-Eで画像生成（同じ条件の生成済み画像はローカル保存から表示）"""
         try:
             # 実行時間の計測開始
             start_time = time.time()
             
-            with st.spinner("画像を生成中...（数秒かかります）"):
-                response = self.client.images.generate(
-                    model=model,
-                    prompt=prompt,
-                    size=size,
-                    quality=quality if model == "dall-e-3" else "standard",
-                    n=1
-                )
-            
-            # 実行時間の計算
-            generation_time = time.time() - start_time
+            quality = quality if model == "dall-e-3" else "standard"
+            params = {"model": model, "prompt": prompt, "size": size, "quality": quality}
+            key = generated_image_store.make_key(model, prompt, size, quality)
+            stored = generated_image_store.load(key)[:variants]
+            missing = variants - len(stored)
             
             # セッション状態に保存
             st.session_state[f"dalle_prompt_{self.safe_key}"] = prompt
             st.session_state[f"dalle_model_{self.safe_key}"] = model
             
-            # 生成された画像を表示
-            image_url = response.data[0].url
-            st.success("画像を生成しました")
             st.subheader("🤖 生成結果")
             
             # メインコンテンツと右ペイン
             col1, col2 = st.columns([3, 1])
             
             with col1:
-                st.image(image_url, caption="生成画像", use_container_width=True)
+                # 結果枠を先に配置し、保存済み → 生成完了順に表示
+                per_row = min(variants, 2)
+                cells = []
+                for _ in range(0, variants, per_row):
+                    cells.extend(column.empty() for column in st.columns(per_row))
+                for i, variant in enumerate(stored):
+                    self._show_variant(cells[i], variant, cached=True)
                 
-                # 画像URLを表示
-                st.text_input("画像URL（ダウンロード用）", value=image_url, key="generated_url")
+                generated, errors = [], []
+                if missing:
+                    with st.spinner(f"画像を生成中...（{missing}枚）"):
+                        results = self._request_variants(model, prompt, size, quality, missing)
+                        for position, data, revised_prompt, elapsed, error in results:
+                            if error is not None:
+                                errors.append(error)
+                                cells[len(stored) + position].error(f"画像生成エラー: {error}")
+                                continue
+                            variant = generated_image_store.add(key, params, data, revised_prompt, elapsed)
+                            generated.append(variant)
+                            self._show_variant(cells[len(stored) + position], variant, cached=False)
                 
                 # 詳細情報
                 with st.expander("生成情報"):
@@ -599,9 +840,16 @@ image_url = response.data[0].url
                     st.write(f"**サイズ**: {size}")
                     st.write(f"**品質**: {quality}")
                     st.write(f"**プロンプト**: {prompt}")
-                    if hasattr(response.data[0], 'revised_prompt'):
-                        st.write(f"**修正されたプロンプト**: {response.data[0].revised_prompt}")
-                
+                    for variant in stored + generated:
+                        if variant.get("revised_prompt"):
+                            st.write(f"**修正されたプロンプト**: {variant['revised_prompt']}")
+                            break
+            
+            # 実行時間の計算
+            generation_time = time.time() - start_time
+            if len(stored) + len(generated):
+                st.success(f"画像を表示しました（生成 {len(generated)}枚 / 保存済み {len(stored)}枚）")
+            
             with col2:
                 # 情報パネル
                 st.write("**📊 生成情報**")
@@ -609,8 +857,10 @@ image_url = response.data[0].url
                 # モデル情報
                 st.metric("使用モデル", model.upper())
                 
-                # 生成時間
+                # 生成時間（バリエーションごとの所要時間も表示）
                 st.metric("生成時間", f"{generation_time:.2f}秒")
+                for i, variant in enumerate(generated, start=1):
+                    st.write(f"{i}枚目: {variant['elapsed']:.2f}秒")
                 
                 # 画像設定
                 st.write("**🎨 画像設定**")
@@ -622,19 +872,13 @@ image_url = response.data[0].url
                 st.metric("文字数", len(prompt))
                 
                 # 生成枚数
-                st.metric("生成枚数", "1枚")
+                st.metric("生成枚数", f"{len(generated)}枚（保存済み {len(stored)}枚）")
                 
-                # コスト目安（DALL-E 3の場合）
-                if model == "dall-e-3":
+                # コスト目安（新たに生成した分のみ）
+                unit_cost = self._estimate_image_cost(model, size, quality)
+                if unit_cost is not None:
                     st.write("**💰 コスト目安**")
-                    if quality == "hd" and size == "1024x1024":
-                        st.write("$0.080")
-                    elif quality == "hd":
-                        st.write("$0.120")
-                    elif size == "1024x1024":
-                        st.write("$0.040")
-                    else:
-                        st.write("$0.080")
+                    st.write(f"${unit_cost * len(generated):.3f}")
             
         except Exception as e:
             st.error(f"画像生成エラー: {e}")
@@ -707,5 +951,6 @@ def main():
 
 if __name__ == "__main__":
     main()
+    startup_profiler.mark_first_render()
 
 # streamlit run a03_images_and_vision.py --server.port=8503
\ No newline at end of file
@@ -40,7 +40,7 @@ try:
         EasyInputMessageParam, ResponseInputTextParam,
         ConfigManager, MessageManager, sanitize_key,
         error_handler, timer, get_default_messages,
-        ResponseProcessor, format_timestamp
+        ResponseProcessor, format_timestamp, startup_profiler
     )
 except ImportError as e:
     st.error(f"ヘルパーモジュールのインポートに失敗しました: {e}")
@@ -497,5 +497,6 @@ def main():
 
 if __name__ == "__main__":
     main()
+    startup_profiler.mark_first_render()
 
 # streamlit run a04_audio_speeches.py --server.port=8504
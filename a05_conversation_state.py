@@ -7,7 +7,6 @@
 import os
 import sys
 import json
-import requests
 import logging
 from datetime import datetime
 import time
@@ -16,7 +15,6 @@ from typing import Optional, List, Dict, Any, Union
 from pathlib import Path
 
 import streamlit as st
-import pandas as pd
 from pydantic import BaseModel, Field, ValidationError
 
 from openai import OpenAI
@@ -45,14 +43,15 @@ try:
     from helper_st import (
         UIHelper, MessageManagerUI, ResponseProcessorUI,
         SessionStateManager, error_handler_ui, timer_ui,
-        InfoPanelManager, safe_streamlit_json
+        InfoPanelManager, safe_streamlit_json, SessionMemoryManager
     )
     from helper_api import (
         config, logger, TokenManager, OpenAIClient,
         EasyInputMessageParam, ResponseInputTextParam,
         ConfigManager, MessageManager, sanitize_key,
         error_handler, timer, get_default_messages,
-        ResponseProcessor, format_timestamp
+        ResponseProcessor, format_timestamp,
+        lazy_import, startup_profiler, find_nearby_cities
     )
 except ImportError as e:
     st.error(f"ヘルパーモジュールのインポートに失敗しました: {e}")
@@ -240,7 +239,7 @@ follow_up_response = client.responses.create(
                 )
             
             # セッション状態に保存
-            st.session_state[f"initial_response_{self.safe_key}"] = response
+            SessionMemoryManager.store(f"initial_response_{self.safe_key}", response, group=self.safe_key)
             st.session_state[f"initial_query_{self.safe_key}"] = question
             st.success(f"✅ Response ID: `{response.id}` を保存しました")
             st.rerun()
@@ -253,7 +252,7 @@ follow_up_response = client.responses.create(
     def _process_follow_up_question(self, question: str):
         """追加質問の処理"""
         try:
-            initial_response = st.session_state[f"initial_response_{self.safe_key}"]
+            initial_response = SessionMemoryManager.get(f"initial_response_{self.safe_key}")
             
             with st.spinner("処理中（前の会話を引き継ぎ中）..."):
                 response = self.client.responses.create(
@@ -263,7 +262,7 @@ follow_up_response = client.responses.create(
                 )
             
             # セッション状態に保存
-            st.session_state[f"follow_up_response_{self.safe_key}"] = response
+            SessionMemoryManager.store(f"follow_up_response_{self.safe_key}", response, group=self.safe_key)
             st.session_state[f"follow_up_query_{self.safe_key}"] = question
             st.success(f"✅ 会話を継続しました - Response ID: `{response.id}`")
             st.rerun()
@@ -277,7 +276,7 @@ follow_up_response = client.responses.create(
         """会話結果の表示（右ペイン付き）"""
         # 初回回答
         if f"initial_response_{self.safe_key}" in st.session_state:
-            response = st.session_state[f"initial_response_{self.safe_key}"]
+            response = SessionMemoryManager.get(f"initial_response_{self.safe_key}")
             initial_query = st.session_state.get(f"initial_query_{self.safe_key}", "")
             
             st.subheader("🤖 初回の回答")
@@ -315,7 +314,7 @@ follow_up_response = client.responses.create(
         
         # 追加質問への回答
         if f"follow_up_response_{self.safe_key}" in st.session_state:
-            response = st.session_state[f"follow_up_response_{self.safe_key}"]
+            response = SessionMemoryManager.get(f"follow_up_response_{self.safe_key}")
             follow_up_query = st.session_state.get(f"follow_up_query_{self.safe_key}", "")
             
             st.subheader("🤖 追加質問への回答")
@@ -424,7 +423,7 @@ structured_response = client.responses.parse(
                     tools=[tool]
                 )
             
-            st.session_state[f"search_response_{self.safe_key}"] = response
+            SessionMemoryManager.store(f"search_response_{self.safe_key}", response, group=self.safe_key)
             st.session_state[f"search_query_{self.safe_key}"] = query
             st.success(f"✅ Web検索完了 - Response ID: `{response.id}`")
             st.rerun()
@@ -437,7 +436,7 @@ structured_response = client.responses.parse(
     def _execute_structured_parse(self):
         """構造化パースの実行"""
         try:
-            search_response = st.session_state[f"search_response_{self.safe_key}"]
+            search_response = SessionMemoryManager.get(f"search_response_{self.safe_key}")
             
             # スキーマ定義
             class APIInfo(BaseModel):
@@ -452,7 +451,7 @@ structured_response = client.responses.parse(
                     text_format=APIInfo
                 )
             
-            st.session_state[f"structured_response_{self.safe_key}"] = structured_response
+            SessionMemoryManager.store(f"structured_response_{self.safe_key}", structured_response, group=self.safe_key)
             st.success("✅ 構造化パース完了")
             st.rerun()
             
@@ -465,7 +464,7 @@ structured_response = client.responses.parse(
         """検索結果の表示（右ペイン付き）"""
         # 検索結果
         if f"search_response_{self.safe_key}" in st.session_state:
-            response = st.session_state[f"search_response_{self.safe_key}"]
+            response = SessionMemoryManager.get(f"search_response_{self.safe_key}")
             search_query = st.session_state.get(f"search_query_{self.safe_key}", "")
             
             st.subheader("🤖 検索結果")
@@ -502,7 +501,7 @@ structured_response = client.responses.parse(
         
         # 構造化データ
         if f"structured_response_{self.safe_key}" in st.session_state:
-            response = st.session_state[f"structured_response_{self.safe_key}"]
+            response = SessionMemoryManager.get(f"structured_response_{self.safe_key}")
             
             st.subheader("🤖 構造化データ")
             
@@ -619,6 +618,11 @@ response = client.responses.create(
                 latitude: float = Field(..., description="緯度（10進）")
                 longitude: float = Field(..., description="経度（10進）")
             
+            class NearbyCitiesParams(BaseModel):
+                latitude: float = Field(..., description="緯度（10進）")
+                longitude: float = Field(..., description="経度（10進）")
+                radius_km: float = Field(..., description="検索半径（km）")
+            
             # 天気取得関数
             def get_weather(latitude: float, longitude: float) -> dict:
                 """Open-Meteo APIで現在の天気情報を取得"""
@@ -628,6 +632,7 @@ response = client.responses.create(
                     "&current=temperature_2m,relative_humidity_2m,wind_speed_10m"
                 )
                 try:
+                    requests = lazy_import("requests")
                     r = requests.get(url, timeout=10)
                     r.raise_for_status()
                     data = r.json()
@@ -647,6 +652,8 @@ response = client.responses.create(
             # JSON Schema生成
             schema = WeatherParams.model_json_schema()
             schema["additionalProperties"] = False
+            nearby_schema = NearbyCitiesParams.model_json_schema()
+            nearby_schema["additionalProperties"] = False
             
             # FunctionToolParam構築
             weather_tool: FunctionToolParam = {
@@ -656,21 +663,35 @@ response = client.responses.create(
                 "parameters": schema,
                 "strict": True,
             }
+            # 近隣都市の検索（都市データの空間インデックスで実行）
+            nearby_tool: FunctionToolParam = {
+                "type": "function",
+                "name": "find_nearby_cities",
+                "description": "指定した座標から半径内にある日本の都市を近い順に取得",
+                "parameters": nearby_schema,
+                "strict": True,
+            }
             
             with st.spinner("Function Calling 実行中..."):
                 response = self.client.responses.create(
                     model="gpt-4.1",
                     input=query,
-                    tools=[weather_tool]
+                    tools=[weather_tool, nearby_tool]
                 )
             
-            # 実際の天気データを取得
+            # 実際の天気データと近隣都市を取得
             coords = cities[selected_city]
             weather_data = get_weather(coords["lat"], coords["lon"])
+            nearby_cities = find_nearby_cities(
+                coords["lat"], coords["lon"],
+                radius_km=config.get("weather.nearby_radius_km", 50),
+                limit=config.get("weather.nearby_limit", 10)
+            )
             
             # セッション状態に保存
-            st.session_state[f"function_response_{self.safe_key}"] = response
+            SessionMemoryManager.store(f"function_response_{self.safe_key}", response, group=self.safe_key)
             st.session_state[f"weather_data_{self.safe_key}"] = weather_data
+            st.session_state[f"nearby_cities_{self.safe_key}"] = nearby_cities
             st.session_state[f"selected_city_{self.safe_key}"] = selected_city
             
             st.success(f"✅ Function Calling完了 - Response ID: `{response.id}`")
@@ -685,9 +706,10 @@ response = client.responses.create(
         """天気結果の表示（右ペイン付き）"""
         # Function Call結果
         if f"function_response_{self.safe_key}" in st.session_state:
-            response = st.session_state[f"function_response_{self.safe_key}"]
+            response = SessionMemoryManager.get(f"function_response_{self.safe_key}")
             selected_city = st.session_state.get(f"selected_city_{self.safe_key}", "")
             weather_data = st.session_state.get(f"weather_data_{self.safe_key}", {})
+            nearby_cities = st.session_state.get(f"nearby_cities_{self.safe_key}", {})
             
             st.subheader(f"🤖 Function Call 結果 - {selected_city}")
             
@@ -712,6 +734,11 @@ response = client.responses.create(
                 elif weather_data:
                     st.error(f"天気データ取得エラー: {weather_data.get('error', 'Unknown error')}")
                 
+                # 近隣都市（find_nearby_cities の結果）
+                if nearby_cities.get("cities"):
+                    st.subheader(f"📍 近隣の都市（半径{nearby_cities['radius_km']}km）")
+                    st.dataframe(nearby_cities["cities"], use_container_width=True, hide_index=True)
+                
             with info_col:
                 # 情報パネル
                 st.write("**📊 Function Call情報**")
@@ -732,6 +759,7 @@ response = client.responses.create(
                 # Function情報
                 st.write("**🔧 Function**")
                 st.write("get_weather")
+                st.write("find_nearby_cities")
                 
                 # API情報
                 st.write("**🌐 外部API**")
@@ -811,5 +839,6 @@ def main():
 
 if __name__ == "__main__":
     main()
+    startup_profiler.mark_first_render()
 
 # streamlit run a05_conversation_state.py --server.port=8505
\ No newline at end of file
@@ -15,7 +15,6 @@ from typing import Optional, List, Dict, Any, Union
 from pathlib import Path
 
 import streamlit as st
-import pandas as pd
 from pydantic import BaseModel, Field, ValidationError
 
 from openai import OpenAI
@@ -43,14 +42,14 @@ try:
     from helper_st import (
         UIHelper, MessageManagerUI, ResponseProcessorUI,
         SessionStateManager, error_handler_ui, timer_ui,
-        InfoPanelManager, safe_streamlit_json
+        InfoPanelManager, safe_streamlit_json, SessionMemoryManager
     )
     from helper_api import (
         config, logger, TokenManager, OpenAIClient,
         EasyInputMessageParam, ResponseInputTextParam,
         ConfigManager, MessageManager, sanitize_key,
         error_handler, timer, get_default_messages,
-        ResponseProcessor, format_timestamp
+        ResponseProcessor, format_timestamp, startup_profiler
     )
 except ImportError as e:
     st.error(f"ヘルパーモジュールのインポートに失敗しました: {e}")
@@ -284,7 +283,7 @@ response = client.responses.create(model=model, input=messages)
                 )
             
             # セッション状態に保存
-            st.session_state[f"reasoning_response_{self.safe_key}"] = response
+            SessionMemoryManager.store(f"reasoning_response_{self.safe_key}", response, group=self.safe_key)
             st.success("✅ 段階的推論完了")
             st.rerun()
             
@@ -296,7 +295,7 @@ response = client.responses.create(model=model, input=messages)
     def _display_reasoning_results(self):
         """推論結果の表示"""
         if f"reasoning_response_{self.safe_key}" in st.session_state:
-            response = st.session_state[f"reasoning_response_{self.safe_key}"]
+            response = SessionMemoryManager.get(f"reasoning_response_{self.safe_key}")
             st.subheader("🤖 段階的推論結果")
             ResponseProcessorUI.display_response(response)
 
@@ -410,7 +409,7 @@ response = client.responses.create(model=model, input=messages)
                 )
             
             # セッション状態に保存
-            st.session_state[f"hypothesis_response_{self.safe_key}"] = response
+            SessionMemoryManager.store(f"hypothesis_response_{self.safe_key}", response, group=self.safe_key)
             st.success("✅ 仮説検証完了")
             st.rerun()
             
@@ -422,7 +421,7 @@ response = client.responses.create(model=model, input=messages)
     def _display_hypothesis_results(self):
         """仮説検証結果の表示"""
         if f"hypothesis_response_{self.safe_key}" in st.session_state:
-            response = st.session_state[f"hypothesis_response_{self.safe_key}"]
+            response = SessionMemoryManager.get(f"hypothesis_response_{self.safe_key}")
             st.subheader("🤖 仮説検証結果")
             ResponseProcessorUI.display_response(response)
 
@@ -538,7 +537,7 @@ response = client.responses.create(model=model, input=messages)
                 )
             
             # セッション状態に保存
-            st.session_state[f"tree_response_{self.safe_key}"] = response
+            SessionMemoryManager.store(f"tree_response_{self.safe_key}", response, group=self.safe_key)
             st.success("✅ Tree of Thought 探索完了")
             st.rerun()
             
@@ -550,7 +549,7 @@ response = client.responses.create(model=model, input=messages)
     def _display_tree_results(self):
         """Tree of Thought 結果の表示（右ペイン付き）"""
         if f"tree_response_{self.safe_key}" in st.session_state:
-            response = st.session_state[f"tree_response_{self.safe_key}"]
+            response = SessionMemoryManager.get(f"tree_response_{self.safe_key}")
             goal = st.session_state.get(f"tree_goal_{self.safe_key}", "")
             
             st.subheader("🤖 Tree of Thought 結果")
@@ -714,7 +713,7 @@ response = client.responses.create(model=model, input=messages)
                 exec_time = time.time() - start_time
             
             # セッション状態に保存
-            st.session_state[f"decision_response_{self.safe_key}"] = response
+            SessionMemoryManager.store(f"decision_response_{self.safe_key}", response, group=self.safe_key)
             st.session_state[f"decision_decision_{self.safe_key}"] = topic
             st.session_state[f"decision_time_{self.safe_key}"] = exec_time
             st.success("✅ 賛否比較決定完了")
@@ -728,7 +727,7 @@ response = client.responses.create(model=model, input=messages)
     def _display_decision_results(self):
         """決定結果の表示"""
         if f"decision_response_{self.safe_key}" in st.session_state:
-            response = st.session_state[f"decision_response_{self.safe_key}"]
+            response = SessionMemoryManager.get(f"decision_response_{self.safe_key}")
             st.subheader("🤖 賛否比較決定結果")
             ResponseProcessorUI.display_response(response)
 
@@ -854,7 +853,7 @@ response = client.responses.create(model=model, input=messages)
                 )
             
             # セッション状態に保存
-            st.session_state[f"reflect_response_{self.safe_key}"] = response
+            SessionMemoryManager.store(f"reflect_response_{self.safe_key}", response, group=self.safe_key)
             st.success("✅ Plan-Execute-Reflect 完了")
             st.rerun()
             
@@ -866,7 +865,7 @@ response = client.responses.create(model=model, input=messages)
     def _display_reflect_results(self):
         """振り返り結果の表示"""
         if f"reflect_response_{self.safe_key}" in st.session_state:
-            response = st.session_state[f"reflect_response_{self.safe_key}"]
+            response = SessionMemoryManager.get(f"reflect_response_{self.safe_key}")
             st.subheader("🤖 Plan-Execute-Reflect 結果")
             ResponseProcessorUI.display_response(response)
 
@@ -938,5 +937,6 @@ def main():
 
 if __name__ == "__main__":
     main()
+    startup_profiler.mark_first_render()
 
 # streamlit run a06_reasoning_chain_of_thought.py --server.port=8506
\ No newline at end of file
@@ -1,7 +1,7 @@
 # helper_api.py - 改修版（重複削除・config.yml対応）
-from typing import List, Dict, Any, Optional, Union, Tuple, Literal, Callable
+from typing import List, Dict, Any, Optional, Union, Tuple, Literal, Callable, Iterator
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from functools import wraps
 from datetime import datetime
 from abc import ABC, abstractmethod
@@ -10,30 +10,101 @@ import hashlib
 # === 必要な標準ライブラリ ===
 import logging
 import logging.handlers
+import importlib
 import yaml
 import os
+import sys
 import time
 import json
+import io
+import base64
 import re
+import math
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+
+# ==================================================
+# 起動時間プロファイラ
+# ==================================================
+class StartupProfiler:
+    """起動時間の計測（import内訳・初回描画時間）
+
+    helper_api の import 開始を起点とし、重い依存モジュールの import 時間、
+    グローバル初期化の所要時間、初回描画完了までの時間を記録する。
+    """
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._imports: Dict[str, float] = {}
+        self._sections: Dict[str, float] = {}
+        self._first_render: Optional[float] = None
+
+    @contextmanager
+    def section(self, name: str):
+        """処理ブロックの所要時間を記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sections[name] = time.perf_counter() - start
+
+    def import_module(self, name: str):
+        """モジュールを初回使用時にimport（初回のみ所要時間を記録）"""
+        module = sys.modules.get(name)
+        if module is not None:
+            return module
+
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        self._imports[name] = time.perf_counter() - start
+        return module
+
+    def mark_first_render(self) -> None:
+        """初回描画の完了を記録（2回目以降は無視）"""
+        if self._first_render is None:
+            self._first_render = time.perf_counter() - self._origin
+
+    def report(self) -> Dict[str, Any]:
+        """計測結果の取得（秒単位）"""
+        return {
+            "sections"    : dict(self._sections),
+            "imports"     : dict(self._imports),
+            "first_render": self._first_render,
+            "uptime"      : time.perf_counter() - self._origin,
+        }
+
+
+# グローバルプロファイラ（他の初期化より先に生成）
+startup_profiler = StartupProfiler()
+
+
+def lazy_import(name: str):
+    """重い依存モジュール（pandas, requests, tiktoken 等）を初回使用時にimport"""
+    return startup_profiler.import_module(name)
 
-import tiktoken
-from openai import OpenAI
 
 # -----------------------------------------------------
-# OpenAI API型定義
+# OpenAI API型定義（各デモアプリで必須のため即時import）
 # -----------------------------------------------------
-from openai.types.responses import (
-    EasyInputMessageParam,
-    ResponseInputTextParam,
-    ResponseInputImageParam,
-    Response
-)
-from openai.types.chat import (
-    ChatCompletionSystemMessageParam,
-    ChatCompletionUserMessageParam,
-    ChatCompletionAssistantMessageParam,
-    ChatCompletionMessageParam,
-)
+with startup_profiler.section("openai"):
+    from openai import OpenAI
+    from openai.types.responses import (
+        EasyInputMessageParam,
+        ResponseInputTextParam,
+        ResponseInputImageParam,
+        Response
+    )
+    from openai.types.chat import (
+        ChatCompletionSystemMessageParam,
+        ChatCompletionUserMessageParam,
+        ChatCompletionAssistantMessageParam,
+        ChatCompletionMessageParam,
+    )
 
 # Role型の定義
 RoleType = Literal["user", "assistant", "system", "developer"]
@@ -112,13 +183,11 @@ class ConfigManager:
                     return config
             except Exception as e:
                 # テスト環境では警告を抑制
-                import sys
                 if 'pytest' not in sys.modules:
                     print(f"設定ファイルの読み込みに失敗: {e}")
                 return self._get_default_config()
         else:
             # テスト環境では警告を抑制
-            import sys
             if 'pytest' not in sys.modules:
                 print(f"設定ファイルが見つかりません: {self.config_path}")
             return self._get_default_config()
@@ -222,6 +291,7 @@ class ConfigManager:
         """設定の再読み込み"""
         self._config = self._load_config()
         self._cache.clear()
+        model_registry.refresh()
 
     def save(self, filepath: str = None) -> bool:
         """設定をファイルに保存"""
@@ -237,8 +307,9 @@ class ConfigManager:
 
 
 # グローバル設定インスタンス
-config = ConfigManager("config.yml")
-logger = config.logger
+with startup_profiler.section("config"):
+    config = ConfigManager("config.yml")
+    logger = config.logger
 
 
 # ==================================================
@@ -248,7 +319,7 @@ class MemoryCache:
     """メモリベースキャッシュ"""
 
     def __init__(self):
-        self._storage = {}
+        self._storage: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self._enabled = config.get("cache.enabled", True)
         self._ttl = config.get("cache.ttl", 3600)
         self._max_size = config.get("cache.max_size", 100)
@@ -270,15 +341,16 @@ class MemoryCache:
         if not self._enabled:
             return
 
+        # 挿入順 = タイムスタンプ順を保つため、既存キーは末尾へ付け直す
+        self._storage.pop(key, None)
         self._storage[key] = {
             'result'   : value,
             'timestamp': time.time()
         }
 
-        # サイズ制限チェック
-        if len(self._storage) > self._max_size:
-            oldest_key = min(self._storage, key=lambda k: self._storage[k]['timestamp'])
-            del self._storage[oldest_key]
+        # サイズ制限チェック（先頭が最古エントリ）
+        while len(self._storage) > self._max_size:
+            self._storage.popitem(last=False)
 
     def clear(self) -> None:
         """キャッシュクリア"""
@@ -289,6 +361,111 @@ class MemoryCache:
         return len(self._storage)
 
 
+class SharedCache:
+    """
+    プロセス共有キャッシュ（スレッドセーフ・LRU・メモリ上限付き）
+
+    Streamlit の全セッションから同時に参照されるため、操作は全てロック下で行う。
+    エントリ数（max_size）と推定バイト数（max_bytes）の両方で上限を管理し、
+    LRU順（OrderedDict の先頭）から O(1) で追い出す。
+    """
+
+    def __init__(self, max_size: int = None, max_bytes: int = None, ttl: int = None):
+        self._storage: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.max_size = max_size or config.get("cache.max_size", 100)
+        self.max_bytes = max_bytes or config.get("cache.max_bytes", 64 * 1024 * 1024)
+        self.ttl = ttl or config.get("cache.ttl", 3600)
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def estimate_size(value: Any) -> int:
+        """値のメモリ使用量を推定（pickle長、失敗時は sys.getsizeof）"""
+        try:
+            return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return sys.getsizeof(value)
+
+    def get(self, key: str, ttl: int = None) -> Tuple[bool, Any]:
+        """キャッシュから値を取得し (ヒット有無, 値) を返す"""
+        with self._lock:
+            entry = self._storage.get(key)
+            if entry is None:
+                self._misses += 1
+                return False, None
+
+            value, timestamp, size = entry
+            if time.time() - timestamp >= (ttl or self.ttl):
+                self._remove(key)
+                self._misses += 1
+                return False, None
+
+            self._storage.move_to_end(key)
+            self._hits += 1
+            return True, value
+
+    def set(self, key: str, value: Any, size: int = None) -> None:
+        """キャッシュに値を設定（上限超過分はLRU順に追い出し）
+
+        size を渡すと推定（pickle）を省略する。大きな値を頻繁に入れる場合に使用。
+        """
+        if size is None:
+            size = self.estimate_size(value)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                # 単体で上限を超える値はキャッシュしない
+                return
+
+            self._storage[key] = (value, time.time(), size)
+            self._bytes += size
+            while self._storage and (len(self._storage) > self.max_size or self._bytes > self.max_bytes):
+                oldest_key = next(iter(self._storage))
+                self._remove(oldest_key)
+                self._evictions += 1
+
+    def _remove(self, key: str) -> None:
+        """エントリ削除（ロック取得済みで呼ぶこと）"""
+        entry = self._storage.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def delete_prefix(self, prefix: str) -> int:
+        """指定プレフィックスのエントリを削除（セッション単位のクリア用）"""
+        with self._lock:
+            keys = [k for k in self._storage if k.startswith(prefix)]
+            for k in keys:
+                self._remove(k)
+            return len(keys)
+
+    def clear(self) -> None:
+        """キャッシュクリア"""
+        with self._lock:
+            self._storage.clear()
+            self._bytes = 0
+
+    def size(self) -> int:
+        """キャッシュサイズ"""
+        return len(self._storage)
+
+    def stats(self) -> Dict[str, Any]:
+        """統計情報（エントリ数・使用バイト数・ヒット率など）"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries"  : len(self._storage),
+                "bytes"    : self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits"     : self._hits,
+                "misses"   : self._misses,
+                "evictions": self._evictions,
+                "hit_rate" : self._hits / lookups if lookups else 0.0,
+            }
+
+
 # グローバルキャッシュインスタンス
 cache = MemoryCache()
 
@@ -509,13 +686,50 @@ class MessageManager:
 
 
 # ==================================================
-# トークン管理
+# モデルレジストリ
 # ==================================================
-class TokenManager:
-    """トークン数の管理（新モデル対応）"""
+@dataclass(frozen=True)
+class ModelInfo:
+    """モデルの能力・制限・料金（レジストリで事前計算）"""
+    name: str
+    categories: frozenset
+    is_reasoning: bool
+    supports_temperature: bool
+    supports_vision: bool
+    supports_audio: bool
+    encoding: str
+    max_tokens: int
+    max_output: int
+    pricing: Optional[Dict[str, float]] = None
+
+    @property
+    def limits(self) -> Dict[str, int]:
+        """get_model_limits() 互換の制限辞書"""
+        return {"max_tokens": self.max_tokens, "max_output": self.max_output}
+
+    def in_category(self, category: str) -> bool:
+        """config.yml の models.categories に属するか"""
+        return category in self.categories
+
+
+class ModelRegistry:
+    """config.yml のモデル定義から能力・制限・料金を事前計算するレジストリ
+
+    models.categories / model_pricing / model_limits を一度だけ読み込み、
+    以降の判定は辞書参照のみで行う。日付付きのモデル名（gpt-4o-2024-08-06 等）は
+    既知モデルへの最長プレフィックス一致で解決し、結果をメモ化する。
+    """
+
+    # temperature をサポートしない推論系カテゴリ
+    REASONING_CATEGORIES = ("reasoning", "deep_research", "frontier")
+
+    # 未登録モデル用の推論系識別子（フォールバック）
+    REASONING_INDICATORS = ("o1", "o3", "o4", "gpt-5")
+
+    DEFAULT_ENCODING = "cl100k_base"
 
     # モデル別のエンコーディング対応表
-    MODEL_ENCODINGS = {
+    DEFAULT_ENCODINGS = {
         "gpt-4o"                   : "cl100k_base",
         "gpt-4o-mini"              : "cl100k_base",
         "gpt-4o-audio-preview"     : "cl100k_base",
@@ -530,6 +744,151 @@ class TokenManager:
         "o4-mini"                  : "cl100k_base",
     }
 
+    # モデル別のトークン制限（config.yml の model_limits で上書き可能）
+    DEFAULT_LIMITS = {
+        "gpt-4o"                   : {"max_tokens": 128000, "max_output": 4096},
+        "gpt-4o-mini"              : {"max_tokens": 128000, "max_output": 4096},
+        "gpt-4o-audio-preview"     : {"max_tokens": 128000, "max_output": 4096},
+        "gpt-4o-mini-audio-preview": {"max_tokens": 128000, "max_output": 4096},
+        "gpt-4.1"                  : {"max_tokens": 128000, "max_output": 4096},
+        "gpt-4.1-mini"             : {"max_tokens": 128000, "max_output": 4096},
+        "o1"                       : {"max_tokens": 128000, "max_output": 32768},
+        "o1-mini"                  : {"max_tokens": 128000, "max_output": 65536},
+        "o3"                       : {"max_tokens": 200000, "max_output": 100000},
+        "o3-mini"                  : {"max_tokens": 200000, "max_output": 100000},
+        "o4"                       : {"max_tokens": 256000, "max_output": 128000},
+        "o4-mini"                  : {"max_tokens": 256000, "max_output": 128000},
+        "gpt-5"                    : {"max_tokens": 400000, "max_output": 128000},
+        "gpt-5-mini"               : {"max_tokens": 400000, "max_output": 128000},
+        "gpt-5-nano"               : {"max_tokens": 400000, "max_output": 128000},
+    }
+
+    FALLBACK_LIMITS = {"max_tokens": 128000, "max_output": 4096}
+
+    def __init__(self, config_manager: "ConfigManager" = None):
+        self._config = config_manager
+        self._models: Dict[str, ModelInfo] = {}
+        self._resolved: Dict[str, ModelInfo] = {}
+        self._built = False
+
+    def _build(self) -> None:
+        """config.yml からモデル表を構築（初回アクセス時に一度だけ）"""
+        cfg = self._config or config
+        categories = cfg.get("models.categories", {}) or {}
+        pricing = cfg.get("model_pricing", {}) or {}
+        limits = dict(self.DEFAULT_LIMITS)
+        limits.update(cfg.get("model_limits", {}) or {})
+
+        membership: Dict[str, set] = {}
+        for category, names in categories.items():
+            for name in names or []:
+                membership.setdefault(name, set()).add(category)
+
+        names = set(membership)
+        names.update(cfg.get("models.available", []) or [])
+        names.update(pricing)
+        names.update(limits)
+        names.update(self.DEFAULT_ENCODINGS)
+
+        self._models = {
+            name: self._make_info(name, frozenset(membership.get(name, ())),
+                                  limits.get(name), pricing.get(name))
+            for name in names
+        }
+        self._resolved = {}
+        self._built = True
+
+    def _make_info(self, name: str, categories: frozenset,
+                   limits: Optional[Dict[str, int]], pricing: Optional[Dict[str, float]]) -> ModelInfo:
+        """ModelInfo の生成"""
+        if categories:
+            is_reasoning = any(c in categories for c in self.REASONING_CATEGORIES)
+        else:
+            is_reasoning = any(i in name.lower() for i in self.REASONING_INDICATORS)
+
+        limits = limits or self.FALLBACK_LIMITS
+        return ModelInfo(
+            name=name,
+            categories=categories,
+            is_reasoning=is_reasoning,
+            supports_temperature=not is_reasoning,
+            supports_vision="vision" in categories,
+            supports_audio="audio" in categories or "audio" in name,
+            encoding=self.DEFAULT_ENCODINGS.get(name, self.DEFAULT_ENCODING),
+            max_tokens=limits.get("max_tokens", self.FALLBACK_LIMITS["max_tokens"]),
+            max_output=limits.get("max_output", self.FALLBACK_LIMITS["max_output"]),
+            pricing=pricing,
+        )
+
+    def refresh(self) -> None:
+        """設定変更後にレジストリを再構築させる"""
+        self._built = False
+        self._models = {}
+        self._resolved = {}
+
+    def get(self, model: str = None) -> ModelInfo:
+        """モデル情報の取得（プレフィックス解決はメモ化）"""
+        if not self._built:
+            self._build()
+        if model is None:
+            model = (self._config or config).get("models.default", "gpt-4o-mini")
+
+        info = self._models.get(model) or self._resolved.get(model)
+        if info is not None:
+            return info
+
+        base = self._match_prefix(model)
+        if base is not None:
+            info = replace(base, name=model)
+        else:
+            info = self._make_info(model, frozenset(), None, None)
+        self._resolved[model] = info
+        return info
+
+    def _match_prefix(self, model: str) -> Optional[ModelInfo]:
+        """既知モデルへの最長プレフィックス一致（gpt-4o-mini-2024-07-18 → gpt-4o-mini）"""
+        lowered = model.lower()
+        best = None
+        for name, info in self._models.items():
+            if lowered.startswith(name + "-") and (best is None or len(name) > len(best.name)):
+                best = info
+        return best
+
+    def is_reasoning(self, model: str = None) -> bool:
+        return self.get(model).is_reasoning
+
+    def supports_temperature(self, model: str = None) -> bool:
+        return self.get(model).supports_temperature
+
+    def supports_vision(self, model: str = None) -> bool:
+        return self.get(model).supports_vision
+
+    def supports_audio(self, model: str = None) -> bool:
+        return self.get(model).supports_audio
+
+    def get_encoding(self, model: str = None) -> str:
+        return self.get(model).encoding
+
+    def get_limits(self, model: str = None) -> Dict[str, int]:
+        return self.get(model).limits
+
+    def get_pricing(self, model: str = None) -> Optional[Dict[str, float]]:
+        return self.get(model).pricing
+
+
+# グローバルモデルレジストリ
+model_registry = ModelRegistry()
+
+
+# ==================================================
+# トークン管理
+# ==================================================
+class TokenManager:
+    """トークン数の管理（新モデル対応）"""
+
+    # モデル別のエンコーディング対応表（ModelRegistry と共有）
+    MODEL_ENCODINGS = ModelRegistry.DEFAULT_ENCODINGS
+
     @classmethod
     def count_tokens(cls, text: str, model: str = None) -> int:
         """テキストのトークン数をカウント"""
@@ -537,8 +896,8 @@ class TokenManager:
             model = config.get("models.default", "gpt-4o-mini")
 
         try:
-            encoding_name = cls.MODEL_ENCODINGS.get(model, "cl100k_base")
-            enc = tiktoken.get_encoding(encoding_name)
+            encoding_name = model_registry.get_encoding(model)
+            enc = lazy_import("tiktoken").get_encoding(encoding_name)
             return len(enc.encode(text))
         except Exception as e:
             logger.error(f"トークンカウントエラー: {e}")
@@ -552,8 +911,8 @@ class TokenManager:
             model = config.get("models.default", "gpt-4o-mini")
 
         try:
-            encoding_name = cls.MODEL_ENCODINGS.get(model, "cl100k_base")
-            enc = tiktoken.get_encoding(encoding_name)
+            encoding_name = model_registry.get_encoding(model)
+            enc = lazy_import("tiktoken").get_encoding(encoding_name)
             tokens = enc.encode(text)
             if len(tokens) <= max_tokens:
                 return text
@@ -569,8 +928,7 @@ class TokenManager:
         if model is None:
             model = config.get("models.default", "gpt-4o-mini")
 
-        pricing = config.get("model_pricing", {})
-        model_pricing = pricing.get(model)
+        model_pricing = model_registry.get_pricing(model)
 
         if not model_pricing:
             # フォールバック
@@ -584,21 +942,148 @@ class TokenManager:
     @classmethod
     def get_model_limits(cls, model: str) -> Dict[str, int]:
         """モデルのトークン制限を取得"""
-        limits = {
-            "gpt-4o"                   : {"max_tokens": 128000, "max_output": 4096},
-            "gpt-4o-mini"              : {"max_tokens": 128000, "max_output": 4096},
-            "gpt-4o-audio-preview"     : {"max_tokens": 128000, "max_output": 4096},
-            "gpt-4o-mini-audio-preview": {"max_tokens": 128000, "max_output": 4096},
-            "gpt-4.1"                  : {"max_tokens": 128000, "max_output": 4096},
-            "gpt-4.1-mini"             : {"max_tokens": 128000, "max_output": 4096},
-            "o1"                       : {"max_tokens": 128000, "max_output": 32768},
-            "o1-mini"                  : {"max_tokens": 128000, "max_output": 65536},
-            "o3"                       : {"max_tokens": 200000, "max_output": 100000},
-            "o3-mini"                  : {"max_tokens": 200000, "max_output": 100000},
-            "o4"                       : {"max_tokens": 256000, "max_output": 128000},
-            "o4-mini"                  : {"max_tokens": 256000, "max_output": 128000},
-        }
-        return limits.get(model, {"max_tokens": 128000, "max_output": 4096})
+        return model_registry.get_limits(model)
+
+    # --------------------------------------------------
+    # 画像入力（タイル方式）のトークン推定
+    # --------------------------------------------------
+    # detail=low は 512px 以内の1枚として固定トークン。
+    # high/auto は 2048px 四方に収めた後、短辺を 768px まで縮小し、512px タイル数で課金。
+    IMAGE_LOW_MAX_SIDE = 512
+    IMAGE_HIGH_MAX_SIDE = 2048
+    IMAGE_HIGH_SHORT_SIDE = 768
+    IMAGE_TILE_SIZE = 512
+    # (基本トークン, タイルあたりトークン)
+    IMAGE_TOKEN_RATES = {
+        "default"    : (85, 170),
+        "gpt-4o-mini": (2833, 5667),
+    }
+
+    @classmethod
+    def fit_image_size(cls, width: int, height: int, detail: str = "auto") -> Tuple[int, int]:
+        """detail 指定時にモデル側で実際に使われる解像度（拡大はしない）"""
+        if width <= 0 or height <= 0:
+            return width, height
+        if detail == "low":
+            scale = min(1.0, cls.IMAGE_LOW_MAX_SIDE / max(width, height))
+        else:
+            scale = min(1.0, cls.IMAGE_HIGH_MAX_SIDE / max(width, height))
+            short_side = min(width, height) * scale
+            if short_side > cls.IMAGE_HIGH_SHORT_SIDE:
+                scale *= cls.IMAGE_HIGH_SHORT_SIDE / short_side
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    @staticmethod
+    def read_image_size(data: bytes) -> Optional[Tuple[int, int]]:
+        """
+        画像ヘッダーから (幅, 高さ) を取得（全体はデコードしない）
+
+        PNG / GIF / WebP は先頭の固定位置、JPEG は SOF マーカーまでセグメントを辿る。
+        判定できない場合は None。
+        """
+        if data.startswith(b"\x89PNG\r\n\x1a\n") and len(data) >= 24:
+            return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+        if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+            return int.from_bytes(data[6:8], "little"), int.from_bytes(data[8:10], "little")
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+            chunk = data[12:16]
+            if chunk == b"VP8X":
+                return 1 + int.from_bytes(data[24:27], "little"), 1 + int.from_bytes(data[27:30], "little")
+            if chunk == b"VP8L":
+                bits = int.from_bytes(data[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8 ":
+                return int.from_bytes(data[26:28], "little") & 0x3FFF, int.from_bytes(data[28:30], "little") & 0x3FFF
+            return None
+        if data[:2] == b"\xff\xd8":
+            # SOF0-SOF15（DHT=C4, JPG=C8, DAC=CC を除く）に寸法がある
+            position = 2
+            while position + 9 <= len(data):
+                if data[position] != 0xFF:
+                    return None
+                marker = data[position + 1]
+                if marker == 0xFF:
+                    position += 1
+                    continue
+                if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                    position += 2
+                    continue
+                length = int.from_bytes(data[position + 2:position + 4], "big")
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height = int.from_bytes(data[position + 5:position + 7], "big")
+                    width = int.from_bytes(data[position + 7:position + 9], "big")
+                    return width, height
+                position += 2 + length
+        return None
+
+    # data URL はヘッダー解析に必要な先頭部分のみデコード（不足時のみ全体）
+    IMAGE_HEADER_BASE64_CHARS = 65536
+
+    @classmethod
+    def image_url_size(cls, image_url: str) -> Optional[Tuple[int, int]]:
+        """画像URL（data URL）から寸法を取得。リモートURLなど判定できない場合は None"""
+        if image_url and image_url.startswith(("http://", "https://")):
+            # 事前確認済みのURLは取得済みの寸法を使う（未確認なら通信はしない）
+            hit, info = image_url_cache.get(image_url)
+            return (info.width, info.height) if hit and info.ok else None
+        if not image_url or not image_url.startswith("data:"):
+            return None
+        _, _, payload = image_url.partition(",")
+        try:
+            head = payload[:cls.IMAGE_HEADER_BASE64_CHARS]
+            size = cls.read_image_size(base64.b64decode(head[:len(head) - len(head) % 4]))
+            if size is None and len(payload) > len(head):
+                size = cls.read_image_size(base64.b64decode(payload))
+            return size
+        except ValueError:
+            return None
+
+    @classmethod
+    def count_message_tokens(cls, messages: List[Any], model: str = None) -> Dict[str, int]:
+        """
+        メッセージリストの入力トークン数を推定（テキスト + 画像）
+
+        画像は data URL ならヘッダーから寸法を読み、タイル方式で見積もる。
+        寸法が分からない画像（リモートURL）は正方形（high で4タイル相当）として扱う。
+        """
+        totals = {"text": 0, "image": 0, "images": 0, "unknown_images": 0}
+
+        def field(obj: Any, name: str, default: Any = None) -> Any:
+            return obj.get(name, default) if isinstance(obj, dict) else getattr(obj, name, default)
+
+        for message in messages:
+            content = field(message, "content", "")
+            if isinstance(content, str):
+                totals["text"] += cls.count_tokens(content, model)
+                continue
+            for part in content or []:
+                part_type = field(part, "type")
+                if part_type in ("input_text", "text", "output_text"):
+                    totals["text"] += cls.count_tokens(field(part, "text", "") or "", model)
+                elif part_type == "input_image":
+                    detail = field(part, "detail", "auto") or "auto"
+                    size = cls.image_url_size(field(part, "image_url", "") or "")
+                    if size is None:
+                        totals["unknown_images"] += 1
+                        size = (cls.IMAGE_HIGH_SHORT_SIDE, cls.IMAGE_HIGH_SHORT_SIDE)
+                    totals["image"] += cls.estimate_image_tokens(*size, detail=detail, model=model)
+                    totals["images"] += 1
+
+        totals["total"] = totals["text"] + totals["image"]
+        return totals
+
+    @classmethod
+    def estimate_image_tokens(cls, width: int, height: int, detail: str = "auto", model: str = None) -> int:
+        """画像1枚の入力トークン数を推定（auto は high として見積もる）"""
+        if model is None:
+            model = config.get("models.default", "gpt-4o-mini")
+        base, per_tile = cls.IMAGE_TOKEN_RATES.get(model, cls.IMAGE_TOKEN_RATES["default"])
+        if detail == "low":
+            return base
+
+        fitted_width, fitted_height = cls.fit_image_size(width, height, detail)
+        tiles = -(-fitted_width // cls.IMAGE_TILE_SIZE) * -(-fitted_height // cls.IMAGE_TILE_SIZE)
+        return base + per_tile * tiles
 
 
 # ==================================================
@@ -610,6 +1095,9 @@ class ResponseProcessor:
     @staticmethod
     def extract_text(response: Response) -> List[str]:
         """レスポンスからテキストを抽出"""
+        if isinstance(response, ResponseSnapshot):
+            return list(response.texts)
+
         texts = []
 
         if hasattr(response, 'output'):
@@ -633,6 +1121,11 @@ class ResponseProcessor:
         if usage_obj is None:
             return {}
 
+        if isinstance(usage_obj, dict):
+            return dict(usage_obj)
+        if isinstance(usage_obj, SimpleNamespace):
+            return dict(vars(usage_obj))
+
         # Pydantic モデルの場合
         if hasattr(usage_obj, 'model_dump'):
             try:
@@ -690,6 +1183,840 @@ class ResponseProcessor:
         return str(filepath)
 
 
+# ==================================================
+# レスポンスの軽量スナップショット
+# ==================================================
+@dataclass(frozen=True)
+class ResponseSnapshot:
+    """
+    Response オブジェクトの軽量射影（id・model・テキスト・usage のみ）
+
+    セッション状態に SDK の Response 全体を保持する代わりに使用する。
+    表示側（ResponseProcessor / display_response）と usage.total_tokens 等の
+    属性アクセスはそのまま利用できる。
+    """
+    id: Optional[str]
+    model: Optional[str]
+    created_at: Any
+    texts: Tuple[str, ...]
+    usage_data: Dict[str, Any]
+
+    @classmethod
+    def from_response(cls, response: Any) -> "ResponseSnapshot":
+        """Response（ParsedResponse含む）からスナップショットを作成"""
+        return cls(
+            id=getattr(response, "id", None),
+            model=getattr(response, "model", None),
+            created_at=getattr(response, "created_at", None),
+            texts=tuple(ResponseProcessor.extract_text(response)),
+            usage_data=ResponseProcessor._serialize_usage(getattr(response, "usage", None)),
+        )
+
+    @property
+    def output_text(self) -> str:
+        return "".join(self.texts)
+
+    @property
+    def usage(self) -> Optional[SimpleNamespace]:
+        """usage を属性アクセス可能な形で返す"""
+        return SimpleNamespace(**self.usage_data) if self.usage_data else None
+
+
+# ==================================================
+# 画像前処理（縮小・再エンコード）
+# ==================================================
+@dataclass(frozen=True)
+class PreparedImage:
+    """
+    API送信用に前処理した画像（Base64データと前後のサイズ情報）
+
+    width/height が None の場合は画像をデコードできず、元データをそのまま使用している。
+    """
+    base64_data: str
+    mime_type: str
+    size: int
+    original_size: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    original_width: Optional[int] = None
+    original_height: Optional[int] = None
+    detail: str = "auto"
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64_data}"
+
+    @property
+    def resized(self) -> bool:
+        return (self.width, self.height) != (self.original_width, self.original_height)
+
+    def estimated_tokens(self, model: str = None) -> Optional[int]:
+        """送信後の画像の推定入力トークン数"""
+        if self.width is None or self.height is None:
+            return None
+        return TokenManager.estimate_image_tokens(self.width, self.height, self.detail, model)
+
+    def original_tokens(self, model: str = None) -> Optional[int]:
+        """元画像をそのまま送った場合の推定入力トークン数"""
+        if self.original_width is None or self.original_height is None:
+            return None
+        return TokenManager.estimate_image_tokens(self.original_width, self.original_height, self.detail, model)
+
+
+class ImagePreprocessor:
+    """
+    画像を一度だけデコードし、detail に応じた解像度へ縮小して最小の形式で再エンコード
+
+    モデル側で縮小される解像度を超える画素は送信しても使われないため、
+    送信前に縮小することでアップロード量を減らす。Pillow が無い・デコードできない
+    画像は元データをそのまま使用する。
+    """
+
+    # 先頭バイト列による形式判定（拡張子に依存しない）
+    SIGNATURES = (
+        (b"\x89PNG\r\n\x1a\n", "image/png"),
+        (b"\xff\xd8\xff", "image/jpeg"),
+        (b"GIF87a", "image/gif"),
+        (b"GIF89a", "image/gif"),
+    )
+    SUPPORTED_MIME_TYPES = ("image/png", "image/jpeg", "image/webp", "image/gif")
+
+    @classmethod
+    def sniff_mime_type(cls, data: bytes, default: str = "application/octet-stream") -> str:
+        """画像データの先頭バイトからMIMEタイプを判定"""
+        for signature, mime_type in cls.SIGNATURES:
+            if data.startswith(signature):
+                return mime_type
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return "image/webp"
+        return default
+
+    @classmethod
+    def passthrough(cls, data: bytes, detail: str = "auto") -> PreparedImage:
+        """前処理せず元データをそのまま使用"""
+        return PreparedImage(
+            base64_data=base64.b64encode(data).decode("utf-8"),
+            mime_type=cls.sniff_mime_type(data, default="image/png"),
+            size=len(data),
+            original_size=len(data),
+            detail=detail,
+        )
+
+    @classmethod
+    def from_base64(cls, base64_data: str, detail: str = "auto") -> PreparedImage:
+        """Base64エンコード済みの元データをそのまま使用（形式は先頭のみデコードして判定）"""
+        try:
+            head = base64.b64decode(base64_data[:24])
+        except ValueError:
+            head = b""
+        size = len(base64_data) * 3 // 4
+        return PreparedImage(
+            base64_data=base64_data,
+            mime_type=cls.sniff_mime_type(head, default="image/png"),
+            size=size,
+            original_size=size,
+            detail=detail,
+        )
+
+    @classmethod
+    def prepare(cls, source: Union[str, Path, bytes], detail: str = "auto",
+                quality: int = None) -> PreparedImage:
+        """画像ファイル（またはバイト列）を送信用に前処理"""
+        data = source if isinstance(source, bytes) else Path(source).read_bytes()
+        if quality is None:
+            quality = config.get("vision.jpeg_quality", 85)
+
+        try:
+            image_module = lazy_import("PIL.Image")
+            image_ops = lazy_import("PIL.ImageOps")
+            image = image_module.open(io.BytesIO(data))
+            image.load()
+        except Exception as e:
+            logger.debug(f"画像をデコードできないため元データを使用: {e}")
+            return cls.passthrough(data, detail)
+
+        original_width, original_height = image.size
+        original_mime = cls.sniff_mime_type(data)
+        # アニメーションGIF等の複数フレーム画像は再エンコードしない
+        if getattr(image, "is_animated", False):
+            return replace(cls.passthrough(data, detail), width=original_width, height=original_height,
+                           original_width=original_width, original_height=original_height)
+
+        image = image_ops.exif_transpose(image)
+        width, height = TokenManager.fit_image_size(*image.size, detail)
+        if (width, height) != image.size:
+            image = image.resize((width, height), image_module.Resampling.LANCZOS)
+
+        candidates = cls._encode_candidates(image, quality)
+        # 縮小不要で元データの方が小さければ元データを使用
+        if (width, height) == (original_width, original_height) and original_mime in cls.SUPPORTED_MIME_TYPES:
+            candidates.append((data, original_mime))
+        encoded, mime_type = min(candidates, key=lambda candidate: len(candidate[0]))
+
+        return PreparedImage(
+            base64_data=base64.b64encode(encoded).decode("utf-8"),
+            mime_type=mime_type,
+            size=len(encoded),
+            original_size=len(data),
+            width=width,
+            height=height,
+            original_width=original_width,
+            original_height=original_height,
+            detail=detail,
+        )
+
+    @staticmethod
+    def _encode_candidates(image, quality: int) -> List[Tuple[bytes, str]]:
+        """透過の有無に応じた形式でエンコードした候補を返す"""
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        candidates = []
+
+        def encode(img, fmt: str, mime_type: str, **params):
+            buffer = io.BytesIO()
+            try:
+                img.save(buffer, format=fmt, **params)
+                candidates.append((buffer.getvalue(), mime_type))
+            except (OSError, KeyError, ValueError) as e:
+                logger.debug(f"{fmt} へのエンコードに失敗: {e}")
+
+        if has_alpha:
+            rgba = image.convert("RGBA")
+            encode(rgba, "PNG", "image/png", optimize=True)
+            encode(rgba, "WEBP", "image/webp", quality=quality)
+        else:
+            rgb = image.convert("RGB")
+            encode(rgb, "JPEG", "image/jpeg", quality=quality, optimize=True, progressive=True)
+            encode(rgb, "WEBP", "image/webp", quality=quality)
+        return candidates
+
+    @classmethod
+    def prepare_file(cls, path: Union[str, Path], detail: str = "auto", quality: int = None) -> PreparedImage:
+        """
+        画像ファイルを前処理（結果をキャッシュ）
+
+        キーは (パス, サイズ, 更新時刻, 前処理パラメータ)。ファイルが変わらない限り
+        stat のみでディスク読み込みと再エンコードを省略する。
+        """
+        if quality is None:
+            quality = config.get("vision.jpeg_quality", 85)
+        resolved = Path(path).resolve()
+        stat = resolved.stat()
+        key = f"{resolved}:{stat.st_size}:{stat.st_mtime_ns}:{detail}:{quality}"
+
+        hit, prepared = image_cache.get(key)
+        if hit:
+            return prepared
+        prepared = cls.prepare(resolved, detail=detail, quality=quality)
+        image_cache.set(key, prepared, size=len(prepared.base64_data))
+        return prepared
+
+
+class ImageDirectoryIndex:
+    """
+    画像フォルダのファイル一覧（フォルダの更新時刻が変わった時のみ再走査）
+
+    ファイルの追加・削除・リネームでフォルダの更新時刻が変わるため、
+    それ以外の再実行では stat 1回で一覧を返す。
+    """
+
+    EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[int, Tuple[str, ...]]] = {}
+        self._lock = threading.Lock()
+
+    def files(self, directory: Union[str, Path]) -> List[str]:
+        """フォルダ内の画像ファイル名（ソート済み）。フォルダが無ければ空リスト"""
+        key = str(Path(directory).resolve())
+        try:
+            mtime = os.stat(key).st_mtime_ns
+        except OSError:
+            return []
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                return list(entry[1])
+
+        with os.scandir(key) as it:
+            names = tuple(sorted(
+                e.name for e in it
+                if e.is_file() and e.name.lower().endswith(self.EXTENSIONS)
+            ))
+        with self._lock:
+            self._entries[key] = (mtime, names)
+        return list(names)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# ==================================================
+# HTTP（コネクションプールの共有）
+# ==================================================
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """プロセス共有の requests.Session（ホストごとに接続を再利用、スレッド間で共有可）"""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                requests = lazy_import("requests")
+                pool_size = config.get("http.pool_maxsize", 16)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers["User-Agent"] = config.get("http.user_agent", "openai-api-jp-demo/1.0")
+                _http_session = session
+    return _http_session
+
+
+# ==================================================
+# 画像URLの事前確認（メタデータ取得・小さい画像の埋め込み）
+# ==================================================
+@dataclass(frozen=True)
+class ImageURLInfo:
+    """画像URLの確認結果（ok=False の場合は error に理由）"""
+    url: str
+    ok: bool
+    status: Optional[int] = None
+    content_type: Optional[str] = None
+    size: Optional[int] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    etag: Optional[str] = None
+    error: Optional[str] = None
+    data_url: Optional[str] = None
+
+    @property
+    def request_url(self) -> str:
+        """API送信用のURL（埋め込み済みなら data URL）"""
+        return self.data_url or self.url
+
+
+class ImageURLProbe:
+    """
+    モデルへ送る前に画像URLを確認する（HEAD → 先頭のみの Range GET）
+
+    到達不能・画像以外・大きすぎるURLはモデル呼び出し前に失敗させる。
+    結果は image_url_cache に TTL 付きで保持し（通信エラーは保持しない）、
+    小さい画像は取得済みのデータを data URL として埋め込む。
+    """
+
+    HEADER_BYTES = 65536
+    # HEAD を受け付けないサーバーが返すステータス（GET で再確認する）
+    HEAD_UNSUPPORTED = (403, 405, 501)
+
+    @classmethod
+    def probe(cls, url: str) -> ImageURLInfo:
+        """画像URLを確認（キャッシュ済みなら通信しない）"""
+        hit, info = image_url_cache.get(url)
+        if hit:
+            return info
+
+        requests = lazy_import("requests")
+        try:
+            info = cls._fetch(url)
+        except requests.RequestException as e:
+            return ImageURLInfo(url=url, ok=False, error=f"接続エラー: {e}")
+        image_url_cache.set(url, info, size=len(info.data_url or "") + 512)
+        return info
+
+    @classmethod
+    def probe_many(cls, urls: List[str], max_workers: int = None) -> List[ImageURLInfo]:
+        """複数URLを並列に確認（入力順で返す）"""
+        infos: List[Optional[ImageURLInfo]] = [None] * len(urls)
+        for index, info, error, _ in iter_concurrent(cls.probe, urls, max_workers=max_workers):
+            infos[index] = info if error is None else ImageURLInfo(url=urls[index], ok=False, error=str(error))
+        return infos
+
+    @classmethod
+    def _fetch(cls, url: str) -> ImageURLInfo:
+        if not url.startswith(("http://", "https://")):
+            return ImageURLInfo(url=url, ok=False, error="http(s) のURLではありません")
+
+        session = get_http_session()
+        timeout = config.get("vision.url_timeout", 5)
+        max_bytes = config.get("vision.url_max_bytes", 20 * 1024 * 1024)
+        inline_max = config.get("vision.inline_max_bytes", 256 * 1024) \
+            if config.get("vision.inline_small_images", True) else 0
+
+        content_type, size, etag = None, None, None
+        head = session.head(url, allow_redirects=True, timeout=timeout)
+        if head.status_code not in cls.HEAD_UNSUPPORTED:
+            if head.status_code >= 400:
+                return ImageURLInfo(url=url, ok=False, status=head.status_code, error=f"HTTP {head.status_code}")
+            content_type, size, etag = cls._parse_headers(head.headers)
+            problem = cls._check(content_type, size, max_bytes)
+            if problem:
+                return ImageURLInfo(url=url, ok=False, status=head.status_code, content_type=content_type,
+                                    size=size, etag=etag, error=problem)
+
+        # 寸法判定用の先頭のみ取得（埋め込み対象のサイズなら全体）
+        limit = inline_max if size is not None and size <= inline_max else cls.HEADER_BYTES
+        with session.get(url, headers={"Range": f"bytes=0-{limit - 1}"}, timeout=timeout,
+                         stream=True, allow_redirects=True) as response:
+            if response.status_code >= 400:
+                return ImageURLInfo(url=url, ok=False, status=response.status_code,
+                                    error=f"HTTP {response.status_code}")
+            data = b""
+            exhausted = True
+            for chunk in response.iter_content(16384):
+                data += chunk
+                if len(data) >= limit:
+                    exhausted = False
+                    break
+            get_type, get_size, get_etag = cls._parse_headers(response.headers)
+            content_type = content_type or get_type
+            etag = etag or get_etag
+            if size is None:
+                # 206 は Content-Range の全体長、Range 非対応の 200 は Content-Length
+                size = get_size if get_size is not None else (len(data) if exhausted else None)
+            status = response.status_code
+
+        dimensions = TokenManager.read_image_size(data)
+        mime_type = ImagePreprocessor.sniff_mime_type(data, default=content_type or "")
+        problem = cls._check(mime_type, size, max_bytes)
+        if problem or dimensions is None:
+            return ImageURLInfo(url=url, ok=False, status=status, content_type=mime_type, size=size, etag=etag,
+                                error=problem or "画像の寸法を判定できません")
+
+        data_url = None
+        complete = size is not None and len(data) >= size
+        if inline_max and complete and size <= inline_max and mime_type in ImagePreprocessor.SUPPORTED_MIME_TYPES:
+            data_url = f"data:{mime_type};base64,{base64.b64encode(data[:size]).decode('utf-8')}"
+
+        return ImageURLInfo(url=url, ok=True, status=status, content_type=mime_type, size=size,
+                            width=dimensions[0], height=dimensions[1], etag=etag, data_url=data_url)
+
+    @staticmethod
+    def _parse_headers(headers) -> Tuple[Optional[str], Optional[int], Optional[str]]:
+        """(Content-Type, 全体サイズ, ETag) をレスポンスヘッダーから取得"""
+        content_type = (headers.get("Content-Type") or "").split(";")[0].strip().lower() or None
+        size = None
+        content_range = headers.get("Content-Range") or ""
+        if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+            size = int(content_range.rsplit("/", 1)[1])
+        elif (headers.get("Content-Length") or "").isdigit():
+            size = int(headers["Content-Length"])
+        return content_type, size, headers.get("ETag")
+
+    @staticmethod
+    def _check(content_type: Optional[str], size: Optional[int], max_bytes: int) -> Optional[str]:
+        """送信可否の確認（問題があれば理由）"""
+        if content_type and not content_type.startswith("image/"):
+            return f"画像ではありません（{content_type}）"
+        if content_type and content_type not in ImagePreprocessor.SUPPORTED_MIME_TYPES:
+            return f"未対応の画像形式です（{content_type}）"
+        if size is not None and size > max_bytes:
+            return f"画像が大きすぎます（{size / 1024 / 1024:.1f} MB > {max_bytes / 1024 / 1024:.0f} MB）"
+        return None
+
+
+# ==================================================
+# 生成画像の保存
+# ==================================================
+class GeneratedImageStore:
+    """
+    生成画像のローカル保存（(モデル, プロンプト, サイズ, 品質) のハッシュがキー）
+
+    画像生成APIのURLは期限切れになるため生成直後のデータを保存し、同じ条件の
+    再要求には保存済みの画像を返す。メタデータは <key>.json、画像は
+    <key>_<内容ハッシュ>.<拡張子> として保存する。
+    """
+
+    EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp", "image/gif": "gif"}
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, size: str, quality: str) -> str:
+        payload = json.dumps([model, prompt, size, quality], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def load(self, key: str) -> List[Dict[str, Any]]:
+        """保存済みのバリエーション一覧（画像ファイルが欠けているものは除外）"""
+        try:
+            meta = json.loads((self.directory / f"{key}.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return []
+        return [variant for variant in meta.get("variants", []) if self.path(variant).exists()]
+
+    def path(self, variant: Dict[str, Any]) -> Path:
+        return self.directory / variant["file"]
+
+    def add(self, key: str, params: Dict[str, Any], data: bytes,
+            revised_prompt: str = None, elapsed: float = None) -> Dict[str, Any]:
+        """バリエーションを1件保存してメタデータを返す"""
+        mime_type = ImagePreprocessor.sniff_mime_type(data, default="image/png")
+        variant = {
+            "file"          : f"{key}_{hashlib.sha256(data).hexdigest()[:16]}.{self.EXTENSIONS.get(mime_type, 'png')}",
+            "revised_prompt": revised_prompt,
+            "elapsed"       : elapsed,
+            "created_at"    : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.path(variant).write_bytes(data)
+            variants = [v for v in self.load(key) if v["file"] != variant["file"]] + [variant]
+            meta_path = self.directory / f"{key}.json"
+            temp_path = meta_path.with_suffix(".json.tmp")
+            temp_path.write_text(json.dumps({"params": params, "variants": variants}, ensure_ascii=False, indent=2),
+                                 encoding="utf-8")
+            os.replace(temp_path, meta_path)
+        return variant
+
+
+generated_image_store = GeneratedImageStore(config.get("image_generation.store_dir", "generated_images"))
+
+
+# 前処理済み画像のキャッシュ（プロセス共有）と画像フォルダの一覧
+image_cache = SharedCache(
+    max_size=config.get("vision.cache_max_entries", 64),
+    max_bytes=config.get("vision.cache_max_bytes", 64 * 1024 * 1024),
+    ttl=config.get("vision.cache_ttl", 86400),
+)
+image_index = ImageDirectoryIndex()
+# 画像URLの確認結果（メタデータと埋め込み用データ）
+image_url_cache = SharedCache(
+    max_size=config.get("vision.url_cache_max_entries", 256),
+    max_bytes=config.get("vision.cache_max_bytes", 64 * 1024 * 1024),
+    ttl=config.get("vision.url_cache_ttl", 600),
+)
+
+
+# ==================================================
+# 都市データ（天気デモ用）
+# ==================================================
+class CityTable:
+    """
+    日本の都市データ（列指向: 都市名・緯度・経度・ID）と検索インデックス
+
+    city_jp.list.json の解析は初回のみ行い、結果を .npz（緯度経度は float32）に
+    保存する。以降の起動では .npz を読み込むだけで済む。都市名→行の辞書で O(1) に
+    引け、前方一致は二分探索、部分一致はベクトル化した文字列検索で絞り込む。
+    座標からの検索（半径内・最近傍）は緯度経度のグリッドで候補を絞り、
+    候補のみハーバサイン距離をまとめて計算する。
+    """
+
+    CACHE_VERSION = 1
+    EARTH_RADIUS_KM = 6371.0088
+    KM_PER_DEGREE = 111.195
+    GRID_DEGREES = 0.5
+
+    def __init__(self, names, lat, lon, ids):
+        np = lazy_import("numpy")
+        order = np.argsort(names, kind="stable")
+        self.names = np.asarray(names)[order]
+        self.lat = np.asarray(lat, dtype=np.float32)[order]
+        self.lon = np.asarray(lon, dtype=np.float32)[order]
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+
+        # 都市名→行（同名の都市はソート順で最初の行）
+        self._rows: Dict[str, int] = {}
+        for row, name in enumerate(self.names.tolist()):
+            self._rows.setdefault(name, row)
+        self.unique_names: List[str] = list(self._rows)
+
+        # 検索用（小文字化した都市名と、その並び順）
+        self._lower = np.char.lower(self.names)
+        self._prefix_order = np.argsort(self._lower, kind="stable")
+        self._prefix_keys = self._lower[self._prefix_order]
+
+        # 空間検索用グリッド（初回の座標検索で作成）
+        self._grid: Optional[Tuple[Any, Dict[Tuple[int, int], Tuple[int, int]]]] = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_json(cls, json_path: Union[str, Path]) -> "CityTable":
+        """city_jp.list.json（OpenWeatherMapの都市リスト形式）から作成"""
+        with open(json_path, "r", encoding="utf-8") as f:
+            cities = json.load(f)
+        return cls(
+            [city["name"] for city in cities],
+            [city["coord"]["lat"] for city in cities],
+            [city["coord"]["lon"] for city in cities],
+            [city["id"] for city in cities],
+        )
+
+    @classmethod
+    def load(cls, json_path: Union[str, Path], cache_path: Union[str, Path] = None) -> "CityTable":
+        """
+        .npz キャッシュがJSONと同じ版（サイズ・更新時刻）なら読み込み、無ければJSONから作成して保存
+        """
+        np = lazy_import("numpy")
+        json_path = Path(json_path)
+        cache_path = Path(cache_path) if cache_path else json_path.with_suffix(".npz")
+        stat = json_path.stat()
+        source = np.array([cls.CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+        try:
+            with np.load(cache_path) as data:
+                if np.array_equal(data["source"], source):
+                    return cls(data["names"], data["lat"], data["lon"], data["ids"])
+        except (OSError, KeyError, ValueError):
+            pass
+
+        table = cls.from_json(json_path)
+        try:
+            temp_path = cache_path.with_suffix(".npz.tmp")
+            with open(temp_path, "wb") as f:
+                np.savez(f, names=table.names, lat=table.lat, lon=table.lon, ids=table.ids, source=source)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.debug(f"都市データキャッシュを保存できません: {e}")
+        return table
+
+    def row(self, name: str) -> Optional[int]:
+        return self._rows.get(name)
+
+    def lookup(self, name: str) -> Optional[Tuple[str, float, float]]:
+        """都市名 → (都市名, 緯度, 経度)。見つからなければ None"""
+        row = self._rows.get(name)
+        if row is None:
+            return None
+        return name, float(self.lat[row]), float(self.lon[row])
+
+    def search(self, query: str, limit: int = None) -> List[str]:
+        """
+        都市名の検索（大文字小文字を区別しない）。前方一致を先に、続けて部分一致を返す
+
+        空のクエリでは全都市名を返す。
+        """
+        np = lazy_import("numpy")
+        query = (query or "").strip().lower()
+        if not query:
+            return self.unique_names[:limit]
+
+        lo = np.searchsorted(self._prefix_keys, query, side="left")
+        hi = np.searchsorted(self._prefix_keys, query + "\uffff", side="left")
+        prefix_rows = np.sort(self._prefix_order[lo:hi])
+        substring_rows = np.flatnonzero(np.char.find(self._lower, query) > 0)
+
+        names = dict.fromkeys(self.names[np.concatenate([prefix_rows, substring_rows])].tolist())
+        return list(names)[:limit]
+
+    # ---------- 座標からの検索 ----------
+    def _build_grid(self):
+        """GRID_DEGREES 四方のセル→行範囲（行はセル順に並べ替えて保持）"""
+        np = lazy_import("numpy")
+        cell_lat = np.floor(self.lat / self.GRID_DEGREES).astype(np.int64)
+        cell_lon = np.floor(self.lon / self.GRID_DEGREES).astype(np.int64)
+        order = np.lexsort((cell_lon, cell_lat))
+        cells = np.stack([cell_lat[order], cell_lon[order]], axis=1)
+        starts = np.flatnonzero(np.any(np.diff(cells, axis=0) != 0, axis=1)) + 1
+        bounds = np.concatenate([[0], starts, [len(order)]])
+        spans = {
+            (int(cells[lo, 0]), int(cells[lo, 1])): (int(lo), int(hi))
+            for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo
+        }
+        return order, spans
+
+    def distances_km(self, lat: float, lon: float, rows=None):
+        """(lat, lon) から各行（rows 指定時はその行のみ）までの大円距離 [km]"""
+        np = lazy_import("numpy")
+        lat1, lon1 = np.radians(lat), np.radians(lon)
+        lat2 = np.radians(self.lat if rows is None else self.lat[rows], dtype=np.float64)
+        lon2 = np.radians(self.lon if rows is None else self.lon[rows], dtype=np.float64)
+        a = (np.sin((lat2 - lat1) / 2) ** 2
+             + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+        return 2 * self.EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def _candidate_rows(self, lat: float, lon: float, radius_km: float):
+        """半径 radius_km の円を含むグリッドセルの行（セルが多すぎる場合は全行）"""
+        np = lazy_import("numpy")
+        if self._grid is None:
+            self._grid = self._build_grid()
+        order, spans = self._grid
+
+        span_lat = radius_km / self.KM_PER_DEGREE
+        max_lat = min(abs(lat) + span_lat, 89.0)
+        span_lon = span_lat / math.cos(math.radians(max_lat))
+        lat_cells = range(math.floor((lat - span_lat) / self.GRID_DEGREES),
+                          math.floor((lat + span_lat) / self.GRID_DEGREES) + 1)
+        lon_cells = range(math.floor((lon - span_lon) / self.GRID_DEGREES),
+                          math.floor((lon + span_lon) / self.GRID_DEGREES) + 1)
+        if span_lon >= 180 or len(lat_cells) * len(lon_cells) > len(spans):
+            return np.arange(len(self))
+
+        slices = [spans[(i, j)] for i in lat_cells for j in lon_cells if (i, j) in spans]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([order[lo:hi] for lo, hi in slices])
+
+    def _records(self, rows, distances) -> List[Dict[str, Any]]:
+        return [
+            {
+                "name"       : name,
+                "id"         : int(city_id),
+                "lat"        : round(float(lat), 5),
+                "lon"        : round(float(lon), 5),
+                "distance_km": round(float(distance), 2),
+            }
+            for name, city_id, lat, lon, distance in zip(
+                self.names[rows].tolist(), self.ids[rows], self.lat[rows], self.lon[rows], distances
+            )
+        ]
+
+    def within(self, lat: float, lon: float, radius_km: float, limit: int = None) -> List[Dict[str, Any]]:
+        """半径 radius_km 以内の都市（近い順）"""
+        np = lazy_import("numpy")
+        rows = self._candidate_rows(lat, lon, radius_km)
+        distances = self.distances_km(lat, lon, rows)
+        inside = distances <= radius_km
+        rows, distances = rows[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")[:limit]
+        return self._records(rows[order], distances[order])
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> List[Dict[str, Any]]:
+        """最も近い k 都市（近い順）"""
+        if len(self) == 0 or k <= 0:
+            return []
+        # 半径を広げながら k 件以上含む円を探す（円内の k 件は円外のどの都市より近い）
+        radius_km = 25.0
+        while True:
+            found = self.within(lat, lon, radius_km, limit=k)
+            if len(found) >= min(k, len(self)) or radius_km > math.pi * self.EARTH_RADIUS_KM:
+                return found
+            radius_km *= 4
+
+
+_city_tables: Dict[str, Tuple[Tuple[int, int], CityTable]] = {}
+_city_tables_lock = threading.Lock()
+
+
+def get_city_table(json_path: Union[str, Path]) -> CityTable:
+    """プロセス共有の都市テーブル（JSONが更新された時のみ再読み込み）"""
+    key = str(Path(json_path).resolve())
+    stat = os.stat(key)
+    version = (stat.st_size, stat.st_mtime_ns)
+    with _city_tables_lock:
+        entry = _city_tables.get(key)
+        if entry is None or entry[0] != version:
+            entry = (version, CityTable.load(key))
+            _city_tables[key] = entry
+    return entry[1]
+
+
+def find_nearby_cities(latitude: float, longitude: float, radius_km: float = None,
+                       limit: int = 5, json_path: Union[str, Path] = None) -> Dict[str, Any]:
+    """
+    座標から近くの都市を検索（Function Calling のツール実装として JSON 化できる dict を返す）
+
+    radius_km 指定時は半径内の都市、未指定時は最も近い limit 都市を返す。
+    """
+    json_path = json_path or config.get("paths.cities_json", "data/city_jp.list.json")
+    try:
+        table = get_city_table(json_path)
+    except OSError as e:
+        return {"error": f"都市データを読み込めません: {e}"}
+
+    if radius_km is None:
+        cities = table.nearest(latitude, longitude, k=limit)
+    else:
+        cities = table.within(latitude, longitude, radius_km, limit=limit)
+    return {"latitude": latitude, "longitude": longitude, "radius_km": radius_km, "cities": cities}
+
+
+# ==================================================
+# 天気API（OpenWeatherMap）
+# ==================================================
+@dataclass
+class WeatherFetch:
+    """天気APIの1リクエスト分の結果（失敗時は data=None で error に例外）"""
+    endpoint: str
+    data: Optional[Dict[str, Any]]
+    elapsed: float
+    cached: bool = False
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.data is not None
+
+
+class WeatherClient:
+    """
+    OpenWeatherMap クライアント（接続共有・並列取得・TTLキャッシュ）
+
+    共有セッションでコネクションを再利用し、現在の天気と予報を並列に取得する。
+    応答は丸めた座標・単位・言語をキーに weather_cache に保持するため、
+    同じ地点の再取得は通信しない（通信エラーは保持しない）。
+    """
+
+    def __init__(self, base_url: str = None, cache: SharedCache = None):
+        self.base_url = (base_url or config.get("weather.base_url", "https://api.openweathermap.org/data/2.5")).rstrip("/")
+        self.cache = cache if cache is not None else weather_cache
+
+    @staticmethod
+    def api_key() -> Optional[str]:
+        return os.getenv("OPENWEATHER_API_KEY")
+
+    @staticmethod
+    def round_coord(value: float) -> float:
+        """キャッシュキー・リクエスト用の座標（既定は小数2桁 ≒ 1km）"""
+        return round(float(value), config.get("weather.coord_precision", 2))
+
+    def cache_key(self, endpoint: str, lat: float, lon: float, units: str, lang: Optional[str]) -> str:
+        return f"{self.base_url}/{endpoint}:{self.round_coord(lat)}:{self.round_coord(lon)}:{units}:{lang}"
+
+    def fetch(self, endpoint: str, lat: float, lon: float,
+              units: str = "metric", lang: Optional[str] = "ja") -> WeatherFetch:
+        """1エンドポイント（weather / forecast）を取得（キャッシュ済みなら通信しない）"""
+        start = time.perf_counter()
+        key = self.cache_key(endpoint, lat, lon, units, lang)
+        hit, data = self.cache.get(key)
+        if hit:
+            return WeatherFetch(endpoint, data, time.perf_counter() - start, cached=True)
+
+        params = {
+            "lat"  : self.round_coord(lat),
+            "lon"  : self.round_coord(lon),
+            "appid": self.api_key(),
+            "units": units,
+        }
+        if lang:
+            params["lang"] = lang
+        try:
+            response = get_http_session().get(
+                f"{self.base_url}/{endpoint}", params=params,
+                timeout=config.get("weather.timeout", 10)
+            )
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            logger.debug(f"Weather API error ({endpoint}): {e}")
+            return WeatherFetch(endpoint, None, time.perf_counter() - start, error=e)
+
+        self.cache.set(key, data)
+        return WeatherFetch(endpoint, data, time.perf_counter() - start)
+
+    def fetch_many(self, endpoints: List[str], lat: float, lon: float,
+                   units: str = "metric", lang: Optional[str] = "ja") -> Dict[str, WeatherFetch]:
+        """複数エンドポイントを並列に取得（全体の所要時間はおおよそ最も遅い1件分）"""
+        results: Dict[str, WeatherFetch] = {}
+        fetch = lambda endpoint: self.fetch(endpoint, lat, lon, units, lang)
+        for index, result, error, elapsed in iter_concurrent(fetch, endpoints, max_workers=len(endpoints)):
+            results[endpoints[index]] = result if error is None else WeatherFetch(endpoints[index], None, elapsed, error=error)
+        return results
+
+
+weather_cache = SharedCache(
+    max_size=config.get("weather.cache_max_entries", 512),
+    ttl=config.get("weather.cache_ttl", 600),
+)
+weather_client = WeatherClient()
+
+
 # ==================================================
 # APIクライアント
 # ==================================================
@@ -843,6 +2170,32 @@ def create_session_id() -> str:
     return hashlib.md5(f"{time.time()}_{id(object())}".encode()).hexdigest()[:8]
 
 
+def iter_concurrent(func: Callable[[Any], Any], items: List[Any],
+                    max_workers: int = None) -> Iterator[Tuple[int, Any, Optional[Exception], float]]:
+    """
+    items をスレッドプールで並列処理し、完了順に (入力位置, 結果, 例外, 所要秒) を返す
+
+    同時実行数は max_workers（既定は concurrency.max_workers）で制限する。
+    例外は項目ごとに扱えるよう送出せずに返す。func 内で Streamlit を操作しないこと。
+    """
+    if not items:
+        return
+    max_workers = max(1, min(max_workers or config.get("concurrency.max_workers", 4), len(items)))
+
+    def timed(item):
+        start = time.perf_counter()
+        try:
+            return func(item), None, time.perf_counter() - start
+        except Exception as e:
+            return None, e, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="demo-worker") as executor:
+        futures = {executor.submit(timed, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            result, error, elapsed = future.result()
+            yield futures[future], result, error, elapsed
+
+
 # ==================================================
 # エクスポート（重複定数を削除）
 # ==================================================
@@ -855,8 +2208,22 @@ __all__ = [
     'MessageManager',
     'TokenManager',
     'ResponseProcessor',
+    'ResponseSnapshot',
+    'PreparedImage',
+    'ImagePreprocessor',
+    'ImageDirectoryIndex',
+    'ImageURLInfo',
+    'ImageURLProbe',
+    'GeneratedImageStore',
+    'CityTable',
+    'WeatherFetch',
+    'WeatherClient',
     'OpenAIClient',
     'MemoryCache',
+    'SharedCache',
+    'StartupProfiler',
+    'ModelInfo',
+    'ModelRegistry',
 
     # デコレータ
     'error_handler',
@@ -864,11 +2231,16 @@ __all__ = [
     'cache_result',
 
     # ユーティリティ
+    'lazy_import',
     'sanitize_key',
     'load_json_file',
     'save_json_file',
     'format_timestamp',
     'create_session_id',
+    'iter_concurrent',
+    'get_http_session',
+    'get_city_table',
+    'find_nearby_cities',
     'safe_json_serializer',
     'safe_json_dumps',
 
@@ -882,4 +2254,12 @@ __all__ = [
     'config',
     'logger',
     'cache',
+    'image_cache',
+    'image_index',
+    'image_url_cache',
+    'generated_image_store',
+    'weather_cache',
+    'weather_client',
+    'model_registry',
+    'startup_profiler',
 ]
@@ -1,15 +1,21 @@
 # helper_st.py
 # Streamlit UI関連機能
 # -----------------------------------------
-from functools import wraps
-from typing import List, Dict, Any, Optional, Union, Tuple
+from functools import wraps, lru_cache
+from typing import List, Dict, Any, Optional, Union, Tuple, Callable
 from datetime import datetime
 from abc import ABC, abstractmethod
 import json
 import time
 import traceback
+import hashlib
+import uuid
+from array import array
+from collections import OrderedDict
+from types import SimpleNamespace
 
 import streamlit as st
+from pydantic import BaseModel
 
 from openai.types.responses import (
     EasyInputMessageParam,
@@ -26,6 +32,11 @@ from helper_api import (
     # クラス
     ConfigManager,
     MessageManager,
+    SharedCache,
+    ResponseSnapshot,
+    PreparedImage,
+    ImageURLInfo,
+    ImageURLProbe,
     TokenManager,
     ResponseProcessor,
     OpenAIClient,
@@ -41,6 +52,10 @@ from helper_api import (
     config,
     logger,
     cache,
+    image_cache,
+    model_registry,
+    lazy_import,
+    startup_profiler,
 )
 
 
@@ -90,66 +105,66 @@ def timer_ui(func):
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         result = func(*args, **kwargs)
-        end_time = datetime.now()
-        execution_time = (end_time - start_time).total_seconds()
+        execution_time = time.perf_counter() - start_time
 
         logger.info(f"{func.__name__} took {execution_time:.2f} seconds")
 
         # パフォーマンスモニタリングが有効な場合
         if config.get("experimental.performance_monitoring", True):
-            if 'performance_metrics' not in st.session_state:
-                st.session_state.performance_metrics = []
-            st.session_state.performance_metrics.append({
-                'function'      : func.__name__,
-                'execution_time': execution_time,
-                'timestamp'     : datetime.now()
-            })
+            SessionStateManager.get_performance_metrics().record(func.__name__, execution_time)
 
         return result
 
     return wrapper
 
 
-def cache_result_ui(ttl: int = None):
-    """結果をキャッシュするデコレータ（Streamlit session_state用）"""
+@st.cache_resource(show_spinner=False)
+def get_shared_ui_cache() -> SharedCache:
+    """プロセス共有のUIキャッシュ（全セッションで1インスタンス）"""
+    return SharedCache()
+
+
+def _session_cache_namespace() -> str:
+    """セッション分離用の名前空間（セッションごとに一意）"""
+    if '_cache_session_id' not in st.session_state:
+        st.session_state['_cache_session_id'] = uuid.uuid4().hex
+    return f"session:{st.session_state['_cache_session_id']}:"
+
+
+def cache_result_ui(ttl: int = None, per_session: bool = False):
+    """
+    結果をキャッシュするデコレータ（Streamlit用）
+
+    既定ではプロセス共有キャッシュに保存し、全セッションで結果を再利用する。
+    ユーザー固有データを扱う関数は per_session=True でセッション単位に分離する
+    （分離時も同じ共有ストアに載るため、メモリ上限は全体で管理される）。
+    """
 
     def decorator(func):
+        func_id = f"{func.__module__}.{func.__qualname__}"
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             if not config.get("cache.enabled", True):
                 return func(*args, **kwargs)
 
             # キャッシュキーの生成
-            import hashlib
-            cache_key = f"{func.__name__}_{hashlib.md5(str(args).encode() + str(kwargs).encode()).hexdigest()}"
-
-            # セッションステートにキャッシュ領域を確保
-            if 'ui_cache' not in st.session_state:
-                st.session_state.ui_cache = {}
+            digest = hashlib.md5(str(args).encode() + str(kwargs).encode()).hexdigest()
+            cache_key = f"{func_id}_{digest}"
+            if per_session:
+                cache_key = _session_cache_namespace() + cache_key
 
             # キャッシュの確認
-            if cache_key in st.session_state.ui_cache:
-                cached_data = st.session_state.ui_cache[cache_key]
-                if time.time() - cached_data['timestamp'] < (ttl or config.get("cache.ttl", 3600)):
-                    return cached_data['result']
+            shared_cache = get_shared_ui_cache()
+            hit, cached_result = shared_cache.get(cache_key, ttl=ttl)
+            if hit:
+                return cached_result
 
             # 関数実行とキャッシュ保存
             result = func(*args, **kwargs)
-            st.session_state.ui_cache[cache_key] = {
-                'result'   : result,
-                'timestamp': time.time()
-            }
-
-            # キャッシュサイズ制限
-            max_size = config.get("cache.max_size", 100)
-            if len(st.session_state.ui_cache) > max_size:
-                # 最も古いエントリを削除
-                oldest_key = min(st.session_state.ui_cache,
-                                 key=lambda k: st.session_state.ui_cache[k]['timestamp'])
-                del st.session_state.ui_cache[oldest_key]
-
+            shared_cache.set(cache_key, result)
             return result
 
         return wrapper
@@ -157,6 +172,138 @@ def cache_result_ui(ttl: int = None):
     return decorator
 
 
+# ==================================================
+# メッセージ描画キャッシュ
+# ==================================================
+@lru_cache(maxsize=2048)
+def _render_markdown(role: str, content: Any) -> str:
+    """
+    メッセージ本文を表示用Markdownに変換（メッセージ単位でキャッシュ）
+
+    str はハッシュ値をオブジェクト内に保持するため、2回目以降の参照は本文長に依存しない。
+    """
+    text = content if isinstance(content, str) else str(content)
+    if role in ("developer", "system"):
+        return f"*{text}*"
+    return text
+
+
+# ==================================================
+# パフォーマンスメトリクス（リングバッファ）
+# ==================================================
+class PerformanceMetrics:
+    """
+    固定容量のリングバッファによる実行時間メトリクス
+
+    実行時間・タイムスタンプは array('d') に保持し、容量を超えると古いものから上書きする。
+    件数・平均・最小・最大は全期間のストリーミング集計として O(1) で更新し、
+    パーセンタイルは直近ウィンドウ（容量以内）から算出する。
+    """
+
+    def __init__(self, capacity: int = None):
+        self.capacity = max(1, int(capacity or config.get("experimental.metrics_capacity", 500)))
+        self._times = array('d', bytes(8 * self.capacity))
+        self._stamps = array('d', bytes(8 * self.capacity))
+        self._func_ids = array('I', bytes(4 * self.capacity))
+        self._func_names: List[str] = []
+        self._func_index: Dict[str, int] = {}
+        self._head = 0  # 次の書き込み位置
+        self._size = 0
+        self.clear_aggregates()
+
+    def clear_aggregates(self):
+        """全期間の集計値をリセット"""
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def record(self, function: str, execution_time: float, timestamp: float = None):
+        """実行時間を1件記録（O(1)）"""
+        func_id = self._func_index.get(function)
+        if func_id is None:
+            func_id = self._func_index[function] = len(self._func_names)
+            self._func_names.append(function)
+
+        self._times[self._head] = execution_time
+        self._stamps[self._head] = timestamp if timestamp is not None else time.time()
+        self._func_ids[self._head] = func_id
+        self._head = (self._head + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+        self.count += 1
+        self.total += execution_time
+        self.min = min(self.min, execution_time)
+        self.max = max(self.max, execution_time)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __repr__(self) -> str:
+        return f"PerformanceMetrics(size={self._size}/{self.capacity}, count={self.count}, mean={self.mean:.3f}s)"
+
+    @property
+    def mean(self) -> float:
+        """全期間の平均実行時間"""
+        return self.total / self.count if self.count else 0.0
+
+    def _indices(self, n: int = None) -> List[int]:
+        """直近 n 件のバッファ位置（古い順）"""
+        n = self._size if n is None else min(n, self._size)
+        start = (self._head - n) % self.capacity
+        return [(start + i) % self.capacity for i in range(n)]
+
+    def times(self, n: int = None) -> List[float]:
+        """直近 n 件の実行時間（古い順）"""
+        return [self._times[i] for i in self._indices(n)]
+
+    def recent(self, n: int = None) -> List[Dict[str, Any]]:
+        """直近 n 件の記録（古い順）"""
+        return [
+            {
+                'function'      : self._func_names[self._func_ids[i]],
+                'execution_time': self._times[i],
+                'timestamp'     : datetime.fromtimestamp(self._stamps[i]),
+            }
+            for i in self._indices(n)
+        ]
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """最新の記録"""
+        records = self.recent(1)
+        return records[0] if records else None
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], q: float) -> float:
+        """線形補間によるパーセンタイル（q は 0〜100）"""
+        if not sorted_values:
+            return 0.0
+        pos = (len(sorted_values) - 1) * q / 100
+        lower = int(pos)
+        upper = min(lower + 1, len(sorted_values) - 1)
+        return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+    def summary(self, n: int = None) -> Dict[str, float]:
+        """直近 n 件の集計（件数・平均・最小・最大・p50/p95）"""
+        values = sorted(self.times(n))
+        if not values:
+            return {"count": 0, "mean": 0.0, "min": 0.0, "max": 0.0, "p50": 0.0, "p95": 0.0}
+        return {
+            "count": len(values),
+            "mean" : sum(values) / len(values),
+            "min"  : values[0],
+            "max"  : values[-1],
+            "p50"  : self._percentile(values, 50),
+            "p95"  : self._percentile(values, 95),
+        }
+
+    def clear(self):
+        """全記録のクリア"""
+        self._head = 0
+        self._size = 0
+        self.clear_aggregates()
+
+
 # ==================================================
 # セッション状態管理
 # ==================================================
@@ -169,8 +316,7 @@ class SessionStateManager:
         try:
             if 'initialized' not in st.session_state:
                 st.session_state.initialized = True
-                st.session_state.ui_cache = {}
-                st.session_state.performance_metrics = []
+                st.session_state.performance_metrics = PerformanceMetrics()
                 st.session_state.user_preferences = {}
         except Exception:
             pass
@@ -188,15 +334,143 @@ class SessionStateManager:
         st.session_state.user_preferences[key] = value
 
     @staticmethod
-    def clear_cache():
-        """UIキャッシュのクリア"""
-        st.session_state.ui_cache = {}
+    def clear_cache(shared: bool = False):
+        """UIキャッシュのクリア（shared=True で全セッション共有分も含めてクリア）"""
+        shared_cache = get_shared_ui_cache()
+        if shared:
+            shared_cache.clear()
+        elif '_cache_session_id' in st.session_state:
+            shared_cache.delete_prefix(_session_cache_namespace())
         cache.clear()
 
     @staticmethod
-    def get_performance_metrics() -> List[Dict[str, Any]]:
-        """パフォーマンスメトリクスの取得"""
-        return st.session_state.get('performance_metrics', [])
+    def get_performance_metrics() -> PerformanceMetrics:
+        """パフォーマンスメトリクス（セッション単位のリングバッファ）の取得"""
+        metrics = st.session_state.get('performance_metrics')
+        if not isinstance(metrics, PerformanceMetrics):
+            metrics = PerformanceMetrics()
+            st.session_state['performance_metrics'] = metrics
+        return metrics
+
+
+# ==================================================
+# セッションメモリ管理
+# ==================================================
+class SessionMemoryManager:
+    """
+    セッション状態に保持するデモ結果のメモリ管理
+
+    Response は ResponseSnapshot、pydantic モデルは属性アクセス可能な軽量オブジェクトに
+    射影してから保存する。保存キーごとの推定バイト数をデモ単位（group）で集計し、
+    セッションの上限（session.memory_budget_mb）を超えた場合は
+    最も長く使われていないデモの状態から順に削除する。
+    """
+
+    INDEX_KEY = "_session_memory_index"
+
+    @staticmethod
+    def project(value: Any) -> Any:
+        """保存用の軽量射影（Response / pydantic モデル / それらのリスト）"""
+        if isinstance(value, Response):
+            return ResponseSnapshot.from_response(value)
+        if isinstance(value, BaseModel):
+            return SimpleNamespace(**value.model_dump())
+        if isinstance(value, list):
+            return [SessionMemoryManager.project(v) for v in value]
+        return value
+
+    @staticmethod
+    def _index() -> "OrderedDict[str, Dict[str, Any]]":
+        """キー → {group, bytes} のLRUインデックス（先頭が最も古い）"""
+        index = st.session_state.get(SessionMemoryManager.INDEX_KEY)
+        if not isinstance(index, OrderedDict):
+            index = OrderedDict()
+            st.session_state[SessionMemoryManager.INDEX_KEY] = index
+        return index
+
+    @staticmethod
+    def budget_bytes() -> int:
+        return int(config.get("session.memory_budget_mb", 16) * 1024 * 1024)
+
+    @staticmethod
+    def _touch_group(index: "OrderedDict[str, Dict[str, Any]]", group: str):
+        """グループ内の全キーを最近使用へ移動"""
+        for key in [k for k, v in index.items() if v["group"] == group]:
+            index.move_to_end(key)
+
+    @staticmethod
+    def store(key: str, value: Any, group: str) -> Any:
+        """値を射影して保存し、必要なら予算超過分を追い出す"""
+        value = SessionMemoryManager.project(value)
+        st.session_state[key] = value
+
+        index = SessionMemoryManager._index()
+        index[key] = {"group": group, "bytes": SharedCache.estimate_size(value)}
+        SessionMemoryManager._touch_group(index, group)
+        SessionMemoryManager._enforce_budget(index, keep_group=group)
+        return value
+
+    @staticmethod
+    def append(key: str, item: Any, group: str) -> Any:
+        """リスト値に1件追加（サイズは追加分のみ加算）"""
+        item = SessionMemoryManager.project(item)
+        items = st.session_state.get(key)
+        if not isinstance(items, list):
+            items = []
+            st.session_state[key] = items
+        items.append(item)
+
+        index = SessionMemoryManager._index()
+        entry = index.get(key)
+        if entry is None:
+            entry = index[key] = {"group": group, "bytes": SharedCache.estimate_size(items)}
+        else:
+            entry["bytes"] += SharedCache.estimate_size(item)
+        SessionMemoryManager._touch_group(index, group)
+        SessionMemoryManager._enforce_budget(index, keep_group=group)
+        return item
+
+    @staticmethod
+    def get(key: str, default: Any = None) -> Any:
+        """値の取得（そのデモの状態を最近使用として記録）"""
+        index = SessionMemoryManager._index()
+        if key in index:
+            SessionMemoryManager._touch_group(index, index[key]["group"])
+        return st.session_state.get(key, default)
+
+    @staticmethod
+    def forget(key: str):
+        """値の削除"""
+        SessionMemoryManager._index().pop(key, None)
+        if key in st.session_state:
+            del st.session_state[key]
+
+    @staticmethod
+    def _enforce_budget(index: "OrderedDict[str, Dict[str, Any]]", keep_group: str = None):
+        """予算超過時、LRU順にデモ単位で状態を削除"""
+        budget = SessionMemoryManager.budget_bytes()
+        total = sum(v["bytes"] for v in index.values())
+        while total > budget:
+            victim = next((v["group"] for v in index.values() if v["group"] != keep_group), None)
+            if victim is None:
+                break
+            for key in [k for k, v in index.items() if v["group"] == victim]:
+                total -= index.pop(key)["bytes"]
+                if key in st.session_state:
+                    del st.session_state[key]
+            logger.info(f"Session memory budget exceeded: evicted state of '{victim}'")
+
+    @staticmethod
+    def footprint() -> Dict[str, Any]:
+        """セッションの推定メモリ使用量（合計・デモ別）"""
+        groups: Dict[str, int] = {}
+        for entry in SessionMemoryManager._index().values():
+            groups[entry["group"]] = groups.get(entry["group"], 0) + entry["bytes"]
+        return {
+            "total_bytes" : sum(groups.values()),
+            "budget_bytes": SessionMemoryManager.budget_bytes(),
+            "groups"      : groups,
+        }
 
 
 # ==================================================
@@ -318,8 +592,7 @@ class UIHelper:
             st.write("**パフォーマンス**")
             metrics = SessionStateManager.get_performance_metrics()
             if metrics:
-                avg_time = sum(m['execution_time'] for m in metrics[-10:]) / min(len(metrics), 10)
-                st.metric("平均実行時間（直近10回）", f"{avg_time:.2f}s")
+                st.metric("平均実行時間（直近10回）", f"{metrics.summary(10)['mean']:.2f}s")
 
     @staticmethod
     def select_model(key: str = "model_selection", category: str = None, show_info: bool = True) -> str:
@@ -330,13 +603,13 @@ class UIHelper:
         # カテゴリでフィルタリング
         if category:
             if category == "reasoning":
-                models = [m for m in models if m.startswith("o")]
+                models = [m for m in models if model_registry.get(m).in_category("reasoning")]
                 st.sidebar.caption("🧠 推論特化モデル")
             elif category == "standard":
                 models = [m for m in models if m.startswith("gpt")]
                 st.sidebar.caption("💬 標準対話モデル")
             elif category == "audio":
-                models = [m for m in models if "audio" in m]
+                models = [m for m in models if model_registry.supports_audio(m)]
                 st.sidebar.caption("🎵 音声対応モデル")
 
         default_index = models.index(default_model) if default_model in models else 0
@@ -386,13 +659,40 @@ class UIHelper:
             return user_input, submitted
 
     @staticmethod
-    def display_messages(messages: List[EasyInputMessageParam], show_system: bool = False):
-        """メッセージ履歴の表示（改良版）"""
+    def paginate_window(total: int, key: str, page_size: int = None) -> int:
+        """
+        表示ウィンドウの開始位置を返す（末尾 page_size 件から表示）
+
+        古い要素は「以前の○件を表示」ボタンで page_size 件ずつ段階的に展開する。
+        """
+        page_size = page_size or config.get("ui.message_page_size", 20)
+        state_key = f"_window_{key}"
+        visible = st.session_state.get(state_key, page_size)
+        if not isinstance(visible, int):
+            visible = page_size
+
+        start = max(0, total - visible)
+        if start > 0:
+            def _show_more():
+                st.session_state[state_key] = visible + page_size
+
+            st.button(
+                f"⬆️ 以前の{min(page_size, start)}件を表示（非表示 {start} 件）",
+                key=f"more_{key}",
+                on_click=_show_more
+            )
+        return start
+
+    @staticmethod
+    def display_messages(messages: List[EasyInputMessageParam], show_system: bool = False,
+                         key: str = "messages", page_size: int = None):
+        """メッセージ履歴の表示（直近ページのみ描画）"""
         if not messages:
             st.info("メッセージがありません")
             return
 
-        for i, msg in enumerate(messages):
+        start = UIHelper.paginate_window(len(messages), key, page_size)
+        for msg in messages[start:]:
             role = msg.get("role", "")
             content = msg.get("content", "")
 
@@ -408,11 +708,11 @@ class UIHelper:
                                 if image_url:
                                     st.image(image_url, caption="アップロード画像")
                     else:
-                        st.markdown(content)
+                        st.markdown(_render_markdown(role, content))
 
             elif role == "assistant":
                 with st.chat_message("assistant", avatar="🤖"):
-                    st.markdown(content)
+                    st.markdown(_render_markdown(role, content))
 
             elif (role == "developer" or role == "system") and show_system:
                 # with st.expander(f"🔧 {role.capitalize()} Message", expanded=False):
@@ -420,15 +720,23 @@ class UIHelper:
                 # this function is called inside another expander.
                 with st.container():
                     st.markdown(f"**🔧 {role.capitalize()} Message**")
-                    st.markdown(f"*{content}*")
+                    st.markdown(_render_markdown(role, content))
 
     @staticmethod
-    def show_token_info(text: str, model: str = None, position: str = "sidebar"):
-        """トークン情報の表示（拡張版）"""
+    def show_token_info(text: Union[str, List[Any]], model: str = None, position: str = "sidebar"):
+        """トークン情報の表示（拡張版）
+
+        text にメッセージリストを渡すと、画像入力（input_image）も含めて見積もる。
+        """
         if not text:
             return
 
-        token_count = TokenManager.count_tokens(text, model)
+        breakdown = None
+        if isinstance(text, list):
+            breakdown = TokenManager.count_message_tokens(text, model)
+            token_count = breakdown["total"]
+        else:
+            token_count = TokenManager.count_tokens(text, model)
         limits = TokenManager.get_model_limits(model)
 
         # 表示位置の選択
@@ -442,8 +750,14 @@ class UIHelper:
                 usage_percent = (token_count / limits['max_tokens']) * 100
                 st.metric("使用率", f"{usage_percent:.1f}%")
 
+            if breakdown and breakdown["images"]:
+                note = f"（寸法不明 {breakdown['unknown_images']}枚は標準サイズで概算）" \
+                    if breakdown["unknown_images"] else ""
+                st.write(f"テキスト {breakdown['text']:,} + 画像{breakdown['images']}枚 "
+                         f"{breakdown['image']:,} トークン{note}")
+
             # コスト推定（仮定: 出力は入力の50%）
-            estimated_output = token_count // 2
+            estimated_output = (breakdown["text"] if breakdown else token_count) // 2
             cost = TokenManager.estimate_cost(token_count, estimated_output, model)
             st.metric("推定コスト", f"${cost:.6f}")
 
@@ -457,6 +771,39 @@ class UIHelper:
             elif usage_percent > 70:
                 st.info("ℹ️ トークン使用率が高めです")
 
+    @staticmethod
+    def show_image_preparation(prepared: PreparedImage, model: str = None):
+        """画像前処理の結果（送信サイズ・解像度・推定トークン）の表示"""
+        st.write("**🖼️ 送信画像**")
+        reduction = 1 - prepared.size / prepared.original_size if prepared.original_size else 0.0
+        st.metric("送信サイズ", f"{prepared.size / 1024:.1f} KB",
+                  delta=f"-{reduction:.0%}" if reduction > 0 else None, delta_color="inverse")
+        st.write(f"**元ファイル**: {prepared.original_size / 1024:.1f} KB")
+        st.write(f"**形式**: {prepared.mime_type} / detail={prepared.detail}")
+
+        if prepared.width is not None:
+            st.write(f"**解像度**: {prepared.original_width}×{prepared.original_height} → "
+                     f"{prepared.width}×{prepared.height}")
+            st.metric("推定画像トークン", f"{prepared.estimated_tokens(model):,}")
+
+    @staticmethod
+    def check_image_url(url: str) -> Optional[ImageURLInfo]:
+        """画像URLを送信前に確認し、結果を表示（使用できない場合は None）"""
+        with st.spinner("画像URLを確認中..."):
+            info = ImageURLProbe.probe(url)
+        UIHelper.show_image_url_info(info)
+        return info if info.ok else None
+
+    @staticmethod
+    def show_image_url_info(info: ImageURLInfo):
+        """画像URLの確認結果の表示"""
+        if not info.ok:
+            st.error(f"❌ 画像URLを使用できません: {info.error}")
+            return
+        size = f"{info.size / 1024:.1f} KB" if info.size is not None else "サイズ不明"
+        inline = " / Base64で埋め込み送信" if info.data_url else ""
+        st.write(f"✅ {info.content_type} / {info.width}×{info.height} / {size}{inline}")
+
     @staticmethod
     def create_tabs(tab_names: List[str], key: str = "tabs") -> List[Any]:
         """タブの作成"""
@@ -483,28 +830,57 @@ class UIHelper:
                 else:
                     st.metric(label, value)
 
+    @staticmethod
+    def _serialize_download(data: Any, mime_type: str) -> Tuple[Any, str]:
+        """ダウンロード用データのシリアライズ（dict/list は安全なJSON処理）"""
+        if isinstance(data, (dict, list)):
+            data = safe_json_dumps(data)
+            if mime_type == "text/plain":
+                mime_type = "application/json"
+        return data, mime_type
+
     @staticmethod
     def create_download_button(
             data: Any,
             filename: str,
             mime_type: str = "text/plain",
             label: str = "ダウンロード",
-            help: str = None
+            help: str = None,
+            cache_key: str = None
     ):
-        """ダウンロードボタンの作成（安全なJSON処理対応）"""
+        """
+        ダウンロードボタンの作成（安全なJSON処理対応）
+
+        data に callable を渡すと遅延モードになり、「準備」ボタンが押されるまで
+        生成・シリアライズを行わない（再実行後も表示され続けるページ向け）。
+        cache_key を指定した場合はシリアライズ結果をセッション単位でメモ化し、
+        再実行時に再シリアライズしない。
+        """
         try:
-            if isinstance(data, (dict, list)):
-                # 安全なJSONシリアライゼーションを使用
-                data = safe_json_dumps(data)
-                if mime_type == "text/plain":
-                    mime_type = "application/json"
+            lazy = callable(data)
+            payload_key = None
+            if cache_key:
+                payload_key = f"{_session_cache_namespace()}download:{cache_key}"
+            widget_key = sanitize_key(cache_key or filename)
+
+            cached = get_shared_ui_cache().get(payload_key) if payload_key else (False, None)
+            if cached[0]:
+                payload, mime_type = cached[1]
+            elif lazy and not st.button(f"⚙️ {label}を準備", key=f"prepare_{widget_key}"):
+                return
+            else:
+                payload, mime_type = UIHelper._serialize_download(data() if lazy else data, mime_type)
+                if payload_key:
+                    get_shared_ui_cache().set(payload_key, (payload, mime_type))
 
             st.download_button(
                 label=label,
-                data=data,
+                data=payload,
                 file_name=filename,
                 mime=mime_type,
-                help=help or f"{filename}をダウンロードします"
+                help=help or f"{filename}をダウンロードします",
+                key=f"download_{widget_key}" if cache_key else None,
+                on_click="ignore"  # ダウンロード時にスクリプト全体を再実行しない
             )
         except Exception as e:
             st.error(f"ダウンロードボタン作成エラー: {e}")
@@ -560,27 +936,27 @@ class UIHelper:
 
         with st.expander("📈 パフォーマンス情報", expanded=False):
             # 最近の実行時間
-            recent_metrics = metrics[-10:]
-            avg_time = sum(m['execution_time'] for m in recent_metrics) / len(recent_metrics)
-            max_time = max(m['execution_time'] for m in recent_metrics)
-            min_time = min(m['execution_time'] for m in recent_metrics)
+            recent = metrics.summary(10)
 
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("平均実行時間", f"{avg_time:.2f}s")
+                st.metric("平均実行時間", f"{recent['mean']:.2f}s")
             with col2:
-                st.metric("最大実行時間", f"{max_time:.2f}s")
+                st.metric("最大実行時間", f"{recent['max']:.2f}s")
             with col3:
-                st.metric("最小実行時間", f"{min_time:.2f}s")
+                st.metric("最小実行時間", f"{recent['min']:.2f}s")
+
+            window = metrics.summary()
+            st.caption(
+                f"累計 {metrics.count} 回 / 平均 {metrics.mean:.2f}s / "
+                f"p50 {window['p50']:.2f}s / p95 {window['p95']:.2f}s "
+                f"(直近 {window['count']} 件, 容量 {metrics.capacity})"
+            )
 
             # 実行時間の推移
             if len(metrics) > 1:
                 try:
-                    import pandas as pd
-                    df = pd.DataFrame(metrics)
-                    st.line_chart(df.set_index('timestamp')['execution_time'])
-                except ImportError:
-                    st.info("pandas が必要です：pip install pandas")
+                    st.line_chart(metrics.times())
                 except Exception as e:
                     st.error(f"チャート表示エラー: {e}")
 
@@ -663,13 +1039,15 @@ class ResponseProcessorUI(ResponseProcessor):
                         st.write("**Raw JSON**")
                         safe_streamlit_json(formatted)
 
-                    # ダウンロードボタン
+                    # ダウンロードボタン（シリアライズ結果はレスポンスIDでメモ化）
                     try:
+                        response_id = formatted.get('id')
                         UIHelper.create_download_button(
                             formatted,
                             f"response_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
                             "application/json",
-                            "📥 JSONダウンロード"
+                            "📥 JSONダウンロード",
+                            cache_key=f"response_{response_id}" if response_id else None
                         )
                     except Exception as e:
                         st.error(f"ダウンロードボタン作成エラー: {e}")
@@ -719,7 +1097,7 @@ class DemoBase(ABC):
     def display_messages(self):
         """メッセージの表示"""
         messages = self.message_manager.get_messages()
-        UIHelper.display_messages(messages)
+        UIHelper.display_messages(messages, key=f"messages_{self.key_prefix}")
 
     def add_user_message(self, content: str):
         """ユーザーメッセージの追加"""
@@ -747,6 +1125,84 @@ class DemoBase(ABC):
         return response
 
 
+# ==================================================
+# デモレジストリ（遅延生成）
+# ==================================================
+class DemoRegistry:
+    """
+    デモの遅延レジストリ
+
+    デモ名とファクトリ（クラス＋引数）だけを登録し、選択されたデモのみを生成する。
+    生成済みインスタンスはセッション状態に保持し、再実行（rerun）をまたいで再利用する。
+    デモは会話履歴などセッション固有の状態を持つため、プロセス共有の
+    st.cache_resource ではなくセッション単位のキャッシュとしている。
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._state_key = f"_demo_instances_{sanitize_key(namespace)}"
+        self._factories: Dict[str, Callable[[], Any]] = {}
+
+    def register(self, name: str, factory: Callable[..., Any], *args, **kwargs) -> "DemoRegistry":
+        """デモファクトリの登録（生成は get() 時まで遅延）"""
+        self._factories[name] = lambda: factory(*args, **kwargs)
+        return self
+
+    def keys(self) -> List[str]:
+        """登録済みデモ名（登録順）"""
+        return list(self._factories.keys())
+
+    def __len__(self) -> int:
+        return len(self._factories)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._factories
+
+    def __iter__(self):
+        return iter(self._factories)
+
+    def _instances(self) -> Dict[str, Any]:
+        """セッション単位のインスタンスキャッシュを取得"""
+        instances = st.session_state.get(self._state_key)
+        if not isinstance(instances, dict):
+            instances = {}
+            st.session_state[self._state_key] = instances
+        return instances
+
+    def get(self, name: str) -> Optional[Any]:
+        """デモインスタンスの取得（未生成なら生成してキャッシュ）"""
+        factory = self._factories.get(name)
+        if factory is None:
+            return None
+
+        instances = self._instances()
+        demo = instances.get(name)
+        if demo is None:
+            with startup_profiler.section(f"demo:{name}"):
+                demo = factory()
+            instances[name] = demo
+            logger.debug(f"Demo instantiated: {self.namespace}/{name}")
+        return demo
+
+    def __getitem__(self, name: str) -> Any:
+        demo = self.get(name)
+        if demo is None:
+            raise KeyError(name)
+        return demo
+
+    def instantiated(self) -> List[str]:
+        """生成済みデモ名の一覧"""
+        return [name for name in self._factories if name in self._instances()]
+
+    def clear(self, name: Optional[str] = None):
+        """キャッシュ済みインスタンスの破棄（name 省略時は全て）"""
+        instances = self._instances()
+        if name is None:
+            instances.clear()
+        else:
+            instances.pop(name, None)
+
+
 # ==================================================
 # 後方互換性のための関数
 # ==================================================
@@ -792,6 +1248,39 @@ def append_user_message(append_text: str, image_url: Optional[str] = None) -> Li
         messages.append(EasyInputMessageParam(role="user", content=append_text))
     return messages
 
+# ==================================================
+# 情報パネル用フラグメント
+# ==================================================
+def sidebar_fragment(func):
+    """
+    サイドバーのパネルを st.fragment として描画するデコレータ
+
+    フラグメント内のウィジェット操作ではそのパネルだけが再実行され、
+    メインのデモ本体や他のパネルは再実行されない。
+    フラグメントは自身のコンテナにしか書き込めないため、st.sidebar 内で呼び出す。
+    Streamlit ランタイム外（bare mode・テスト）では通常の関数として実行する。
+    """
+    fragment = st.fragment(func) if hasattr(st, "fragment") else func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with st.sidebar:
+            if not st.runtime.exists():
+                return func(*args, **kwargs)
+            return fragment(*args, **kwargs)
+
+    return wrapper
+
+
+@lru_cache(maxsize=256)
+def _simulate_cost(model: str, input_tokens: int, output_tokens: int) -> Tuple[float, float]:
+    """料金シミュレーターの計算（入力・出力コスト）"""
+    pricing = model_registry.get_pricing(model) or {}
+    input_cost = (input_tokens / 1000) * pricing.get("input", 0)
+    output_cost = (output_tokens / 1000) * pricing.get("output", 0)
+    return input_cost, output_cost
+
+
 # ==================================================
 # 情報パネル表示クラス
 # ==================================================
@@ -799,12 +1288,14 @@ class InfoPanelManager:
     """左ペインの情報パネル管理"""
 
     @staticmethod
+    @sidebar_fragment
     def show_model_info(selected_model: str):
         """モデル情報パネル"""
-        with st.sidebar.expander("📊 モデル情報", expanded=False):
-            # 基本情報
-            limits = TokenManager.get_model_limits(selected_model)
-            pricing = config.get("model_pricing", {}).get(selected_model, {})
+        with st.expander("📊 モデル情報", expanded=False):
+            # 基本情報（model_registryで事前計算済み）
+            info = model_registry.get(selected_model)
+            limits = info.limits
+            pricing = info.pricing or {}
 
             col1, col2 = st.columns(2)
             with col1:
@@ -819,17 +1310,18 @@ class InfoPanelManager:
                 st.write(f"- 出力: ${pricing.get('output', 0):.5f}")
 
             # モデル特性
-            if selected_model.startswith("o"):
+            if info.in_category("reasoning"):
                 st.info("🧠 推論特化モデル")
-            elif "audio" in selected_model:
+            elif info.supports_audio:
                 st.info("🎵 音声対応モデル")
-            elif "gpt-4o" in selected_model:
+            elif info.supports_vision:
                 st.info("👁️ 視覚対応モデル")
 
     @staticmethod
+    @sidebar_fragment
     def show_session_info():
         """セッション情報パネル"""
-        with st.sidebar.expander("📋 セッション情報", expanded=False):
+        with st.expander("📋 セッション情報", expanded=False):
             # セッション変数の統計
             st.write("**アクティブセッション**")
 
@@ -852,11 +1344,20 @@ class InfoPanelManager:
                 if len(message_counts) > 3:
                     st.write(f"... 他 {len(message_counts) - 3} 個")
 
+            # デモ結果のメモリ使用量（SessionMemoryManager管理分）
+            footprint = SessionMemoryManager.footprint()
+            if footprint["groups"]:
+                st.write(
+                    "**保存済み結果**",
+                    f"{footprint['total_bytes'] / 1024:.1f} KB / {footprint['budget_bytes'] / 1024 / 1024:.0f} MB"
+                )
+
     @staticmethod
+    @sidebar_fragment
     def show_cost_info(selected_model: str):
         """料金情報パネル"""
-        with st.sidebar.expander("💰 料金計算", expanded=False):
-            pricing = config.get("model_pricing", {}).get(selected_model)
+        with st.expander("💰 料金計算", expanded=False):
+            pricing = model_registry.get_pricing(selected_model)
             if not pricing:
                 st.warning("料金情報が見つかりません")
                 return
@@ -879,9 +1380,8 @@ class InfoPanelManager:
                 key="cost_output_tokens"
             )
 
-            # コスト計算
-            input_cost = (input_tokens / 1000) * pricing["input"]
-            output_cost = (output_tokens / 1000) * pricing["output"]
+            # コスト計算（同一入力はメモ化済みの結果を再利用）
+            input_cost, output_cost = _simulate_cost(selected_model, input_tokens, output_tokens)
             total_cost = input_cost + output_cost
 
             col1, col2 = st.columns(2)
@@ -893,42 +1393,40 @@ class InfoPanelManager:
             st.write("**総コスト**", f"${total_cost:.6f}")
 
             # 月間推定
-            daily_calls = st.slider("1日の呼び出し回数", 1, 1000, 100)
+            daily_calls = st.slider("1日の呼び出し回数", 1, 1000, 100, key="cost_daily_calls")
             monthly_cost = total_cost * daily_calls * 30
             st.info(f"月間推定: ${monthly_cost:.2f}")
 
     @staticmethod
+    @sidebar_fragment
     def show_performance_info():
         """パフォーマンス情報パネル"""
         metrics = SessionStateManager.get_performance_metrics()
         if not metrics:
             return
 
-        with st.sidebar.expander("⚡ パフォーマンス", expanded=False):
-            recent_metrics = metrics[-5:]
-            if recent_metrics:
-                avg_time = sum(m['execution_time'] for m in recent_metrics) / len(recent_metrics)
-                max_time = max(m['execution_time'] for m in recent_metrics)
-                min_time = min(m['execution_time'] for m in recent_metrics)
-
+        with st.expander("⚡ パフォーマンス", expanded=False):
+            recent = metrics.summary(5)
+            if recent["count"]:
                 col1, col2 = st.columns(2)
                 with col1:
-                    st.write("平均", f"{avg_time:.2f}s")
-                    st.write("最大", f"{max_time:.2f}s")
+                    st.write("平均", f"{recent['mean']:.2f}s")
+                    st.write("最大", f"{recent['max']:.2f}s")
                 with col2:
-                    st.write("最小", f"{min_time:.2f}s")
-                    st.write("実行回数", len(metrics))
+                    st.write("最小", f"{recent['min']:.2f}s")
+                    st.write("実行回数", metrics.count)
 
-                latest = recent_metrics[-1]
+                latest = metrics.latest()
                 st.write(f"**最新実行**: {latest['function']} ({latest['execution_time']:.2f}s)")
 
     @staticmethod
+    @sidebar_fragment
     def show_debug_panel():
         """デバッグパネル"""
         if not config.get("experimental.debug_mode", False):
             return
 
-        with st.sidebar.expander("🐛 デバッグ情報", expanded=False):
+        with st.expander("🐛 デバッグ情報", expanded=False):
             st.write("**アクティブ設定**")
             debug_config = {
                 "default_model": config.get("models.default"),
@@ -951,14 +1449,50 @@ class InfoPanelManager:
                 logger.setLevel(getattr(logger, new_level))
 
             st.write(f"**キャッシュ**: {cache.size()} エントリ")
+            shared_stats = get_shared_ui_cache().stats()
+            st.write(
+                f"**共有UIキャッシュ**: {shared_stats['entries']} エントリ / "
+                f"{shared_stats['bytes'] / 1024:.1f} KB "
+                f"(上限 {shared_stats['max_bytes'] / 1024 / 1024:.0f} MB, "
+                f"ヒット率 {shared_stats['hit_rate']:.0%})"
+            )
+            image_stats = image_cache.stats()
+            st.write(
+                f"**画像キャッシュ**: {image_stats['entries']} エントリ / "
+                f"{image_stats['bytes'] / 1024:.1f} KB (ヒット率 {image_stats['hit_rate']:.0%})"
+            )
             if st.button("🗑️ キャッシュクリア"):
                 cache.clear()
+                image_cache.clear()
                 st.success("キャッシュをクリアしました")
 
+            InfoPanelManager._show_startup_profile()
+
     @staticmethod
+    def _show_startup_profile():
+        """起動プロファイル（import内訳・初回描画時間）"""
+        report = startup_profiler.report()
+
+        st.write("**起動プロファイル**")
+        first_render = report["first_render"]
+        if first_render is not None:
+            st.write(f"- 初回描画: `{first_render:.2f}s`")
+        else:
+            st.write("- 初回描画: 計測中")
+
+        for name, elapsed in report["sections"].items():
+            st.write(f"- 初期化 {name}: `{elapsed * 1000:.0f}ms`")
+
+        if report["imports"]:
+            st.write("**遅延import**")
+            for name, elapsed in sorted(report["imports"].items(), key=lambda x: -x[1]):
+                st.write(f"- {name}: `{elapsed * 1000:.0f}ms`")
+
+    @staticmethod
+    @sidebar_fragment
     def show_settings():
         """設定パネル"""
-        with st.sidebar.expander("⚙️ 設定", expanded=False):
+        with st.expander("⚙️ 設定", expanded=False):
             # デバッグモード
             debug_mode = st.checkbox(
                 "デバッグモード",
@@ -996,6 +1530,10 @@ class InfoPanelManager:
                 value=st.session_state.get('show_timestamps', True),
                 key="setting_timestamps"
             )
+            if show_timestamps != st.session_state.get('show_timestamps', True):
+                # メッセージ表示に影響するため、変更時のみアプリ全体を再実行
+                st.session_state.show_timestamps = show_timestamps
+                st.rerun()
             st.session_state.show_timestamps = show_timestamps
 
 
@@ -1008,12 +1546,17 @@ __all__ = [
     'MessageManagerUI',
     'ResponseProcessorUI',
     'DemoBase',
+    'DemoRegistry',
     'SessionStateManager',
+    'SessionMemoryManager',
+    'PerformanceMetrics',
 
     # デコレータ
     'error_handler_ui',
     'timer_ui',
     'cache_result_ui',
+    'sidebar_fragment',
+    'get_shared_ui_cache',
 
     # ユーティリティ
     'safe_streamlit_json',
@@ -71,6 +71,153 @@ class TestCommonUI:
         mock_sanitize_key.assert_called_once_with("Test Demo")
         mock_ui_helper.select_model.assert_called_once_with("model_test_demo")
 
+    def test_cache_result_ui_shared_and_per_session(self):
+        """共有キャッシュはセッション間で再利用され、per_session指定時は分離される"""
+        from helper_st import cache_result_ui, get_shared_ui_cache
+
+        calls = []
+
+        @cache_result_ui()
+        def shared_func(x):
+            calls.append(("shared", x))
+            return x * 2
+
+        @cache_result_ui(per_session=True)
+        def private_func(x):
+            calls.append(("private", x))
+            return x * 3
+
+        class _SessionState(dict):
+            __getattr__ = dict.__getitem__
+            __setattr__ = dict.__setitem__
+
+        with patch('streamlit.session_state', _SessionState()):
+            assert shared_func(2) == 4
+            assert private_func(2) == 6
+        with patch('streamlit.session_state', _SessionState()):
+            assert shared_func(2) == 4
+            assert private_func(2) == 6
+
+        # 共有分は1回、セッション分離分はセッションごとに実行
+        assert calls == [("shared", 2), ("private", 2), ("private", 2)]
+        assert get_shared_ui_cache().stats()["entries"] == 3
+
+    def test_shared_cache_lru_byte_budget(self):
+        """SharedCacheがエントリ数・バイト数の上限でLRU順に追い出す"""
+        from helper_api import SharedCache
+
+        shared_cache = SharedCache(max_size=3, max_bytes=10_000, ttl=60)
+        shared_cache.set("a", "x")
+        shared_cache.set("b", "y")
+        shared_cache.set("c", "z")
+        assert shared_cache.get("a") == (True, "x")  # a を最近使用に
+
+        shared_cache.set("d", "w")
+        assert shared_cache.get("b") == (False, None)
+        assert shared_cache.get("a") == (True, "x")
+
+        # バイト上限による追い出し（big2 を入れると big が追い出される）
+        shared_cache.set("big", "0" * 9_000)
+        shared_cache.set("big2", "1" * 9_000)
+        stats = shared_cache.stats()
+        assert stats["bytes"] <= 10_000
+        assert shared_cache.get("big") == (False, None)
+        assert shared_cache.get("big2")[0] is True
+
+        shared_cache.set("too_big", "0" * 20_000)
+        assert shared_cache.get("too_big") == (False, None)
+
+    def test_performance_metrics_ring_buffer(self):
+        """PerformanceMetricsが容量を超えても直近分のみ保持し、累計集計を維持する"""
+        from helper_st import PerformanceMetrics
+
+        metrics = PerformanceMetrics(capacity=4)
+        for i in range(1, 7):
+            metrics.record("func_a" if i % 2 else "func_b", float(i))
+
+        assert len(metrics) == 4
+        assert metrics.times() == [3.0, 4.0, 5.0, 6.0]
+        assert metrics.count == 6
+        assert metrics.mean == pytest.approx(3.5)
+        assert (metrics.min, metrics.max) == (1.0, 6.0)
+
+        summary = metrics.summary(2)
+        assert summary["count"] == 2
+        assert summary["mean"] == pytest.approx(5.5)
+        assert metrics.summary()["p50"] == pytest.approx(4.5)
+        assert metrics.latest()["function"] == "func_b"
+
+        metrics.clear()
+        assert len(metrics) == 0 and metrics.count == 0
+
+    @patch('streamlit.button')
+    def test_paginate_window(self, mock_button):
+        """履歴は直近ページのみ表示され、展開状態に応じて開始位置が変わる"""
+        from helper_st import UIHelper
+
+        with patch('streamlit.session_state', {}) as session_state:
+            assert UIHelper.paginate_window(50, key="hist", page_size=20) == 30
+            mock_button.assert_called_once()
+
+            # 「以前の○件を表示」のコールバックで表示件数が増える
+            mock_button.call_args.kwargs["on_click"]()
+            assert session_state["_window_hist"] == 40
+            assert UIHelper.paginate_window(50, key="hist", page_size=20) == 10
+
+        mock_button.reset_mock()
+        with patch('streamlit.session_state', {}):
+            assert UIHelper.paginate_window(5, key="hist", page_size=20) == 0
+            mock_button.assert_not_called()
+
+    @patch('streamlit.download_button')
+    def test_create_download_button_lazy_and_memoized(self, mock_download):
+        """ダウンロードデータは要求時のみ生成され、cache_key指定時はメモ化される"""
+        from helper_st import UIHelper
+
+        with patch('streamlit.session_state', {}), \
+             patch('helper_st.safe_json_dumps', return_value='{"a": 1}') as mock_dumps:
+            # cache_key 指定: 2回目の再実行ではシリアライズしない
+            for _ in range(2):
+                UIHelper.create_download_button({"a": 1}, "r.json", cache_key="resp_1")
+            mock_dumps.assert_called_once()
+            assert mock_download.call_count == 2
+            assert mock_download.call_args.kwargs["mime"] == "application/json"
+
+            # callable: 「準備」ボタンが押されるまで生成しない
+            factory = MagicMock(return_value={"b": 2})
+            mock_download.reset_mock()
+            with patch('streamlit.button', return_value=False):
+                UIHelper.create_download_button(factory, "lazy.json")
+            factory.assert_not_called()
+            mock_download.assert_not_called()
+
+            with patch('streamlit.button', return_value=True):
+                UIHelper.create_download_button(factory, "lazy.json")
+            factory.assert_called_once()
+            mock_download.assert_called_once()
+
+    def test_sidebar_fragment_runs_outside_runtime(self):
+        """ランタイム外ではフラグメント化したパネルが通常関数として実行される"""
+        from helper_st import sidebar_fragment, _simulate_cost
+
+        calls = []
+
+        @sidebar_fragment
+        def panel(model):
+            calls.append(model)
+            return model
+
+        assert panel("gpt-4o-mini") == "gpt-4o-mini"
+        assert calls == ["gpt-4o-mini"]
+
+        with patch('helper_st.model_registry') as mock_registry:
+            mock_registry.get_pricing.return_value = {"input": 0.01, "output": 0.03}
+            _simulate_cost.cache_clear()
+            assert _simulate_cost("test-model", 1000, 2000) == pytest.approx((0.01, 0.06))
+            _simulate_cost("test-model", 1000, 2000)
+            mock_registry.get_pricing.assert_called_once()
+            _simulate_cost.cache_clear()
+
 
 class TestBaseDemoClass:
     """BaseDemoクラスのテスト"""
@@ -413,38 +560,152 @@ class TestWeatherDemo:
                 mock_write.assert_called()
                 mock_header.assert_called()
     
-    @patch('requests.get')
     @patch('os.getenv')
-    def test_get_current_weather(self, mock_getenv, mock_requests_get, demo_instance):
+    def test_get_current_weather(self, mock_getenv, demo_instance):
         """_get_current_weatherメソッドのテスト"""
+        import requests_mock
+        from helper_api import weather_cache
+        
         # 環境変数のモック
         mock_getenv.return_value = "test_api_key"
+        weather_cache.clear()
         
-        # APIレスポンスのモック
-        mock_response = MagicMock()
-        mock_response.json.return_value = {
-            "weather": [{"main": "Clear", "description": "clear sky"}],
-            "main": {"temp": 20.5, "humidity": 65, "pressure": 1013},
-            "wind": {"speed": 3.5, "deg": 180},
-            "name": "Tokyo"
-        }
-        mock_response.raise_for_status = MagicMock()
-        mock_requests_get.return_value = mock_response
-        
-        # メソッドを実行
-        result = demo_instance._get_current_weather(35.6762, 139.6503, "Tokyo")
+        with requests_mock.Mocker() as mocker:
+            mocker.get("https://api.openweathermap.org/data/2.5/weather", json={
+                "weather": [{"main": "Clear", "description": "clear sky"}],
+                "main": {"temp": 20.5, "humidity": 65, "pressure": 1013},
+                "wind": {"speed": 3.5, "deg": 180},
+                "coord": {"lat": 35.68, "lon": 139.65},
+                "name": "Tokyo"
+            })
+            
+            # メソッドを実行
+            result = demo_instance._get_current_weather(35.6762, 139.6503)
+            
+            # アサーション
+            assert result["city"] == "Tokyo"
+            assert result["temperature"] == 20.5
+            assert result["humidity"] == 65
+            
+            # API呼び出しの確認（共有セッション・タイムアウト付き）
+            assert mocker.call_count == 1
+            request = mocker.request_history[0]
+            assert "api.openweathermap.org" in request.url
+            assert request.qs["appid"] == ["test_api_key"]
+            assert request.timeout
+            
+            # 同じ地点の再取得はキャッシュから
+            assert demo_instance._get_current_weather(35.6762, 139.6503) == result
+            assert mocker.call_count == 1
+    
+    def test_weather_client_fetches_concurrently(self):
+        """現在の天気と予報は並列に取得され、失敗はキャッシュされない"""
+        import threading
+        import requests_mock
+        from helper_api import SharedCache, WeatherClient
         
-        # アサーション
-        if result:  # resultがNoneでない場合のみチェック
-            assert "Tokyo" in result
-            assert "Clear" in result
-            assert "20.5" in result or "21" in result  # 四捨五入の可能性
-            assert "65%" in result
+        client = WeatherClient(base_url="https://weather.example/data/2.5", cache=SharedCache(ttl=60))
+        barrier = threading.Barrier(2, timeout=5)
+        
+        def respond(request, context):
+            # 2リクエストが同時に到達しなければタイムアウトする
+            barrier.wait()
+            return {"endpoint": request.path.rsplit("/", 1)[-1]}
+        
+        with requests_mock.Mocker() as mocker:
+            mocker.get("https://weather.example/data/2.5/weather", json=respond)
+            mocker.get("https://weather.example/data/2.5/forecast", json=respond)
+            
+            legs = client.fetch_many(["weather", "forecast"], 35.68, 139.69)
+            assert legs["weather"].data == {"endpoint": "weather"}
+            assert legs["forecast"].data == {"endpoint": "forecast"}
+            assert not any(leg.cached for leg in legs.values())
+            
+            # 丸めた座標が同じなら通信しない
+            legs = client.fetch_many(["weather", "forecast"], 35.6801, 139.6899)
+            assert all(leg.cached for leg in legs.values())
+            assert mocker.call_count == 2
+            
+            mocker.get("https://weather.example/data/2.5/weather", status_code=500)
+            failed = client.fetch("weather", 34.69, 135.50)
+            assert not failed.ok and failed.error is not None
+            assert not client.cache.get(client.cache_key("weather", 34.69, 135.50, "metric", "ja"))[0]
+    
+    def test_city_table_cache_and_search(self, tmp_path):
+        """都市データは .npz にキャッシュされ、名前参照と前方一致・部分一致検索ができる"""
+        import numpy as np
+        from helper_api import CityTable, get_city_table
+        
+        json_path = tmp_path / "city_jp.list.json"
+        json_path.write_text(json.dumps([
+            {"id": i, "name": name, "coord": {"lat": 35.0 + i, "lon": 139.0 + i}}
+            for i, name in enumerate(["Tokyo", "Kyoto", "Higashi-Kyoto", "Osaka", "Tokyo", "Tokorozawa"])
+        ]), encoding="utf-8")
         
-        # API呼び出しの確認
-        mock_requests_get.assert_called_once()
-        call_args = mock_requests_get.call_args
-        assert "api.openweathermap.org" in call_args[0][0]
+        table = get_city_table(json_path)
+        assert (tmp_path / "city_jp.list.npz").exists()
+        assert table.lat.dtype == np.float32
+        assert table.unique_names == ["Higashi-Kyoto", "Kyoto", "Osaka", "Tokorozawa", "Tokyo"]
+        
+        # 同名の都市はファイル内で先に出現した行
+        assert table.lookup("Tokyo") == ("Tokyo", 35.0, 139.0)
+        assert table.lookup("Nowhere") is None
+        
+        # 前方一致が先、部分一致が後
+        assert table.search("to") == ["Tokorozawa", "Tokyo", "Higashi-Kyoto", "Kyoto"]
+        assert table.search("KYO", limit=2) == ["Kyoto", "Higashi-Kyoto"]
+        assert table.search("") == table.unique_names
+        
+        # プロセス内では同じインスタンス、別プロセス相当ではJSONを解析せず .npz から復元
+        assert get_city_table(json_path) is table
+        with patch.object(CityTable, "from_json") as mock_from_json:
+            restored = CityTable.load(json_path)
+            mock_from_json.assert_not_called()
+        assert restored.unique_names == table.unique_names
+    
+    def test_city_table_spatial_search(self, tmp_path):
+        """グリッドで絞り込んだ半径検索・最近傍検索が全件計算と一致する"""
+        import numpy as np
+        from helper_api import CityTable, find_nearby_cities
+        
+        rng = np.random.default_rng(0)
+        lat, lon = rng.uniform(24, 46, 2000), rng.uniform(123, 146, 2000)
+        table = CityTable([f"city{i:04d}" for i in range(2000)], lat, lon, np.arange(2000))
+        
+        for q_lat, q_lon, radius in [(35.68, 139.69, 30), (43.0, 141.3, 120), (26.2, 127.7, 5), (0.0, 0.0, 100)]:
+            distances = table.distances_km(q_lat, q_lon)
+            expected = set(np.flatnonzero(distances <= radius).tolist())
+            assert {table.row(c["name"]) for c in table.within(q_lat, q_lon, radius)} == expected
+            
+            nearest = table.nearest(q_lat, q_lon, k=3)
+            assert [c["distance_km"] for c in nearest] == pytest.approx(np.sort(distances)[:3], abs=0.01)
+        
+        # ツール実装: JSON化できる dict を返し、データが無ければ error を返す
+        json_path = tmp_path / "city_jp.list.json"
+        json_path.write_text(json.dumps([
+            {"id": 1, "name": "Tokyo", "coord": {"lat": 35.6895, "lon": 139.69171}},
+            {"id": 2, "name": "Kawasaki", "coord": {"lat": 35.52056, "lon": 139.71722}},
+            {"id": 3, "name": "Osaka", "coord": {"lat": 34.69374, "lon": 135.50218}},
+        ]), encoding="utf-8")
+        result = find_nearby_cities(35.68, 139.69, radius_km=50, json_path=json_path)
+        assert [c["name"] for c in result["cities"]] == ["Tokyo", "Kawasaki"]
+        json.dumps(result)
+        assert "error" in find_nearby_cities(35.68, 139.69, json_path=tmp_path / "missing.json")
+    
+    def test_select_city_filters_with_search(self, demo_instance):
+        """絞り込み入力に一致する都市だけが選択肢になる"""
+        from helper_api import CityTable
+        
+        table = CityTable(["Tokyo", "Osaka", "Kyoto"], [35.68, 34.69, 35.01], [139.69, 135.50, 135.76], [1, 2, 3])
+        with patch('streamlit.subheader'), patch('streamlit.write'), \
+             patch('streamlit.text_input', return_value="ky"), \
+             patch('streamlit.selectbox', return_value="Kyoto") as mock_selectbox:
+            city, lat, lon = demo_instance._select_city(table)
+        
+        assert mock_selectbox.call_args[0][1] == ["Kyoto", "Tokyo"]
+        assert city == "Kyoto"
+        assert lat == pytest.approx(35.01, abs=1e-4)
+        assert lon == pytest.approx(135.76, abs=1e-4)
 
 
 class TestImageResponseDemo:
@@ -648,6 +909,175 @@ class TestMemoryResponseDemo:
                     # MagicMockの場合、output_text属性を確認
                     assert str(last_response) == "New response" or hasattr(last_response, 'output_text')
 
+    def test_process_conversation_step_chain_mode(self, demo_instance):
+        """サーバー側会話状態モードでは新しい質問のみ送信し、チェーン切れ時は全履歴送信に戻る"""
+        import httpx
+        from openai import NotFoundError
+
+        demo_instance.model = "gpt-4o-mini"
+        demo_instance.get_model = MagicMock(return_value="gpt-4o-mini")
+        demo_instance.conversation_steps = [{
+            "user_input": "First message",
+            "assistant_response": "First response",
+            "timestamp": "2024-01-01 10:00:00",
+            "response_id": "resp_prev",
+        }]
+        mock_response = MagicMock(id="resp_new", output_text="New response")
+        demo_instance.call_api_unified = MagicMock(return_value=mock_response)
+        demo_instance._extract_usage_info = MagicMock(return_value={"total_tokens": 10})
+
+        session_state = {f"chain_mode_{demo_instance.safe_key}": True}
+        with patch('streamlit.session_state', session_state), \
+             patch('streamlit.success'), patch('streamlit.warning') as mock_warning, \
+             patch('streamlit.rerun'), patch('streamlit.subheader'), \
+             patch('a00_responses_api.ResponseProcessorUI'):
+
+            # チェーン有効: previous_response_id 付きで新しい質問のみ送信
+            demo_instance.client.create_response.return_value = mock_response
+            demo_instance._process_conversation_step("Second", temperature=0.3)
+
+            params = demo_instance.client.create_response.call_args.kwargs
+            assert params["previous_response_id"] == "resp_prev"
+            assert [m["content"] for m in params["input"]] == ["Second"]
+            demo_instance.call_api_unified.assert_not_called()
+            transport = demo_instance.conversation_steps[-1]["transport"]
+            assert transport["mode"] == "chain"
+            assert transport["sent_bytes"] < transport["replay_bytes"]
+            assert transport["sent_tokens"] < transport["replay_tokens"]
+
+            # チェーン切れ: 全履歴送信にフォールバック
+            not_found = NotFoundError(
+                "Previous response not found",
+                response=httpx.Response(404, request=httpx.Request("POST", "https://api.openai.com/v1/responses")),
+                body=None
+            )
+            demo_instance.client.create_response.side_effect = not_found
+            demo_instance._process_conversation_step("Third", temperature=0.3)
+
+            demo_instance.call_api_unified.assert_called_once()
+            mock_warning.assert_called_once()
+            assert demo_instance.conversation_steps[-1]["transport"]["mode"] == "replay"
+
+
+    def test_step_messages_stored_as_delta(self, demo_instance):
+        """ステップは差分のみ保持し、送信時のメッセージ履歴を再構築できる（旧形式も変換）"""
+        defaults = [
+            {"role": "developer", "content": "You are helpful."},
+            {"role": "user", "content": "Please help."},
+        ]
+        demo_instance.message_bases = {}
+        demo_instance.conversation_steps = []
+        demo_instance.call_api_unified = MagicMock(return_value=MagicMock(id=None, output_text="answer"))
+        demo_instance._extract_usage_info = MagicMock(return_value={"total_tokens": 10})
+
+        with patch('streamlit.session_state', {}), \
+             patch('streamlit.success'), patch('streamlit.rerun'), patch('streamlit.subheader'), \
+             patch('a00_responses_api.ResponseProcessorUI'), \
+             patch('a00_responses_api.get_default_messages', side_effect=lambda: [dict(m) for m in defaults]):
+            for query in ["Q1", "Q2", "Q3"]:
+                demo_instance._process_conversation_step(query, temperature=None)
+
+        sent = [dict(m) for m in demo_instance.call_api_unified.call_args_list[2][0][0]]
+        assert all('messages_at_step' not in step for step in demo_instance.conversation_steps)
+        assert len(demo_instance.message_bases) == 1
+        assert demo_instance.get_step_messages(2) == sent
+        assert [m["content"] for m in demo_instance.get_step_messages(0)] == [
+            "You are helpful.", "Please help.", "Q1"]
+
+        # 旧形式（messages_at_step 全保持）のインポートを差分へ変換して追加
+        legacy = {"conversation_steps": [
+            {"user_input": "L1", "assistant_response": "A1",
+             "messages_at_step": [{"role": "developer", "content": "Old"}, {"role": "user", "content": "L1"}]},
+            {"user_input": "L2", "assistant_response": "A2",
+             "messages_at_step": [{"role": "developer", "content": "Old"}, {"role": "user", "content": "L1"},
+                                  {"role": "assistant", "content": "A1"}, {"role": "user", "content": "L2"}]},
+        ]}
+        imported = demo_instance._normalize_imported_steps(legacy, offset=3)
+        demo_instance.conversation_steps.extend(imported)
+
+        assert all('messages_at_step' not in step for step in imported)
+        assert demo_instance.get_step_messages(4) == legacy["conversation_steps"][1]["messages_at_step"]
+        assert len(demo_instance.message_bases) == 2
+
+
+    def test_statistics_accumulated_per_step(self, demo_instance):
+        """統計はステップ追加ごとに実usage・モデル別料金で累積される"""
+        from a00_responses_api import TokenManager
+
+        demo_instance.model = "gpt-4o-mini"
+        demo_instance.conversation_steps = []
+        demo_instance.conversation_stats = demo_instance._empty_statistics()
+        steps = [
+            {"user_input": "abc", "assistant_response": "12345", "model": "gpt-4o-mini", "total_tokens": 150,
+             "usage": {"input_tokens": 100, "output_tokens": 50, "total_tokens": 150,
+                       "input_tokens_details": {"cached_tokens": 64},
+                       "output_tokens_details": {"reasoning_tokens": 0}}},
+            {"user_input": "a", "assistant_response": "xy", "model": "o3-mini", "total_tokens": 300,
+             "usage": {"input_tokens": 120, "output_tokens": 180, "total_tokens": 300,
+                       "input_tokens_details": {"cached_tokens": 0},
+                       "output_tokens_details": {"reasoning_tokens": 128}}},
+        ]
+        with patch('streamlit.session_state', {}):
+            for step in steps:
+                demo_instance.conversation_steps.append(step)
+                demo_instance._accumulate_statistics(step)
+
+        stats = demo_instance.conversation_stats
+        assert stats["steps"] == 2
+        assert (stats["input_tokens"], stats["output_tokens"]) == (220, 230)
+        assert (stats["cached_tokens"], stats["reasoning_tokens"]) == (64, 128)
+        assert stats["step_tokens"] == [150, 300]
+        assert (stats["min_question"], stats["max_question"]) == (1, 3)
+        expected = TokenManager.estimate_cost(100, 50, "gpt-4o-mini") + TokenManager.estimate_cost(120, 180, "o3-mini")
+        assert stats["cost"] == pytest.approx(expected)
+        assert set(stats["cost_by_model"]) == {"gpt-4o-mini", "o3-mini"}
+
+        # 再集計しても同じ結果になる
+        with patch('streamlit.session_state', {}):
+            demo_instance._rebuild_statistics()
+        assert demo_instance.conversation_stats["cost"] == pytest.approx(expected)
+        assert demo_instance.conversation_stats["total_tokens"] == 450
+
+
+    def test_ndjson_export_import_roundtrip(self, demo_instance):
+        """NDJSONは1行1レコードで書き出し、行単位で検証しながら読み込む（旧形式JSONも可）"""
+        import io
+        import json
+
+        demo_instance.model = "gpt-4o-mini"
+        demo_instance.message_bases = {}
+        base_id = demo_instance._register_base([{"role": "developer", "content": "Be brief."}])
+        demo_instance.conversation_steps = [
+            {"user_input": f"Q{i}", "assistant_response": f"A{i}", "context": {"base": base_id, "from": 0}}
+            for i in range(3)
+        ]
+        expected = [demo_instance.get_step_messages(i) for i in range(3)]
+
+        payload = demo_instance._serialize_conversation()
+        lines = payload.decode("utf-8").splitlines()
+        assert [json.loads(line)["type"] for line in lines] == ["header", "base", "step", "step", "step"]
+
+        # 不正な行を混ぜても該当行のみ読み飛ばす
+        uploaded = io.BytesIO(payload + b"{broken\n" + b'{"type": "step", "user_input": 1}\n')
+        header = demo_instance._read_import_header(uploaded)
+        assert header["total_steps"] == 3
+
+        demo_instance.message_bases = {}
+        errors = []
+        steps = demo_instance._load_import_steps(uploaded, header, offset=0, errors=errors)
+        demo_instance.conversation_steps = steps
+        assert len(steps) == 3 and len(errors) == 2
+        assert [demo_instance.get_step_messages(i) for i in range(3)] == expected
+
+        # 旧形式（単一JSONドキュメント）
+        legacy = io.BytesIO(json.dumps({"conversation_steps": [
+            {"user_input": "L1", "assistant_response": "R1",
+             "messages_at_step": [{"role": "user", "content": "L1"}]}
+        ]}, indent=2).encode("utf-8"))
+        assert demo_instance._read_import_header(legacy) is None
+        legacy_steps = demo_instance._load_import_steps(legacy, None, offset=3, errors=[])
+        assert legacy_steps[0]["context"]["from"] == 3
+
 
 class TestMainApp:
     """メインアプリケーションのテスト"""
@@ -170,6 +170,22 @@ class TestBaseDemoClass:
             assert demo.is_reasoning_model("gpt-4o-mini") == False
             assert demo.is_reasoning_model("gpt-4-turbo") == False
 
+    def test_model_registry_dated_variants(self):
+        """日付付きモデル名がプレフィックス一致で解決・メモ化されることのテスト"""
+        from helper_api import ModelRegistry
+
+        registry = ModelRegistry()
+
+        info = registry.get("gpt-4o-mini-2024-07-18")
+        assert info.name == "gpt-4o-mini-2024-07-18"
+        assert info.supports_temperature is True
+        assert info.supports_vision is True
+        assert info.limits == registry.get_limits("gpt-4o-mini")
+
+        assert registry.is_reasoning("o3-2025-04-16") is True
+        assert registry.supports_audio("gpt-4o-mini-tts") is True
+        assert registry.get("gpt-4o-mini-2024-07-18") is info
+
 
 class TestEventExtractionDemo:
     """EventExtractionDemoクラスのテスト"""
@@ -557,6 +573,30 @@ class TestDemoManager:
             mock_radio.assert_called_once()
             mock_demo_instance.run.assert_called_once()
 
+    @patch('a01_structured_outputs_parse_schema.ConfigManager')
+    def test_demo_manager_lazy_instantiation(self, mock_config):
+        """選択されたデモのみ生成され、再実行をまたいでキャッシュされることのテスト"""
+        from a01_structured_outputs_parse_schema import DemoManager
+
+        with patch('a01_structured_outputs_parse_schema.EventExtractionDemo') as mock_event_demo, \
+             patch('a01_structured_outputs_parse_schema.MathReasoningDemo') as mock_math_demo, \
+             patch('streamlit.session_state', {}):
+
+            manager = DemoManager()
+            mock_event_demo.assert_not_called()
+            mock_math_demo.assert_not_called()
+
+            demo = manager.demos.get("イベント情報抽出")
+            mock_event_demo.assert_called_once_with("イベント情報抽出")
+            mock_math_demo.assert_not_called()
+
+            # 再実行（DemoManager再生成）でも同一インスタンスを再利用
+            rerun_manager = DemoManager()
+            assert rerun_manager.demos.get("イベント情報抽出") is demo
+            mock_event_demo.assert_called_once()
+            assert rerun_manager.demos.instantiated() == ["イベント情報抽出"]
+            assert rerun_manager.demos.get("存在しないデモ") is None
+
 
 class TestErrorHandling:
     """エラーハンドリングのテスト"""
@@ -201,25 +201,53 @@ class TestBasicFunctionCallDemo:
         demo_instance._display_with_info.assert_called_once()
     
     @patch('os.getenv')
-    @patch('requests.get')
-    def test_fetch_weather_data(self, mock_requests_get, mock_getenv, demo_instance):
+    def test_fetch_weather_data(self, mock_getenv, demo_instance):
         """_fetch_weather_dataメソッドのテスト"""
+        import requests_mock
+        from helper_api import weather_cache
         
         mock_getenv.return_value = "test_api_key"
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {"weather": "sunny"}
-        mock_requests_get.return_value = mock_response
+        weather_cache.clear()
         
-        with patch('streamlit.write'), \
+        with requests_mock.Mocker() as mocker, \
+             patch('streamlit.write'), \
              patch('streamlit.expander'), \
-             patch('streamlit.json'):
+             patch('streamlit.json') as mock_json:
+            mocker.get("https://api.openweathermap.org/data/2.5/weather", json={"weather": "sunny"})
             
             coords = {"lat": 35.6895, "lon": 139.69171}
             demo_instance._fetch_weather_data("東京", coords)
             
-            mock_requests_get.assert_called_once()
-            assert "api.openweathermap.org" in mock_requests_get.call_args[0][0]
+            assert mocker.call_count == 1
+            assert "api.openweathermap.org" in mocker.request_history[0].url
+            assert mocker.request_history[0].timeout
+            mock_json.assert_called_once_with({"weather": "sunny"})
+    
+    def test_handle_function_calls_resolves_city_table(self, demo_instance):
+        """固定の座標表に無い都市は都市データから座標を引く"""
+        from helper_api import CityTable
+        from a02_responses_tools_pydantic_parse import WeatherRequest
+        
+        table = CityTable(["Sapporo", "Naha"], [43.06, 26.21], [141.35, 127.68], [1, 2])
+        function_call = MagicMock()
+        function_call.name = "WeatherRequest"
+        function_call.parsed_arguments = WeatherRequest(city="Sapporo", date="today")
+        response = MagicMock(output=[function_call])
+        demo_instance._fetch_weather_data = MagicMock()
+        
+        with patch('streamlit.write'), \
+             patch('a02_responses_tools_pydantic_parse.get_city_table', return_value=table):
+            demo_instance._handle_function_calls(response)
+            
+            city, coords = demo_instance._fetch_weather_data.call_args[0]
+            assert city == "Sapporo"
+            assert coords["lat"] == pytest.approx(43.06, abs=1e-4)
+            
+            # 該当しない都市では天気APIを呼ばない
+            demo_instance._fetch_weather_data.reset_mock()
+            function_call.parsed_arguments = WeatherRequest(city="Atlantis", date="today")
+            demo_instance._handle_function_calls(response)
+            demo_instance._fetch_weather_data.assert_not_called()
 
 
 class TestNestedStructureDemo:
@@ -198,6 +198,86 @@ class TestURLImageToTextDemo:
             mock_response_ui.display_response.assert_called_once_with(mock_response)
 
 
+    def test_run_image_batch_concurrent(self, demo_instance):
+        """バッチモードは上限付きワーカーで並列実行し、結果を入力順に返す"""
+        import threading
+
+        lock = threading.Lock()
+        state = {"active": 0, "peak": 0}
+
+        def create(model, input):
+            url = input[-1]["content"][1]["image_url"]
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.05 if url.endswith("0") else 0.01)
+            with lock:
+                state["active"] -= 1
+            if url.endswith("bad"):
+                raise RuntimeError("unreachable")
+            return MagicMock(output_text=f"answer {url}", usage=MagicMock(total_tokens=10))
+
+        demo_instance.client.responses.create.side_effect = create
+        images = [(f"img{i}", f"https://example.com/{i}", "auto") for i in range(6)]
+        images.append(("broken", "https://example.com/bad", "auto"))
+
+        with patch('a03_images_and_vision.config') as mock_config, \
+             patch('a03_images_and_vision.get_default_messages', return_value=[]), \
+             patch('a03_images_and_vision.ResponseProcessor.extract_text',
+                   side_effect=lambda r: [r.output_text]):
+            mock_config.get.side_effect = lambda key, default=None: 3 if key == "vision.batch_max_workers" else default
+            results = demo_instance._run_image_batch("describe", images)
+
+        assert [r["label"] for r in results] == [label for label, _, _ in images]
+        assert results[0]["text"] == "answer https://example.com/0"
+        assert isinstance(results[-1]["error"], RuntimeError)
+        assert sum(r["tokens"] for r in results) == 60
+        assert 1 < state["peak"] <= 3
+
+
+    def test_image_url_probe(self):
+        """画像URLはHEAD→Range GETで確認し、結果をキャッシュ、小さい画像は埋め込む"""
+        import io
+        import requests_mock
+        from PIL import Image
+        from helper_api import ImageURLProbe, TokenManager, image_url_cache
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (640, 480), "green").save(buffer, format="JPEG")
+        small = buffer.getvalue()
+        image_url_cache.clear()
+
+        with requests_mock.Mocker() as mocker:
+            mocker.head("https://example.com/small.jpg",
+                        headers={"Content-Type": "image/jpeg", "Content-Length": str(len(small)), "ETag": '"v1"'})
+            mocker.get("https://example.com/small.jpg", content=small, status_code=206,
+                       headers={"Content-Range": f"bytes 0-{len(small) - 1}/{len(small)}"})
+            mocker.head("https://example.com/missing.jpg", status_code=404)
+            mocker.head("https://example.com/page", headers={"Content-Type": "text/html"})
+
+            infos = ImageURLProbe.probe_many([
+                "https://example.com/small.jpg",
+                "https://example.com/missing.jpg",
+                "https://example.com/page",
+            ])
+            assert [info.ok for info in infos] == [True, False, False]
+            assert (infos[0].width, infos[0].height, infos[0].etag) == (640, 480, '"v1"')
+            assert infos[0].request_url.startswith("data:image/jpeg;base64,")
+            assert infos[1].error == "HTTP 404"
+            assert "text/html" in infos[2].error
+
+            request_count = mocker.call_count
+            assert ImageURLProbe.probe("https://example.com/small.jpg") is infos[0]
+            assert mocker.call_count == request_count
+            # GETは先頭のみ要求する
+            get_requests = [r for r in mocker.request_history if r.method == "GET"]
+            assert get_requests[0].headers["Range"].startswith("bytes=0-")
+
+        # 確認済みURLはトークン見積もりに寸法を使用
+        assert TokenManager.image_url_size("https://example.com/small.jpg") == (640, 480)
+        image_url_cache.clear()
+
+
 class TestBase64ImageToTextDemo:
     """Base64ImageToTextDemoクラスのテスト"""
     
@@ -262,6 +342,99 @@ class TestBase64ImageToTextDemo:
             mock_success.assert_called_once()
 
 
+    def test_prepare_image_downsizes_for_detail(self, demo_instance, tmp_path):
+        """前処理でdetailに応じた解像度へ縮小し、小さい形式・正しいMIMEで送信する"""
+        from PIL import Image
+        from helper_api import TokenManager
+
+        image_path = tmp_path / "large.png"
+        Image.effect_noise((3000, 2000), 40).convert("RGB").save(image_path, format="PNG")
+
+        prepared = demo_instance._prepare_image(str(image_path), detail="auto")
+        assert (prepared.original_width, prepared.original_height) == (3000, 2000)
+        assert (prepared.width, prepared.height) == (1152, 768)
+        assert prepared.size < prepared.original_size
+        assert prepared.mime_type in ("image/jpeg", "image/webp")
+        assert prepared.data_url.startswith(f"data:{prepared.mime_type};base64,")
+        assert prepared.estimated_tokens("gpt-4o") == 85 + 170 * 6
+
+        low = demo_instance._prepare_image(str(image_path), detail="low")
+        assert max(low.width, low.height) == 512
+        assert low.estimated_tokens("gpt-4o") == 85
+
+        # タイル方式の計算例（1024x1024, high → 4タイル）
+        assert TokenManager.estimate_image_tokens(1024, 1024, "high", "gpt-4o") == 765
+
+
+    def test_prepared_image_cache_and_directory_index(self, tmp_path):
+        """前処理結果は(パス,サイズ,更新時刻,パラメータ)でキャッシュし、一覧はフォルダ更新時のみ再走査"""
+        from PIL import Image
+        from helper_api import ImagePreprocessor, ImageDirectoryIndex, image_cache
+
+        image_cache.clear()
+        image_path = tmp_path / "photo.png"
+        Image.new("RGB", (1600, 1200), "red").save(image_path)
+
+        with patch.object(ImagePreprocessor, "prepare", wraps=ImagePreprocessor.prepare) as mock_prepare:
+            first = ImagePreprocessor.prepare_file(image_path, detail="high")
+            second = ImagePreprocessor.prepare_file(image_path, detail="high")
+            ImagePreprocessor.prepare_file(image_path, detail="low")
+            assert second is first
+            assert mock_prepare.call_count == 2
+
+            # ファイル更新で再処理
+            Image.new("RGB", (800, 600), "blue").save(image_path)
+            os.utime(image_path, ns=(time.time_ns(), time.time_ns() + 10**9))
+            assert ImagePreprocessor.prepare_file(image_path, detail="high").original_width == 800
+            assert mock_prepare.call_count == 3
+
+        index = ImageDirectoryIndex()
+        (tmp_path / "notes.txt").write_text("x")
+        with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+            assert index.files(tmp_path) == ["photo.png"]
+            assert index.files(tmp_path) == ["photo.png"]
+            assert mock_scandir.call_count == 1
+
+            Image.new("RGB", (10, 10)).save(tmp_path / "b.JPG", format="JPEG")
+            os.utime(tmp_path, ns=(time.time_ns(), time.time_ns() + 10**9))
+            assert index.files(tmp_path) == ["b.JPG", "photo.png"]
+            assert mock_scandir.call_count == 2
+        assert index.files(tmp_path / "missing") == []
+        image_cache.clear()
+
+
+    def test_message_token_estimate_includes_images(self):
+        """画像ヘッダーから寸法を読み、メッセージ合計に画像トークンを含める"""
+        import io
+        from PIL import Image
+        from helper_api import TokenManager
+
+        for fmt in ("PNG", "JPEG", "GIF", "WEBP"):
+            buffer = io.BytesIO()
+            Image.new("RGB", (1234, 567)).save(buffer, format=fmt)
+            assert TokenManager.read_image_size(buffer.getvalue()) == (1234, 567)
+        assert TokenManager.read_image_size(b"not an image") is None
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (2048, 1024)).save(buffer, format="JPEG")
+        data_url = "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+        messages = [
+            {"role": "developer", "content": "You are helpful."},
+            {"role": "user", "content": [
+                {"type": "input_text", "text": "describe"},
+                {"type": "input_image", "image_url": data_url, "detail": "high"},
+                {"type": "input_image", "image_url": "https://example.com/a.jpg", "detail": "low"},
+            ]},
+        ]
+        with patch.object(TokenManager, "count_tokens", return_value=3):
+            totals = TokenManager.count_message_tokens(messages, "gpt-4o")
+
+        # 2048x1024 → 1536x768 → 3x2タイル、low は固定
+        assert totals["image"] == (85 + 170 * 6) + 85
+        assert (totals["images"], totals["unknown_images"]) == (2, 1)
+        assert totals["total"] == totals["text"] + totals["image"] == 6 + totals["image"]
+
+
 class TestPromptToImageDemo:
     """PromptToImageDemoクラスのテスト"""
     
@@ -307,15 +480,22 @@ class TestPromptToImageDemo:
     @patch('streamlit.text_input')
     @patch('time.time')
     def test_generate_image_from_prompt(self, mock_time, mock_text_input, mock_image,
-                                       mock_columns, mock_success, mock_spinner, demo_instance):
+                                       mock_columns, mock_success, mock_spinner, demo_instance, tmp_path):
         """_generate_image_from_promptメソッドのテスト"""
         
+        import io
+        from PIL import Image
+        from helper_api import GeneratedImageStore
+        
         # 時間のモック
         mock_time.side_effect = [0, 3.5]
         
-        # DALL-E レスポンスのモック
+        # DALL-E レスポンスのモック（b64_jsonで受け取る）
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 64), "purple").save(buffer, format="PNG")
         mock_image_data = MagicMock()
-        mock_image_data.url = "https://example.com/generated.jpg"
+        mock_image_data.b64_json = base64.b64encode(buffer.getvalue()).decode()
+        mock_image_data.revised_prompt = None
         mock_response = MagicMock()
         mock_response.data = [mock_image_data]
         demo_instance.client.images.generate.return_value = mock_response
@@ -329,7 +509,8 @@ class TestPromptToImageDemo:
              patch('streamlit.write'), \
              patch('streamlit.metric'), \
              patch('streamlit.expander'), \
-             patch('streamlit.subheader'):
+             patch('streamlit.subheader'), \
+             patch('a03_images_and_vision.generated_image_store', GeneratedImageStore(tmp_path)):
             
             demo_instance._generate_image_from_prompt(
                 "dall-e-3", "Test prompt", "1024x1024", "standard"
@@ -340,10 +521,61 @@ class TestPromptToImageDemo:
                 prompt="Test prompt",
                 size="1024x1024",
                 quality="standard",
-                n=1
+                n=1,
+                response_format="b64_json"
             )
             mock_success.assert_called_once()
             mock_image.assert_called_once()
+    
+    def test_generate_image_variants_reuse_store(self, demo_instance, tmp_path):
+        """保存済みの画像は再生成せず、不足分のみ並列に生成する"""
+        import io
+        from PIL import Image
+        from helper_api import GeneratedImageStore
+        
+        counter = iter(range(1, 100))
+        
+        def encoded_image():
+            buffer = io.BytesIO()
+            Image.new("RGB", (32, 32), (next(counter), 0, 0)).save(buffer, format="PNG")
+            return base64.b64encode(buffer.getvalue()).decode()
+        
+        def generate(**kwargs):
+            return MagicMock(data=[MagicMock(b64_json=encoded_image(), revised_prompt="revised")
+                                   for _ in range(kwargs["n"])])
+        
+        demo_instance.client.images.generate.side_effect = generate
+        store = GeneratedImageStore(tmp_path)
+        
+        with patch('streamlit.session_state', {}), \
+             patch('streamlit.columns', side_effect=lambda spec: [MagicMock() for _ in range(spec if isinstance(spec, int) else len(spec))]), \
+             patch('streamlit.spinner'), \
+             patch('streamlit.success'), \
+             patch('streamlit.write'), \
+             patch('streamlit.metric'), \
+             patch('streamlit.expander'), \
+             patch('streamlit.subheader'), \
+             patch('a03_images_and_vision.generated_image_store', store):
+            
+            demo_instance._generate_image_from_prompt("dall-e-3", "A cat", "1024x1024", "standard", 2)
+            assert demo_instance.client.images.generate.call_count == 2
+            assert all(c.kwargs["n"] == 1 for c in demo_instance.client.images.generate.call_args_list)
+            
+            key = store.make_key("dall-e-3", "A cat", "1024x1024", "standard")
+            assert len(store.load(key)) == 2
+            
+            # 同じ条件で3枚を要求すると、不足の1枚だけ生成される
+            demo_instance._generate_image_from_prompt("dall-e-3", "A cat", "1024x1024", "standard", 3)
+            assert demo_instance.client.images.generate.call_count == 3
+            assert len(store.load(key)) == 3
+            
+            # dall-e-2 は n 指定の1リクエストでまとめて生成する
+            demo_instance.client.images.generate.reset_mock()
+            demo_instance._generate_image_from_prompt("dall-e-2", "A cat", "512x512", "standard", 2)
+            demo_instance.client.images.generate.assert_called_once()
+            assert demo_instance.client.images.generate.call_args.kwargs["n"] == 2
+            assert all(store.path(v).exists()
+                       for v in store.load(store.make_key("dall-e-2", "A cat", "512x512", "standard")))
 
 
 class TestImageEditDemo:
@@ -494,6 +494,52 @@ class TestConversationStateFeatures:
             assert len(tools) == 1
             assert tools[0]['type'] == 'web_search_preview'
 
+    def test_response_stored_as_snapshot_with_budget(self):
+        """Responseは軽量スナップショットで保存され、予算超過時はLRUのデモから削除される"""
+        from a05_conversation_state import StatefulConversationDemo
+        from helper_st import SessionMemoryManager, ResponseProcessorUI
+        from helper_api import ResponseSnapshot
+        from openai.types.responses import Response, ResponseOutputMessage, ResponseOutputText, ResponseUsage
+
+        response = Response.model_construct(
+            id="resp_123", model="gpt-4o-mini", created_at=1.0,
+            output=[ResponseOutputMessage.model_construct(
+                type="message", role="assistant", status="completed", id="msg_1",
+                content=[ResponseOutputText.model_construct(type="output_text", text="回答です", annotations=[])]
+            )],
+            usage=ResponseUsage.model_construct(input_tokens=10, output_tokens=5, total_tokens=15)
+        )
+
+        demo = StatefulConversationDemo("Test")
+        demo.model = "gpt-4o-mini"
+        demo.client = MagicMock()
+        demo.client.responses.create.return_value = response
+
+        with patch('streamlit.session_state', {}), \
+             patch('streamlit.spinner'), \
+             patch('streamlit.success'), \
+             patch('streamlit.rerun'), \
+             patch('a05_conversation_state.get_default_messages', return_value=[]):
+
+            demo._process_initial_question("質問")
+
+            stored = st.session_state[f"initial_response_{demo.safe_key}"]
+            assert isinstance(stored, ResponseSnapshot)
+            assert stored.id == "resp_123"
+            assert stored.usage.total_tokens == 15
+            assert ResponseProcessorUI.extract_text(stored) == ["回答です"]
+
+            # 予算超過: 最も使われていないデモ（other_demo）の状態が削除される
+            SessionMemoryManager.store("old_result", "x" * 1000, group="other_demo")
+            SessionMemoryManager.get(f"initial_response_{demo.safe_key}")
+            with patch.object(SessionMemoryManager, 'budget_bytes', return_value=1500):
+                SessionMemoryManager.store("new_result", "y" * 600, group="third_demo")
+
+            assert "old_result" not in st.session_state
+            assert f"initial_response_{demo.safe_key}" in st.session_state
+            assert "new_result" in st.session_state
+            assert set(SessionMemoryManager.footprint()["groups"]) == {demo.safe_key, "third_demo"}
+
 
 class TestIntegration:
     """統合テスト"""